@@ -0,0 +1,77 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+def retry_after(seconds: float) -> str:
+    # Retry-After i hele sekunder, minst 1
+    return str(max(1, int(math.ceil(seconds))))
+
+
+class Gate:
+    """Høyst `limit` samtidige forespørsler; opptil `queue` venter i inntil `timeout` sekunder, resten avvises.
+
+    Ventende forespørsler holder en arbeidstråd, så limit + queue bør ikke være større enn antall
+    arbeidstråder.
+    """
+
+    def __init__(self, limit: int, queue: int, timeout: float):
+        self.limit = max(1, int(limit))
+        self.queue = max(0, int(queue))
+        self.timeout = max(0.0, float(timeout))
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> bool:
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            if self.waiting >= self.queue:
+                return False
+            self.waiting += 1
+            try:
+                if not self._cond.wait_for(lambda: self.active < self.limit, self.timeout):
+                    return False
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class RateLimiter:
+    """Token bucket per klient: `burst` forespørsler på en gang, deretter `rate` per sekund.
+
+    Høyst `max_clients` bøtter holdes; den som er brukt minst nylig kastes først, og den er
+    sannsynligvis full igjen uansett.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.max_clients = max(1, int(max_clients))
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client: str) -> float:
+        """0 hvis forespørselen slipper gjennom, ellers sekunder til neste token."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""Ytelsesmåling: syntetiske data, last mot save_server.py og tid per steg i enrich_parks.py.
+
+Hver kjøring legges til som én JSON-linje i bench_results.jsonl (med commit), så kjøringer
+fra ulike commits kan sammenlignes med --compare.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+RESULTS_PATH = ROOT / 'bench_results.jsonl'
+
+# (navn, metode, sti); body lages per forespørsel av make_body
+SCENARIOS = {
+    'db': ('GET', '/db'),
+    'highscores': ('GET', '/highscores'),
+    'save-hints': ('POST', '/save-hints'),
+    'update': ('POST', '/update'),
+    'move': ('POST', '/move'),
+    'locate': ('POST', '/locate'),
+}
+# punkter per /locate-forespørsel
+LOCATE_BATCH = 1000
+# --flood: skrivinger som kjøres samtidig med lesingene i 'highscores'
+FLOOD = {
+    'save-db': ('POST', '/save-db'),
+    'post-highscores': ('POST', '/highscores'),
+}
+# avvist av opptakskontrollen i save_server.py; telles for seg og ikke som feil
+REJECTED_STATUS = (413, 429, 503)
+
+
+# -- syntetiske data ---------------------------------------------------
+
+def make_ring(rng, lon, lat, r, points):
+    # ujevn stjerneform rundt (lon, lat); lengdegrader strekkes så flaten blir omtrent rund
+    ring = []
+    for k in range(points):
+        a = 2 * math.pi * k / points
+        rr = r * rng.uniform(0.7, 1.0)
+        ring.append([round(lon + 2 * rr * math.cos(a), 5), round(lat + rr * math.sin(a), 5)])
+    ring.append(ring[0])
+    return ring
+
+
+def make_database(n, points, per_park, seed):
+    rng = random.Random(seed)
+    feats = []
+    for i in range(n):
+        park = i // per_park
+        lon, lat = rng.uniform(5.5, 30.0), rng.uniform(58.2, 70.8)
+        props = {
+            'id': i + 1,
+            'name': f'Park {park}',
+            'code': str(1000 + park),
+            'source': 'park',
+            'status': 'active',
+        }
+        feats.append({ 'type': 'Feature', 'properties': props,
+                       'geometry': { 'type': 'Polygon', 'coordinates': [make_ring(rng, lon, lat, rng.uniform(0.02, 0.25), points)] } })
+    return { 'dataset': { 'type': 'FeatureCollection', 'features': feats } }
+
+
+def make_hints(parks, per_park, seed):
+    rng = random.Random(seed)
+    out = {}
+    for park in range(parks):
+        hints = [f'Hint {k} om park {park}.' for k in range(per_park)]
+        if rng.random() < 0.5:
+            hints.append(f'Etablert i {rng.randint(1962, 2020)}.')
+        out[f'park{park}'] = { 'code': str(1000 + park), 'name': f'Park {park}', 'hints': hints }
+    return { 'parks': out }
+
+
+def make_highscores(players, seed):
+    rng = random.Random(seed)
+    return [{ 'name': f'Spiller {i}', 'score': rng.randint(0, 5000) } for i in range(players)]
+
+
+def write_dataset(data_dir: Path, args):
+    db = make_database(args.features, args.points, args.per_park, args.seed)
+    parks = (args.features + args.per_park - 1) // args.per_park
+    (data_dir / 'np_database.json').write_text(json.dumps(db, ensure_ascii=False, indent=2), encoding='utf-8')
+    (data_dir / 'park_hints.json').write_text(json.dumps(make_hints(parks, 5, args.seed), ensure_ascii=False, indent=2), encoding='utf-8')
+    (data_dir / 'highscores.json').write_text(json.dumps(make_highscores(args.players, args.seed), ensure_ascii=False), encoding='utf-8')
+    return parks
+
+
+# -- last mot serveren -------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(data_dir: Path, port: int, workers: int, log, processes: int = 0, backend: str = 'json'):
+    # processes > 0: gunicorn (wsgi.py) med så mange worker-prosesser; sqlite importerer JSON-filene ved oppstart
+    env = dict(os.environ, DATA_DIR=str(data_dir), HOST='127.0.0.1', PORT=str(port), WORKERS=str(workers),
+               WEB_CONCURRENCY=str(processes), STORE_BACKEND=backend, PYTHONUNBUFFERED='1')
+    if processes:
+        argv = ['gunicorn', '-c', str(ROOT / 'gunicorn.conf.py'), 'wsgi:app']
+    else:
+        argv = [sys.executable, str(ROOT / 'save_server.py')]
+    proc = subprocess.Popen(argv, cwd=str(ROOT), env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'save_server.py avsluttet med kode {proc.returncode}')
+        try:
+            c = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            c.request('GET', '/highscores')
+            c.getresponse().read()
+            c.close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('save_server.py svarte ikke')
+
+
+def make_body(name, rng, features, parks):
+    if name == 'save-hints':
+        park = rng.randrange(parks)
+        return { 'code': str(1000 + park), 'name': f'Park {park}', 'hints': [f'Hint {rng.random():.6f}'] }
+    if name == 'update':
+        return { 'id': rng.randint(1, features), 'props': { 'name': f'Park {rng.randrange(parks)}' } }
+    if name == 'move':
+        park = rng.randrange(parks)
+        return { 'id': rng.randint(1, features), 'to': { 'code': str(1000 + park), 'name': f'Park {park}' } }
+    if name == 'locate':
+        return { 'points': [[round(rng.uniform(57.9, 71.2), 5), round(rng.uniform(4.5, 31.0), 5)] for _ in range(LOCATE_BATCH)] }
+    if name == 'post-highscores':
+        return { 'name': f'Spammer {rng.randrange(10 ** 6)}', 'score': rng.randrange(10 ** 6) }
+    return None
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    i = min(len(sorted_values) - 1, max(0, int(math.ceil(q / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[i]
+
+
+def run_scenario(port, name, duration, concurrency, features, parks, seed, body=None):
+    # body: ferdig kodet body til alle forespørslene (f.eks. hele databasen for save-db)
+    method, path = SCENARIOS.get(name) or FLOOD[name]
+    latencies, errors, rejected, nbytes = [], [0], [0], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(k):
+        rng = random.Random(seed * 1000 + k)
+        conn = None
+        mine, err, rej, size = [], 0, 0, 0
+        while time.perf_counter() < stop_at:
+            data = body if body is not None else make_body(name, rng, features, parks)
+            data = json.dumps(data).encode('utf-8') if isinstance(data, dict) else data
+            headers = { 'Accept-Encoding': 'gzip' }
+            if data is not None:
+                headers['Content-Type'] = 'application/json'
+            t = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                conn.request(method, path, body=data, headers=headers)
+                r = conn.getresponse()
+                payload = r.read()
+                if r.status in REJECTED_STATUS:
+                    rej += 1
+                    continue
+                if r.status >= 400:
+                    err += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                err += 1
+                if conn is not None:
+                    conn.close()
+                conn = None
+                continue
+            mine.append(time.perf_counter() - t)
+            size += len(payload)
+        if conn is not None:
+            conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += err
+            rejected[0] += rej
+            nbytes[0] += size
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(k,)) for k in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rejected': rejected[0],
+        'rps': round(len(latencies) / elapsed, 1),
+        'bytesPerRequest': nbytes[0] // len(latencies) if latencies else 0,
+        'p50Ms': ms(percentile(latencies, 50)),
+        'p90Ms': ms(percentile(latencies, 90)),
+        'p99Ms': ms(percentile(latencies, 99)),
+        'maxMs': ms(latencies[-1] if latencies else None),
+    }
+
+
+def warm_up(port, name, features, parks):
+    method, path = SCENARIOS[name]
+    data = json.dumps(make_body(name, random.Random(0), features, parks)).encode('utf-8')
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        conn.request(method, path, body=data, headers={ 'Content-Type': 'application/json' })
+        conn.getresponse().read()
+    finally:
+        conn.close()
+
+
+def run_flood(port, data_dir: Path, args, parks):
+    """Lesinger (GET /highscores) alene, og så mens --flood klienter poster hele databasen og highscores."""
+    out = { 'reads-idle': run_scenario(port, 'highscores', args.duration, args.concurrency, args.features, parks, args.seed) }
+    db_body = (data_dir / 'np_database.json').read_bytes()
+    writers = { 'save-db': (max(1, args.flood // 2), db_body), 'post-highscores': (max(1, args.flood - args.flood // 2), None) }
+    results = {}
+
+    def writer(name):
+        n, body = writers[name]
+        results[name] = run_scenario(port, name, args.duration, n, args.features, parks, args.seed + 1, body)
+
+    threads = [threading.Thread(target=writer, args=(name,)) for name in writers]
+    for t in threads:
+        t.start()
+    out['reads-flood'] = run_scenario(port, 'highscores', args.duration, args.concurrency, args.features, parks, args.seed)
+    for t in threads:
+        t.join()
+    out.update(('flood-' + name, r) for name, r in results.items())
+    return out
+
+
+# -- berikelse ---------------------------------------------------------
+
+def store_files(data_dir: Path, backend: str):
+    if backend == 'sqlite':
+        return sorted(data_dir.glob('np_store.sqlite3*'))
+    return [data_dir / 'np_database.json']
+
+
+def run_enrich(data_dir: Path, workers: int, force: bool, backend: str = 'json'):
+    timings = data_dir / 'enrich_timings.json'
+    env = dict(os.environ, DATA_DIR=str(data_dir), STORE_BACKEND=backend)
+    argv = [sys.executable, str(ROOT / 'enrich_parks.py'), '--workers', str(workers), '--timings', str(timings)]
+    if force:
+        argv.append('--force')
+    t = time.perf_counter()
+    subprocess.run(argv, env=env, check=True, stdout=subprocess.DEVNULL)
+    total = time.perf_counter() - t
+    stages = json.loads(timings.read_text(encoding='utf-8'))
+    return { 'totalS': round(total, 4), 'stages': stages }
+
+
+# -- resultater --------------------------------------------------------
+
+def git_commit():
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return head + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path: Path):
+    if not path.exists():
+        return []
+    out = []
+    for line in path.read_text(encoding='utf-8').splitlines():
+        try:
+            out.append(json.loads(line))
+        except ValueError:
+            pass
+    return out
+
+
+def compare(prev, cur):
+    # endring i prosent per måling; for rps er høyere bedre, for tider lavere
+    def pct(a, b):
+        if not a or b is None:
+            return ''
+        return f'{(b - a) / a * 100:+.1f} %'
+    print(f"\nMot {prev.get('commit')} ({prev.get('time')}):")
+    for name, r in cur.get('server', {}).items():
+        p = prev.get('server', {}).get(name)
+        if p:
+            print(f"  {name:12s} rps {p['rps']:>9} -> {r['rps']:>9} {pct(p['rps'], r['rps']):>9}   "
+                  f"p50 {p['p50Ms']} -> {r['p50Ms']} ms {pct(p['p50Ms'], r['p50Ms']):>9}   "
+                  f"p99 {p['p99Ms']} -> {r['p99Ms']} ms {pct(p['p99Ms'], r['p99Ms']):>9}")
+    for run, r in cur.get('enrich', {}).items():
+        p = prev.get('enrich', {}).get(run)
+        if p:
+            print(f"  enrich {run:5s} {p['totalS']} -> {r['totalS']} s {pct(p['totalS'], r['totalS']):>9}")
+
+
+def print_report(res):
+    print(f"\n{res['params']['features']} features, {res['parks']} parker, {res['params']['concurrency']} klienter, "
+          f"{res['params']['duration']} s per scenario")
+    for name, r in res.get('server', {}).items():
+        print(f"  {name:12s} {r['rps']:>9} req/s  p50 {r['p50Ms']:>8} ms  p90 {r['p90Ms']:>8} ms  "
+              f"p99 {r['p99Ms']:>8} ms  max {r['maxMs']:>8} ms  {r['bytesPerRequest']:>9} B  feil {r['errors']}"
+              f"  avvist {r.get('rejected', 0)}")
+    for run, r in res.get('enrich', {}).items():
+        stages = '  '.join(f'{k} {v:.3f}' for k, v in r['stages'].items())
+        print(f"  enrich {run:5s} {r['totalS']:.3f} s  ({stages})")
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description='Mål save_server.py og enrich_parks.py på syntetiske data.')
+    ap.add_argument('--features', type=int, default=2000, help='antall park-polygoner (standard 2000)')
+    ap.add_argument('--points', type=int, default=40, help='punkter per polygon (standard 40)')
+    ap.add_argument('--per-park', type=int, default=2, help='polygoner per park (standard 2)')
+    ap.add_argument('--players', type=int, default=5000, help='spillere i topplisten (standard 5000)')
+    ap.add_argument('--duration', type=float, default=5.0, help='sekunder per scenario (standard 5)')
+    ap.add_argument('--concurrency', type=int, default=8, help='samtidige klienter (standard 8)')
+    ap.add_argument('--workers', type=int, default=8, help='WORKERS for serveren (standard 8)')
+    ap.add_argument('--gunicorn', type=int, default=0, metavar='N', help='kjør wsgi.py i gunicorn med N prosesser')
+    ap.add_argument('--backend', choices=('json', 'sqlite'), default='json', help='STORE_BACKEND for server og enrich (standard json)')
+    ap.add_argument('--scenarios', default=','.join(SCENARIOS), help='kommaseparert utvalg av ' + ', '.join(SCENARIOS))
+    ap.add_argument('--flood', type=int, default=0, metavar='N',
+                    help='mål også lesinger mens N klienter poster /save-db og /highscores (standard 0: av)')
+    ap.add_argument('--enrich-workers', type=int, default=1, help='--workers for enrich_parks.py (standard 1)')
+    ap.add_argument('--skip-server', action='store_true', help='ikke mål serveren')
+    ap.add_argument('--skip-enrich', action='store_true', help='ikke mål enrich_parks.py')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', default=str(RESULTS_PATH), help='JSON-lines-fil resultatet legges til i')
+    ap.add_argument('--compare', action='store_true', help='sammenlign med forrige kjøring med samme parametre i --out')
+    ap.add_argument('--keep', action='store_true', help='behold den midlertidige datakatalogen')
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        print(f"Ukjent scenario: {', '.join(unknown)}")
+        return 2
+    params = { k: getattr(args, k) for k in ('features', 'points', 'per_park', 'players', 'duration', 'concurrency',
+                                               'workers', 'gunicorn', 'backend', 'flood', 'enrich_workers', 'seed') }
+    params['scenarios'] = scenarios
+    data_dir = Path(tempfile.mkdtemp(prefix='np-bench-'))
+    res = {
+        'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'params': params,
+    }
+    try:
+        t = time.perf_counter()
+        res['parks'] = write_dataset(data_dir, args)
+        res['generateS'] = round(time.perf_counter() - t, 3)
+        print(f"Data i {data_dir} ({(data_dir / 'np_database.json').stat().st_size} bytes np_database.json)")
+
+        if not args.skip_server:
+            res['server'] = {}
+            port = free_port()
+            with open(data_dir / 'server.log', 'wb') as log:
+                proc = start_server(data_dir, port, args.workers, log, args.gunicorn, args.backend)
+                try:
+                    for name in scenarios:
+                        if name == 'locate':
+                            # rutenettene bygges ved første forespørsel; det skal ikke telle med
+                            warm_up(port, name, args.features, res['parks'])
+                        res['server'][name] = run_scenario(port, name, args.duration, args.concurrency,
+                                                           args.features, res['parks'], args.seed)
+                        print(f"  {name}: {res['server'][name]['rps']} req/s")
+                    if args.flood:
+                        res['server'].update(run_flood(port, data_dir, args, res['parks']))
+                finally:
+                    proc.terminate()
+                    try:
+                        proc.wait(timeout=30)
+                    except subprocess.TimeoutExpired:
+                        proc.kill()
+
+        if not args.skip_enrich:
+            # kald (uten cache) og varm (alt fra cache) kjøring på samme, ikke berikede data;
+            # serverens endringer er kompaktert til np_database.json ved avslutning
+            if args.backend == 'sqlite' and args.skip_server:
+                subprocess.run([sys.executable, str(ROOT / 'migrate_store.py'), 'import', '--data', str(data_dir)],
+                               check=True, stdout=subprocess.DEVNULL)
+            original = { p: p.read_bytes() for p in store_files(data_dir, args.backend) }
+            res['enrich'] = { 'cold': run_enrich(data_dir, args.enrich_workers, True, args.backend) }
+            for p in store_files(data_dir, args.backend):
+                p.unlink()
+            for p, data in original.items():
+                p.write_bytes(data)
+            res['enrich']['warm'] = run_enrich(data_dir, args.enrich_workers, False, args.backend)
+    finally:
+        if args.keep:
+            print(f"Beholdt {data_dir}")
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print_report(res)
+    out = Path(args.out)
+    previous = [r for r in load_results(out) if r.get('params') == params]
+    with open(out, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(res, ensure_ascii=False) + '\n')
+    print(f"\nLagt til i {out}")
+    if args.compare:
+        if previous:
+            compare(previous[-1], res)
+        else:
+            print('Ingen tidligere kjøring med samme parametre å sammenligne med.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
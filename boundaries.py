@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import struct
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from pyproj import Transformer
+
+from journal import atomic_write_bytes
+
+ROOT = Path(__file__).resolve().parent
+COUNTIES_PATH = ROOT / 'fylker2018.geojson'
+MUNICIP_PATH = ROOT / 'kommuner2018.geojson'
+CACHE_PATH = ROOT / 'boundaries.wgs84.bin'
+
+# Filformat: MAGIC, u32 header-lengde, JSON-header, deretter WKB-blobber etter hverandre.
+# Header: {"source": hash, "layers": {"counties": [[navn, offset, lengde], ...], "municipalities": [...]}}
+MAGIC = b'NPBND1\n'
+LAYERS = ('counties', 'municipalities')
+
+
+def get_name(props: Dict) -> str:
+    for k in ('n', 'N', 'navn', 'NAVN', 'fylkesnavn', 'kommunenavn', 'KOMNAVN', 'name'):
+        if k in props and props[k] is not None:
+            return str(props[k])
+    return ''
+
+
+# Bestem om fylke/kommune-data er i UTM 33 (EPSG:32633) og reprojiser til WGS84 ved behov
+def needs_utm33_to_wgs84(fc: dict) -> bool:
+    try:
+        crs_name = (((fc.get('crs') or {}).get('properties') or {}).get('name') or '').upper()
+        if 'EPSG::32633' in crs_name or 'EPSG:32633' in crs_name:
+            return True
+    except Exception:
+        pass
+    # Heuristikk: sjekk første koordinat for typiske UTM-verdier
+    try:
+        for f in (fc.get('features') or [])[:3]:
+            g = f.get('geometry') or {}
+            coords = g.get('coordinates')
+            if not coords:
+                continue
+            # finn et punkt dypt nok (første [x,y])
+            def first_xy(obj):
+                if isinstance(obj, (list, tuple)):
+                    if len(obj) >= 2 and isinstance(obj[0], (int, float)) and isinstance(obj[1], (int, float)):
+                        return obj[0], obj[1]
+                    for item in obj:
+                        res = first_xy(item)
+                        if res is not None:
+                            return res
+                return None
+            xy = first_xy(coords)
+            if xy:
+                x, y = xy
+                if abs(x) > 1000 or abs(y) > 1000:
+                    return True
+    except Exception:
+        pass
+    return False
+
+
+def source_version(paths=(COUNTIES_PATH, MUNICIP_PATH)) -> str:
+    # innholdshash av grensefilene
+    h = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+def utm33_to_wgs84(geoms: np.ndarray) -> np.ndarray:
+    # Alle koordinater i ett kall: shapely.transform gir en (N, 2)-matrise, pyproj regner vektorisert
+    transformer = Transformer.from_crs('EPSG:32633', 'EPSG:4326', always_xy=True)
+
+    def tx(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+
+    return shapely.transform(geoms, tx)
+
+
+def read_geojson_layer(path: Path) -> Tuple[List[str], np.ndarray]:
+    fc = json.loads(path.read_text(encoding='utf-8'))
+    names, geoms = [], []
+    for f in (fc.get('features') or []):
+        try:
+            g = shape(f.get('geometry'))
+        except Exception:
+            continue
+        names.append(get_name(f.get('properties') or {}))
+        geoms.append(g)
+    arr = np.array(geoms, dtype=object)
+    if needs_utm33_to_wgs84(fc) and len(arr):
+        arr = utm33_to_wgs84(arr)
+    return names, arr
+
+
+def build(cache_path: Path = CACHE_PATH, counties_path: Path = COUNTIES_PATH, municip_path: Path = MUNICIP_PATH):
+    header = { 'source': source_version((counties_path, municip_path)), 'layers': {} }
+    blobs = []
+    offset = 0
+    for layer, path in zip(LAYERS, (counties_path, municip_path)):
+        names, geoms = read_geojson_layer(path)
+        entries = []
+        for name, wkb in zip(names, shapely.to_wkb(geoms).tolist() if len(geoms) else []):
+            entries.append([name, offset, len(wkb)])
+            blobs.append(wkb)
+            offset += len(wkb)
+        header['layers'][layer] = entries
+    head = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    atomic_write_bytes(cache_path, MAGIC + struct.pack('<I', len(head)) + head + b''.join(blobs))
+
+
+def read_cache(cache_path: Path):
+    data = cache_path.read_bytes()
+    if not data.startswith(MAGIC):
+        raise ValueError('not a boundaries cache')
+    pos = len(MAGIC)
+    (n,) = struct.unpack_from('<I', data, pos)
+    pos += 4
+    header = json.loads(data[pos:pos + n].decode('utf-8'))
+    body = memoryview(data)[pos + n:]
+    layers = {}
+    for layer in LAYERS:
+        entries = header['layers'].get(layer) or []
+        wkbs = [bytes(body[off:off + ln]) for (_, off, ln) in entries]
+        geoms = shapely.from_wkb(wkbs) if wkbs else []
+        layers[layer] = [(name, g) for (name, _, _), g in zip(entries, geoms)]
+    return header.get('source'), layers
+
+
+def load_boundaries(cache_path: Path = CACHE_PATH, counties_path: Path = COUNTIES_PATH, municip_path: Path = MUNICIP_PATH):
+    """(fylker, kommuner) som lister av (navn, geometri) i WGS84; cachen bygges på nytt når kildene endres."""
+    version = source_version((counties_path, municip_path))
+    try:
+        source, layers = read_cache(cache_path)
+        if source == version:
+            return layers['counties'], layers['municipalities']
+    except (OSError, ValueError, KeyError, struct.error):
+        pass
+    build(cache_path, counties_path, municip_path)
+    _, layers = read_cache(cache_path)
+    return layers['counties'], layers['municipalities']
+
+
+if __name__ == '__main__':
+    build()
+    _, layers = read_cache(CACHE_PATH)
+    print(f"Skrev {CACHE_PATH.name}: {len(layers['counties'])} fylker, {len(layers['municipalities'])} kommuner ({CACHE_PATH.stat().st_size} bytes)")
+    sys.exit(0)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Bygg spilldataene for spill.html som én fil med innholdshash i navnet.
+
+Omrisset, park-featurene spillet bruker (source=park, ikke slettet eller skjult, slått sammen per park som
+i spill.html) og hintene for disse parkene skrives kompakt til bundle/game.<hash>.json. Komprimeringen
+overlates til verten (GitHub Pages gzipper JSON selv). build_version.json får en `bundle`-oppføring som peker på filen;
+spill.html henter bare den lille filen ved hvert besøk, og bundelen fra cache så lenge hashen er den samme.
+"""
+import argparse
+import hashlib
+import json
+import re
+import sys
+from pathlib import Path
+
+from journal import atomic_write_bytes, atomic_write_text
+
+ROOT = Path(__file__).resolve().parent
+DB_PATH = ROOT / 'np_database.json'
+HINTS_PATH = ROOT / 'park_hints.json'
+# samme rekkefølge som spill.html tidligere hentet, med fallback som i lod.py
+OUTLINE_PATHS = (ROOT / 'norway_outline_full.json', ROOT / 'norway_outline_wgs84.json')
+BUNDLE_DIR = ROOT / 'bundle'
+VERSION_PATH = ROOT / 'build_version.json'
+# øk når formatet endres slik at spill.html må lese det annerledes
+BUNDLE_FORMAT = 1
+
+
+def normalize_key(p: dict) -> str:
+    # som normalizeKey() i spill.html
+    return re.sub(r'[^a-z0-9æøå]', '', str(p.get('code') or p.get('name') or '').lower())
+
+
+def rounded(coords, digits: int):
+    if isinstance(coords, (list, tuple)):
+        return [rounded(c, digits) for c in coords]
+    if isinstance(coords, float):
+        return round(coords, digits)
+    return coords
+
+
+def round_geojson(obj, digits: int):
+    # koordinatene i en FeatureCollection, Feature eller geometri, på stedet
+    if isinstance(obj, dict):
+        if isinstance(obj.get('coordinates'), list):
+            obj['coordinates'] = rounded(obj['coordinates'], digits)
+        for k in ('features', 'geometries'):
+            for item in obj.get(k) or []:
+                round_geojson(item, digits)
+        round_geojson(obj.get('geometry'), digits)
+    return obj
+
+
+def game_parks(db: dict, digits: int) -> list:
+    """Én feature per park med alle flatene, i samme rekkefølge som spill.html slår dem sammen."""
+    groups = {}
+    for f in (db.get('dataset') or {}).get('features') or []:
+        p = (f or {}).get('properties') or {}
+        geom = (f or {}).get('geometry')
+        if not geom or p.get('source') != 'park' or p.get('status') == 'deleted' or p.get('display') == 'no':
+            continue
+        groups.setdefault(normalize_key(p), []).append(f)
+    out = []
+    for key, arr in groups.items():
+        polys = []
+        for f in arr:
+            geom = f['geometry']
+            if geom.get('type') == 'Polygon':
+                polys.append(geom['coordinates'])
+            elif geom.get('type') == 'MultiPolygon':
+                polys.extend(geom['coordinates'])
+        if not polys:
+            continue
+        rep = arr[0].get('properties') or {}
+        geom = { 'type': 'Polygon', 'coordinates': polys[0] } if len(polys) == 1 else { 'type': 'MultiPolygon', 'coordinates': polys }
+        geom['coordinates'] = rounded(geom['coordinates'], digits)
+        props = { k: rep[k] for k in ('name', 'code') if rep.get(k) is not None }
+        props['source'] = 'park'
+        out.append({ 'type': 'Feature', 'properties': props, 'geometry': geom })
+    return out
+
+
+def game_hints(hints: dict, parks: list) -> dict:
+    # bare oppføringer getHintsFor() i spill.html kan finne for parkene i bundelen
+    codes = { str(f['properties'].get('code') or '').strip() for f in parks } - {''}
+    names = { str(f['properties'].get('name') or '').strip().lower() for f in parks } - {''}
+    out = {}
+    for k, v in (hints.get('parks') or {}).items():
+        if not isinstance(v, dict):
+            continue
+        if str(v.get('code') or '').strip() in codes or k in names or str(v.get('name') or '').strip().lower() in names:
+            out[k] = { f: v[f] for f in ('code', 'name', 'hints') if f in v }
+    return { 'parks': out }
+
+
+def build(db: dict, hints: dict, outline: dict, digits: int) -> bytes:
+    parks = game_parks(db, digits)
+    bundle = {
+        'format': BUNDLE_FORMAT,
+        'outline': round_geojson(outline, digits),
+        'db': { 'dataset': { 'type': 'FeatureCollection', 'features': parks } },
+        'hints': game_hints(hints, parks),
+    }
+    return json.dumps(bundle, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Bygg spilldataene for spill.html (bundle/game.<hash>.json)')
+    ap.add_argument('--db', default=str(DB_PATH), help='kildedatabase (standard: np_database.json)')
+    ap.add_argument('--hints', default=str(HINTS_PATH), help='hint (standard: park_hints.json)')
+    ap.add_argument('--outline', default=None, help='Norgesomriss (standard: norway_outline_full.json, ellers norway_outline_wgs84.json)')
+    ap.add_argument('--digits', type=int, default=5, help='desimaler i koordinatene (standard 5, ca. 1 m)')
+    ap.add_argument('--out', default=str(BUNDLE_DIR), help='katalog for bundelen (standard: bundle/)')
+    ap.add_argument('--version-file', default=str(VERSION_PATH), help='manifestet som oppdateres (standard: build_version.json)')
+    args = ap.parse_args(argv)
+
+    db_path, hints_path = Path(args.db), Path(args.hints)
+    outline_path = Path(args.outline) if args.outline else next((p for p in OUTLINE_PATHS if p.exists()), None)
+    for path in (db_path, outline_path):
+        if path is None or not path.exists():
+            print(f"Finner ikke {path or OUTLINE_PATHS[0]}")
+            sys.exit(1)
+    db = json.loads(db_path.read_text(encoding='utf-8'))
+    hints = json.loads(hints_path.read_text(encoding='utf-8')) if hints_path.exists() else { 'parks': {} }
+    outline = json.loads(outline_path.read_text(encoding='utf-8'))
+
+    body = build(db, hints, outline, args.digits)
+    digest = hashlib.sha256(body).hexdigest()
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f'game.{digest[:16]}.json'
+    if not path.exists() or path.read_bytes() != body:
+        atomic_write_bytes(path, body)
+
+    version_path = Path(args.version_file)
+    version = json.loads(version_path.read_text(encoding='utf-8')) if version_path.exists() else {}
+    try:
+        rel = path.resolve().relative_to(version_path.resolve().parent).as_posix()
+    except ValueError:
+        rel = path.as_posix()
+    entry = { 'path': rel, 'sha256': digest, 'bytes': len(body) }
+    previous = (version.get('bundle') or {}).get('path')
+    if version.get('bundle') != entry:
+        version['bundle'] = entry
+        atomic_write_text(version_path, json.dumps(version, ensure_ascii=False, indent=2) + '\n')
+
+    # behold forrige bundle også, for sider som fortsatt har det gamle manifestet
+    # (game.*.json* tar også med .gz/.br fra eldre utgaver av skriptet)
+    keep = { path.name } | ({ Path(previous).name } if previous else set())
+    for old in out_dir.glob('game.*.json*'):
+        if old.name not in keep:
+            old.unlink()
+
+    size = f'{len(body):,}'.replace(',', ' ')
+    print(f"{rel} ({size} bytes), {len(json.loads(body)['db']['dataset']['features'])} parker")
+
+
+if __name__ == '__main__':
+    main()
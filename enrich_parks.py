@@ -1,25 +1,51 @@
 #!/usr/bin/env python3
+import argparse
+import base64
+import hashlib
 import json
+import os
 import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import urllib.request, ssl
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 try:
+    import numpy as np
+    import shapely
     from shapely.geometry import shape
-    from shapely.ops import unary_union, transform as shp_transform
-    from pyproj import Geod, Transformer
+    from shapely.strtree import STRtree
+    from pyproj import Geod
+    from boundaries import COUNTIES_PATH, MUNICIP_PATH, load_boundaries, source_version
 except Exception as e:
     print("Missing dependencies. Install with: pip install -r requirements.txt")
     raise
 
+from hints_catalog import HintsCatalog
+from feature_store import FeatureStore
+from journal import atomic_write_text
+
 ROOT = Path(__file__).resolve().parent
-DB_PATH = ROOT / 'np_database.json'
-COUNTIES_PATH = ROOT / 'fylker2018.geojson'
-MUNICIP_PATH = ROOT / 'kommuner2018.geojson'
-HINTS_PATH = ROOT / 'park_hints.json'
+# samme DATA_DIR som save_server.py; grensefilene ligger alltid ved koden
+DATA_DIR = Path(os.environ.get('DATA_DIR') or ROOT)
+DB_PATH = DATA_DIR / 'np_database.json'
+HINTS_PATH = DATA_DIR / 'park_hints.json'
+CACHE_PATH = DATA_DIR / 'enrich_cache.json'
+# STORE_BACKEND=sqlite som i save_server.py: bare endrede features skrives, i én transaksjon
+STORE_BACKEND = os.environ.get('STORE_BACKEND', 'json')
+SQLITE_PATH = Path(os.environ.get('SQLITE_PATH') or DATA_DIR / 'np_store.sqlite3')
+# egenskapene enrich setter
+ENRICHED_PROPS = ('areaKm2', 'counties', 'municipalities', 'perimeterKm', 'centroid', 'bbox', 'establishedYear')
+# øk når innholdet i en cache-oppføring endres
+CACHE_FORMAT = 2
+# quizindeksen save_server.py bruker for /quiz/next (se quiz.py)
+QUIZ_PATH = DATA_DIR / 'quiz_index.json'
+QUIZ_FORMAT = 1
+# antall nærmeste parker per park i indeksen
+QUIZ_NEAREST = 10
 
 
 def normalize_key(code: str, name: str) -> str:
@@ -32,44 +58,318 @@ def load_json(path: Path) -> dict:
     return json.loads(path.read_text(encoding='utf-8'))
 
 
-def geod_area_km2(geom) -> float:
-    geod = Geod(ellps='WGS84')
-    # shapely >= 2.0 geometry_area_perimeter works on any polygon/multipolygon
-    area_m2, _ = geod.geometry_area_perimeter(geom)
-    return abs(area_m2) / 1_000_000.0
-
-
-def get_name(props: Dict) -> str:
-    for k in ('n', 'N', 'navn', 'NAVN', 'fylkesnavn', 'kommunenavn', 'KOMNAVN', 'name'):
-        if k in props and props[k] is not None:
-            return str(props[k])
-    return ''
-
-
-def extract_year_from_hints(hints_data: dict, code: str, name: str):
-    parks = hints_data.get('parks') or {}
-    # first try match by code
-    key = None
-    for k, v in parks.items():
-        if str(v.get('code', '')).strip() == str(code or '').strip():
-            key = k
-            break
-    if key is None:
-        nrm = (name or '').strip().lower()
-        key = nrm if nrm in parks else None
-    entry = parks.get(key) if key else None
-    hints = entry.get('hints') if entry else None
-    if isinstance(hints, list):
-        for h in hints:
-            m = re.search(r'Opprettet i\s+(\d{4})', str(h), flags=re.IGNORECASE)
-            if m:
-                return int(m.group(1))
-    return None
-
-
-def main():
-    if not DB_PATH.exists():
-        print(f"Finner ikke {DB_PATH}")
+# Én Geod for hele kjøringen (per prosess)
+GEOD = Geod(ellps='WGS84')
+
+
+def geod_area_perimeter_km(geoms: np.ndarray) -> np.ndarray:
+    """Geodetisk areal (km²) og omkrets (km) for en array av flater, én rad per geometri.
+
+    Polygon/MultiPolygon regnes ring for ring rett på koordinatene fra to_ragged_array,
+    med samme fortegn og summeringsrekkefølge som Geod.geometry_area_perimeter.
+    """
+    out = np.zeros((len(geoms), 2))
+    types = shapely.get_type_id(geoms)
+    flat = ((types == shapely.GeometryType.POLYGON) | (types == shapely.GeometryType.MULTIPOLYGON)) & ~shapely.is_empty(geoms)
+    for i in np.flatnonzero(~flat).tolist():
+        if geoms[i] is not None and not shapely.is_empty(geoms[i]):
+            out[i] = GEOD.geometry_area_perimeter(geoms[i])
+    idx = np.flatnonzero(flat)
+    if len(idx):
+        _, coords, (ring_off, poly_off, geom_off) = shapely.to_ragged_array(geoms[idx])
+        x, y = np.ascontiguousarray(coords[:, 0]), np.ascontiguousarray(coords[:, 1])
+        ring_off, poly_off, geom_off = ring_off.tolist(), poly_off.tolist(), geom_off.tolist()
+        for k, i in enumerate(idx.tolist()):
+            area = perim = 0.0
+            for p in range(geom_off[k], geom_off[k + 1]):
+                r0, r1 = poly_off[p], poly_off[p + 1]
+                a, pm = GEOD.polygon_area_perimeter(x[ring_off[r0]:ring_off[r0 + 1]], y[ring_off[r0]:ring_off[r0 + 1]])
+                # hull: fortegnet fra ringretningen trekker arealet fra
+                for r in range(r0 + 1, r1):
+                    a += GEOD.polygon_area_perimeter(x[ring_off[r]:ring_off[r + 1]], y[ring_off[r]:ring_off[r + 1]])[0]
+                area += a
+                perim += pm
+            out[i] = (area, perim)
+    out[:, 0] = np.abs(out[:, 0]) / 1_000_000.0
+    out[:, 1] /= 1000.0
+    return out
+
+
+def parse_geometries(geojson: List[dict]) -> np.ndarray:
+    """GeoJSON-geometrier -> shapely-array, None der geometrien er ugyldig.
+
+    Polygon/MultiPolygon samles til ragged-koordinater og bygges i ett from_ragged_array-kall;
+    andre typer og data som ikke passer (3D, åpne eller for korte ringer) går via shape().
+    """
+    out = np.full(len(geojson), None, dtype=object)
+    fast, slow = [], []
+    xy, ring_off, poly_off, geom_off = [], [0], [0], [0]
+    for i, g in enumerate(geojson):
+        try:
+            t = g.get('type')
+            c = g.get('coordinates')
+            polys = [c] if t == 'Polygon' else c if t == 'MultiPolygon' else None
+            if not polys or not all(p and all(len(r) >= 4 and r[0] == r[-1] for r in p) for p in polys):
+                raise ValueError(t)
+        except (AttributeError, TypeError, ValueError):
+            slow.append(i)
+            continue
+        for p in polys:
+            for r in p:
+                xy.extend(r)
+                ring_off.append(len(xy))
+            poly_off.append(len(ring_off) - 1)
+        geom_off.append(len(poly_off) - 1)
+        fast.append(i)
+    if fast:
+        try:
+            coords = np.array(xy, dtype=float)
+            if coords.ndim != 2 or coords.shape[1] != 2:
+                raise ValueError(coords.shape)
+            offsets = tuple(np.asarray(o, dtype=np.int64) for o in (ring_off, poly_off, geom_off))
+            out[fast] = shapely.from_ragged_array(shapely.GeometryType.MULTIPOLYGON, coords, offsets)
+        except (ValueError, shapely.errors.GEOSException):
+            slow.extend(fast)
+    for i in slow:
+        try:
+            out[i] = shape(geojson[i]) if geojson[i] else None
+        except Exception:
+            out[i] = None
+    return out
+
+
+# Grenser per navn ('counties'/'municipalities') -> (navn, STRtree). Settes én gang per prosess.
+_BOUNDARIES: Dict[str, Tuple[List[str], object]] = {}
+
+
+def init_boundaries(county_wkb: List[Tuple[str, bytes]], municip_wkb: List[Tuple[str, bytes]]):
+    # Kalles i hovedprosessen eller som initializer i hver worker; grensene sendes som WKB én gang
+    for key, items in (('counties', county_wkb), ('municipalities', municip_wkb)):
+        names = [n for (n, _) in items]
+        geoms = shapely.from_wkb([w for (_, w) in items]) if items else []
+        _BOUNDARIES[key] = (names, STRtree(geoms))
+
+
+def intersecting_names(key: str, geoms: list) -> List[List[str]]:
+    # Én bulk-spørring mot et STRtree over grensene; eksakt test med preparerte park-geometrier
+    names, tree = _BOUNDARIES[key]
+    hits: List[set] = [set() for _ in geoms]
+    if len(geoms) == 0 or not names:
+        return [[] for _ in geoms]
+    shapely.prepare(geoms)
+    src, dst = tree.query(geoms, predicate='intersects')
+    for i, j in zip(src.tolist(), dst.tolist()):
+        if names[j]:
+            hits[i].add(names[j])
+    return [sorted(h) for h in hits]
+
+
+def merge_groups(chunk: List[List[dict]]):
+    """Alle geometriene i chunken parses samlet og slås sammen per gruppe med én union_all.
+
+    Returnerer (sammenslåtte geometrier, antall gyldige medlemmer per gruppe).
+    """
+    flat, group_of = [], []
+    for i, geoms in enumerate(chunk):
+        for g in geoms:
+            if g:
+                flat.append(g)
+                group_of.append(i)
+    parsed = parse_geometries(flat)
+    group_of = np.asarray(group_of, dtype=np.intp)
+    valid = ~shapely.is_missing(parsed)
+    parsed, group_of = parsed[valid], group_of[valid]
+    counts = np.bincount(group_of, minlength=len(chunk))
+    # 2D-tabell (gruppe x medlem) fylt med None, så union_all kan ta én akse
+    grid = np.full((len(chunk), max(1, int(counts.max(initial=0)))), None, dtype=object)
+    order = np.argsort(group_of, kind='stable')
+    rows = group_of[order]
+    cols = np.arange(len(rows)) - (np.cumsum(counts) - counts)[rows]
+    grid[rows, cols] = parsed[order]
+    return shapely.union_all(grid, axis=1), counts
+
+
+def enrich_chunk(chunk: List[List[dict]]) -> List[Optional[tuple]]:
+    # chunk: GeoJSON-geometriene til hver gruppe -> (areal, fylker, kommuner, omkrets, sentroide, bbox) eller None
+    merged, counts = merge_groups(chunk)
+    index = np.flatnonzero(counts)
+    merged = merged[index]
+    counties = intersecting_names('counties', merged)
+    municips = intersecting_names('municipalities', merged)
+    centroids = shapely.centroid(merged)
+    cx, cy = shapely.get_x(centroids), shapely.get_y(centroids)
+    bounds = shapely.bounds(merged)
+    out: List[Optional[tuple]] = [None] * len(chunk)
+    area_perim = geod_area_perimeter_km(merged)
+    for k, i in enumerate(index.tolist()):
+        area, perim = area_perim[k]
+        if shapely.is_empty(merged[k]):
+            centroid, bbox = None, None
+        else:
+            centroid = [round(float(cx[k]), 5), round(float(cy[k]), 5)]
+            bbox = [round(float(v), 5) for v in bounds[k]]
+        out[i] = (round(float(area), 1), counties[k], municips[k], round(float(perim), 1), centroid, bbox)
+    return out
+
+
+def enrich_groups(group_geoms: List[List[dict]], county_wkb, municip_wkb, workers: int = 1):
+    # Resultatene kommer tilbake i samme rekkefølge som gruppene, uansett antall workers
+    if workers <= 1 or len(group_geoms) < 2:
+        init_boundaries(county_wkb, municip_wkb)
+        return enrich_chunk(group_geoms)
+    n_chunks = min(len(group_geoms), workers * 4)
+    size = -(-len(group_geoms) // n_chunks)
+    chunks = [group_geoms[i:i + size] for i in range(0, len(group_geoms), size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_boundaries, initargs=(county_wkb, municip_wkb)) as pool:
+        results = []
+        for part in pool.map(enrich_chunk, chunks):
+            results.extend(part)
+    return results
+
+
+def group_hash(arr: List[dict]) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for f in arr:
+        h.update(json.dumps(f.get('geometry'), sort_keys=True, separators=(',', ':')).encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def load_cache(version: str) -> Dict[str, list]:
+    # en cache som ikke kan leses eller har feil form, regnes som tom: alt beregnes på nytt
+    try:
+        data = load_json(CACHE_PATH)
+    except Exception:
+        return {}
+    if not isinstance(data, dict) or data.get('boundaries') != version or data.get('format') != CACHE_FORMAT:
+        return {}
+    groups = data.get('groups')
+    if not isinstance(groups, dict):
+        return {}
+    return { h: v for h, v in groups.items() if isinstance(v, list) }
+
+
+def save_cache(version: str, entries: Dict[str, list]):
+    # atomisk, så et avbrutt løp ikke etterlater en halvskrevet cache
+    atomic_write_text(CACHE_PATH, json.dumps({ 'boundaries': version, 'format': CACHE_FORMAT, 'groups': entries }, ensure_ascii=False, separators=(',', ':')))
+
+
+def needs_geometry(arr: List[dict]) -> bool:
+    # bare grupper der minst ett medlem mangler et geometri-avledet felt må beregnes
+    for f in arr:
+        p = f.get('properties') or {}
+        if not p.get('areaKm2'):
+            return True
+        if not (isinstance(p.get('counties'), list) and p['counties']):
+            return True
+        if not (isinstance(p.get('municipalities'), list) and p['municipalities']):
+            return True
+        if not p.get('perimeterKm') or not p.get('centroid') or not p.get('bbox'):
+            return True
+    return False
+
+
+def build_quiz_index(groups: Dict[str, List[dict]]) -> Optional[dict]:
+    """Parkene i spillet med avstandsmatrise, nærmeste parker, fylke/kommune-tabeller og arealrekkefølge.
+
+    Bygges fra de berikede egenskapene (sentroide, areal, fylker, kommuner), så ingen geometri regnes på nytt.
+    Avstanden er geodetisk mellom sentroidene, i hele km.
+    """
+    parks = []
+    for key, arr in groups.items():
+        # som spill.html: skjulte features og features uten geometri er ikke med
+        props = [f.get('properties') or {} for f in arr if f.get('geometry')]
+        props = [p for p in props if p.get('display') != 'no']
+        if not props or not isinstance(props[0].get('centroid'), list) or len(props[0]['centroid']) != 2:
+            continue
+        parks.append((key, props[0]))
+    if not parks:
+        return None
+    names = { 'counties': {}, 'municipalities': {} }
+    tables = { 'counties': [], 'municipalities': [] }
+    for _, p in parks:
+        for k, index in names.items():
+            tables[k].append(sorted(index.setdefault(name, len(index)) for name in sorted(set(p.get(k) or []))))
+    n = len(parks)
+    lon = np.array([float(p['centroid'][0]) for _, p in parks])
+    lat = np.array([float(p['centroid'][1]) for _, p in parks])
+    km = np.zeros((n, n))
+    i, j = np.triu_indices(n, 1)
+    if len(i):
+        _, _, m = GEOD.inv(lon[i], lat[i], lon[j], lat[j])
+        km[i, j] = km[j, i] = np.asarray(m) / 1000.0
+    distance = np.minimum(np.rint(km), 65535).astype('<u2')
+    np.fill_diagonal(km, np.inf)
+    nearest = np.argsort(km, axis=1, kind='stable')[:, :min(QUIZ_NEAREST, n - 1)]
+    area = np.array([float(p.get('areaKm2') or 0) for _, p in parks])
+    return {
+        'format': QUIZ_FORMAT,
+        'parks': [{ 'key': key, 'code': p.get('code'), 'name': p.get('name'), 'areaKm2': p.get('areaKm2') } for key, p in parks],
+        'counties': list(names['counties']),
+        'municipalities': list(names['municipalities']),
+        'parkCounties': tables['counties'],
+        'parkMunicipalities': tables['municipalities'],
+        'nearest': nearest.tolist(),
+        'sizeOrder': np.argsort(-area, kind='stable').tolist(),
+        'distanceKm': base64.b64encode(distance.tobytes()).decode('ascii'),
+    }
+
+
+def write_quiz_index(groups: Dict[str, List[dict]]):
+    index = build_quiz_index(groups)
+    if index is None:
+        print("Ingen parker med sentroide; quizindeksen er ikke skrevet")
+        return
+    text = json.dumps(index, ensure_ascii=False, separators=(',', ':'))
+    try:
+        if QUIZ_PATH.read_text(encoding='utf-8') == text:
+            return
+    except OSError:
+        pass
+    # atomisk, så save_server.py aldri leser en halvskrevet fil
+    atomic_write_text(QUIZ_PATH, text)
+    print(f"Quizindeks for {len(index['parks'])} parker skrevet til {QUIZ_PATH.name}")
+
+
+class StageTimer:
+    """Veggklokketid per steg i main(), i sekunder og i rekkefølge."""
+
+    def __init__(self):
+        self.stages = {}
+        self._t = time.perf_counter()
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + (now - self._t)
+        self._t = now
+
+    def write(self, path: Path):
+        path.write_text(json.dumps({ k: round(v, 4) for k, v in self.stages.items() }, indent=2), encoding='utf-8')
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description='Berik park-features med areal, fylker, kommuner og opprettelsesår.')
+    ap.add_argument('--workers', type=int, default=1, help='antall prosesser for park-gruppene (standard 1)')
+    ap.add_argument('--force', action='store_true', help='beregn alle grupper på nytt, uten cache')
+    ap.add_argument('--only', metavar='CODE', help='bare parken med denne koden')
+    ap.add_argument('--timings', metavar='FILE', help='skriv tid per steg som JSON til FILE')
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    timer = StageTimer()
+    try:
+        run(args, timer)
+    finally:
+        if args.timings:
+            timer.write(Path(args.timings))
+
+
+def run(args, timer: StageTimer):
+    source = SQLITE_PATH if STORE_BACKEND == 'sqlite' else DB_PATH
+    if not source.exists():
+        print(f"Finner ikke {source}")
         sys.exit(1)
     # Sørg for at fylkes/kommunegrenser finnes lokalt – forsøk GitHub-kilde hvis mangler
     ssl._create_default_https_context = ssl._create_unverified_context
@@ -92,80 +392,23 @@ def main():
         print("Mangler fylkes/kommune-geojson. Legg dem i prosjektroten først eller kjør på nytt.")
         sys.exit(2)
 
-    db = load_json(DB_PATH)
-    feats = (db.get('dataset') or {}).get('features') or []
+    timer.mark('setup')
+    if STORE_BACKEND == 'sqlite':
+        import sqlite_store
+        sdb = sqlite_store.Database(SQLITE_PATH)
+        store = sqlite_store.SQLiteFeatureStore(sdb)
+        # bare park-radene, via indeksen på source
+        feats = store.select(source='park')
+        hints = sqlite_store.SQLiteHints(sdb)
+    else:
+        # via lageret, så journalen med serverens siste endringer er med; skrivingen under legger
+        # bare oppdateringene til i journalen, så endringer gjort i mellomtiden beholdes
+        store = FeatureStore(DB_PATH)
+        feats = [dict(f, properties=dict(f.get('properties') or {}))
+                 for f in (store.to_db().get('dataset') or {}).get('features') or []]
+        hints = HintsCatalog(HINTS_PATH)
     parks = [f for f in feats if (f.get('properties') or {}).get('source') == 'park' and (f.get('properties') or {}).get('status') != 'deleted']
-
-    counties_fc = load_json(COUNTIES_PATH)
-    municip_fc = load_json(MUNICIP_PATH)
-    hints = load_json(HINTS_PATH) if HINTS_PATH.exists() else { 'parks': {} }
-
-    # Bestem om fylke/kommune-data er i UTM 33 (EPSG:32633) og reprojiser til WGS84 ved behov
-    def needs_utm33_to_wgs84(fc: dict) -> bool:
-        try:
-            crs_name = (((fc.get('crs') or {}).get('properties') or {}).get('name') or '').upper()
-            if 'EPSG::32633' in crs_name or 'EPSG:32633' in crs_name:
-                return True
-        except Exception:
-            pass
-        # Heuristikk: sjekk første koordinat for typiske UTM-verdier
-        try:
-            for f in (fc.get('features') or [])[:3]:
-                g = f.get('geometry') or {}
-                coords = g.get('coordinates')
-                if not coords:
-                    continue
-                # finn et punkt dypt nok (første [x,y])
-                def first_xy(obj):
-                    if isinstance(obj, (list, tuple)):
-                        if len(obj) >= 2 and isinstance(obj[0], (int, float)) and isinstance(obj[1], (int, float)):
-                            return obj[0], obj[1]
-                        for item in obj:
-                            res = first_xy(item)
-                            if res is not None:
-                                return res
-                    return None
-                xy = first_xy(coords)
-                if xy:
-                    x, y = xy
-                    if abs(x) > 1000 or abs(y) > 1000:
-                        return True
-        except Exception:
-            pass
-        return False
-
-    transformer = Transformer.from_crs('EPSG:32633', 'EPSG:4326', always_xy=True)
-    def to_wgs84_if_needed(geom_obj, do_transform: bool):
-        if not do_transform:
-            return geom_obj
-        try:
-            return shp_transform(transformer.transform, geom_obj)
-        except Exception:
-            return geom_obj
-
-    counties_need_tx = needs_utm33_to_wgs84(counties_fc)
-    municip_need_tx = needs_utm33_to_wgs84(municip_fc)
-
-    # For speed: konverter county/municip geometries på forhånd (til WGS84)
-    county_geoms: List[Tuple[str, object]] = []
-    for c in (counties_fc.get('features') or []):
-        try:
-            nm = get_name(c.get('properties') or {})
-            g = shape(c.get('geometry'))
-            g = to_wgs84_if_needed(g, counties_need_tx)
-            county_geoms.append((nm, g))
-        except Exception:
-            pass
-
-    municip_geoms: List[Tuple[str, object]] = []
-    for m in (municip_fc.get('features') or []):
-        try:
-            nm = get_name(m.get('properties') or {})
-            g = shape(m.get('geometry'))
-            g = to_wgs84_if_needed(g, municip_need_tx)
-            municip_geoms.append((nm, g))
-        except Exception:
-            pass
+    timer.mark('load')
 
     # Group park features by logical park (code or name)
     groups: Dict[str, List[dict]] = {}
@@ -174,62 +417,113 @@ def main():
         key = normalize_key(str(p.get('code') or ''), str(p.get('name') or ''))
         groups.setdefault(key, []).append(f)
 
-    updated = 0
-    total = len(groups)
+    all_groups = groups
+    if args.only:
+        only = normalize_key(args.only, '')
+        groups = { k: v for k, v in groups.items() if k == only }
+        if not groups:
+            print(f"Fant ingen park med kode {args.only}")
+            return
 
+    # Cache: gruppens geometri-hash -> [areal, fylker, kommuner, omkrets, sentroide, bbox], gyldig for én grenseversjon
+    version = source_version()
+    cache = {} if args.force else load_cache(version)
+    results: Dict[str, Optional[list]] = {}
+    todo: List[Tuple[str, List[dict], str]] = []
     for key, arr in groups.items():
-        # Merge geometry
-        shps = []
-        rep = arr[0].get('properties') or {}
-        for f in arr:
-            g = f.get('geometry')
-            if not g: 
-                continue
-            try:
-                shps.append(shape(g))
-            except Exception:
-                continue
-        if not shps:
+        if not needs_geometry(arr):
             continue
-        merged = unary_union(shps)
-        # Compute area
-        area_km2 = round(geod_area_km2(merged), 1)
-        # Intersections
-        counties = sorted({ n for (n, cg) in county_geoms if n and merged.intersects(cg) })
-        municips = sorted({ n for (n, mg) in municip_geoms if n and merged.intersects(mg) })
-        # Established year
-        year = extract_year_from_hints(hints, rep.get('code'), rep.get('name'))
+        h = group_hash(arr)
+        if h in cache:
+            results[key] = cache[h]
+        else:
+            todo.append((key, arr, h))
+    timer.mark('group')
+
+    if todo:
+        # Merge, areal og snitt for nye/endrede grupper – serielt eller fordelt på prosesser
+        county_geoms, municip_geoms = load_boundaries()
+        timer.mark('boundaries')
+        computed = enrich_groups(
+            [[f.get('geometry') for f in arr] for (_, arr, _) in todo],
+            [(n, shapely.to_wkb(g)) for (n, g) in county_geoms],
+            [(n, shapely.to_wkb(g)) for (n, g) in municip_geoms],
+            workers=args.workers,
+        )
+        timer.mark('compute')
+        for (key, _, h), res in zip(todo, computed):
+            results[key] = list(res) if res is not None else None
+            if res is not None:
+                cache[h] = list(res)
+        if not args.only:
+            # behold bare oppføringer for grupper som fortsatt finnes
+            live = { group_hash(arr) for arr in groups.values() }
+            cache = { h: v for h, v in cache.items() if h in live }
+        save_cache(version, cache)
+        timer.mark('cache')
+        print(f"Beregnet {len(todo)} av {len(groups)} park-grupper ({len(groups) - len(todo)} fra cache eller komplette)")
+
+    updated = 0
+    updates = {}
+    for key, arr in groups.items():
+        if key in results and results[key] is None:
+            # ingen gyldig geometri i gruppen
+            continue
+        rep = arr[0].get('properties') or {}
+        # opprettelsesåret er trukket ut av hintene én gang, i søkeindeksen
+        year = hints.facts(rep.get('code'), rep.get('name')).get('establishedYear')
 
         # Write back to each member feature (append-only semantics)
+        res = results.get(key)
         for f in arr:
             p = f.setdefault('properties', {})
             changed = False
-            if not p.get('areaKm2'):
-                p['areaKm2'] = area_km2
-                changed = True
-            if not (isinstance(p.get('counties'), list) and p['counties']):
-                p['counties'] = counties
-                changed = True
-            if not (isinstance(p.get('municipalities'), list) and p['municipalities']):
-                p['municipalities'] = municips
-                changed = True
+            if res is not None:
+                area_km2, counties, municips, perim_km, centroid, bbox = res
+                if not p.get('areaKm2') and p.get('areaKm2') != area_km2:
+                    p['areaKm2'] = area_km2
+                    changed = True
+                if not (isinstance(p.get('counties'), list) and p['counties']) and p.get('counties') != counties:
+                    p['counties'] = counties
+                    changed = True
+                if not (isinstance(p.get('municipalities'), list) and p['municipalities']) and p.get('municipalities') != municips:
+                    p['municipalities'] = municips
+                    changed = True
+                for k, v in (('perimeterKm', perim_km), ('centroid', centroid), ('bbox', bbox)):
+                    if not p.get(k) and v and p.get(k) != v:
+                        p[k] = v
+                        changed = True
             if year and not p.get('establishedYear'):
                 p['establishedYear'] = year
                 changed = True
             if changed:
                 updated += 1
+                updates[p.get('id')] = { k: p[k] for k in ENRICHED_PROPS if k in p }
+
+    timer.mark('writeback')
 
     # Write out if anything updated
-    if updated:
+    if updated and STORE_BACKEND == 'sqlite':
+        revision = store.update_many(updates)
+        timer.mark('save')
+        print(f"Oppdatert {updated} park-features i {SQLITE_PATH.name} (revisjon {revision})")
+    elif updated:
+        # under lageret sin flock: postene legges i journalen (serveren spiller dem av) og
+        # np_database.json skrives på nytt med en base-post, så serveren ikke ser den som endret utenfra
+        revision = store.update_many(updates)
+        store.compact(force=True)
         backup = DB_PATH.with_suffix('.enriched_' + datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
-        backup.write_text(json.dumps(db, ensure_ascii=False, indent=2), encoding='utf-8')
-        DB_PATH.write_text(json.dumps(db, ensure_ascii=False, indent=2), encoding='utf-8')
-        print(f"Oppdatert {updated} park-features. Lagret og sikkerhetskopiert til {backup.name}")
+        backup.write_text(json.dumps(store.to_db(), ensure_ascii=False, indent=2), encoding='utf-8')
+        store.close()
+        timer.mark('save')
+        print(f"Oppdatert {updated} park-features (revisjon {revision}). Lagret og sikkerhetskopiert til {backup.name}")
     else:
         print("Ingen endringer. Alle park-features hadde allerede metadata.")
 
+    # alle parkene, også med --only; de andre har egenskapene fra før
+    write_quiz_index(all_groups)
+    timer.mark('quiz')
+
 
 if __name__ == '__main__':
     main()
-
-
@@ -0,0 +1,454 @@
+import bisect
+import json
+import logging
+import shutil
+from collections import deque
+from pathlib import Path
+
+from journal import JournaledStore
+from response_cache import file_signature
+
+LOG = logging.getLogger('np.store')
+
+# plassholder for features-listen når resten av dokumentet kodes for strømming
+_FEATURES_MARK = '\x00features\x00'
+
+# egenskaper som /update får endre
+ALLOWED_PROPS = {'name', 'code', 'status', 'display', 'source',
+                 'establishedYear', 'areaKm2', 'counties', 'municipalities'}
+
+
+def parse_id(v):
+    try:
+        return int(v)
+    except Exception:
+        return None
+
+
+class BatchError(Exception):
+    def __init__(self, results):
+        super().__init__('batch rejected')
+        self.results = results
+
+
+class Conflict(Exception):
+    # skriving mot en utdatert revisjon: features den rører er endret siden
+    def __init__(self, revision):
+        super().__init__('stale base revision')
+        self.revision = revision
+
+
+def check_db(db_obj):
+    """ValueError hvis dokumentet ikke har formen {'dataset': {'features': [{'properties': {...}}, ...]}}."""
+    if not isinstance(db_obj, dict):
+        raise ValueError('database must be an object')
+    dataset = db_obj.get('dataset', {})
+    if not isinstance(dataset, dict):
+        raise ValueError('dataset must be an object')
+    feats = dataset.get('features') or []
+    if not isinstance(feats, list):
+        raise ValueError('dataset.features must be a list')
+    for n, f in enumerate(feats):
+        if not isinstance(f, dict):
+            raise ValueError(f'feature {n} must be an object')
+        if not isinstance(f.get('properties') or {}, dict):
+            raise ValueError(f'feature {n}: properties must be an object')
+
+
+def ensure_ids(db_obj):
+    changed = False
+    feats = db_obj.get('dataset', {}).get('features') or []
+    # finn maks eksisterende id; en id som er brukt før, regnes som manglende
+    max_id = 0
+    seen = set()
+    for f in feats:
+        pr = f.get('properties') or {}
+        try:
+            i = int(pr.get('id'))
+        except Exception:
+            i = None
+        if isinstance(i, int) and i not in seen:
+            seen.add(i)
+            if i > max_id:
+                max_id = i
+        else:
+            if i in seen:
+                LOG.warning('duplicate feature id %s (%s); assigning a new id', i, pr.get('name'))
+            pr['id'] = None
+    # tildel nye id-er for de som mangler
+    for f in feats:
+        pr = f.get('properties') or {}
+        if pr.get('id') is None:
+            max_id += 1
+            pr['id'] = max_id
+            f['properties'] = pr
+            changed = True
+    return changed
+
+
+def apply_record(f: dict, rec: dict) -> dict:
+    # ny feature etter en update- eller move-post; originalen endres ikke
+    pr = dict(f.get('properties') or {})
+    if rec.get('op') == 'update':
+        for k, v in (rec.get('props') or {}).items():
+            pr[k] = v
+    else:
+        for k in ('code', 'name'):
+            if k in (rec.get('to') or {}):
+                pr[k] = rec['to'][k]
+    return dict(f, properties=pr)
+
+
+def batch_record(op, live, next_id: int):
+    # valider én batch-operasjon mot tilstanden etter de foregående
+    if not isinstance(op, dict):
+        return None, 'Operation must be an object'
+    kind = op.get('op')
+    if kind == 'insert':
+        feat = op.get('feature')
+        if not isinstance(feat, dict) or not isinstance(feat.get('geometry'), dict):
+            return None, 'Missing feature/geometry'
+        props = feat.get('properties') or {}
+        bad = sorted(k for k in props if k not in ALLOWED_PROPS and k != 'id')
+        if bad:
+            return None, 'Property not allowed: ' + ', '.join(bad)
+        props = { k: v for k, v in props.items() if k != 'id' }
+        props['id'] = next_id
+        return { 'op': 'insert', 'id': next_id, 'feature': { 'type': 'Feature', 'properties': props, 'geometry': feat['geometry'] } }, None
+    if kind not in ('update', 'delete', 'move'):
+        return None, 'Unknown op'
+    fid = parse_id(op.get('id'))
+    if fid is None:
+        return None, 'Missing id'
+    if fid not in live:
+        return None, 'Not found'
+    if kind == 'update':
+        props = op.get('props')
+        if not isinstance(props, dict) or not props:
+            return None, 'Missing props'
+        bad = sorted(k for k in props if k not in ALLOWED_PROPS)
+        if bad:
+            return None, 'Property not allowed: ' + ', '.join(bad)
+        return { 'op': 'update', 'id': fid, 'props': props }, None
+    if kind == 'delete':
+        return { 'op': 'delete', 'id': fid }, None
+    to = op.get('to')
+    if not isinstance(to, dict) or not any(k in to for k in ('code', 'name')):
+        return None, 'Missing to'
+    return { 'op': 'move', 'id': fid, 'to': { k: str(to[k]) for k in ('code', 'name') if k in to } }, None
+
+
+class FeatureStore(JournaledStore):
+    """np_database.json i minnet, indeksert på properties.id.
+
+    Endringer skrives som poster i en fsync-et journal og brukes på features i
+    minnet; compact() skriver et nytt øyeblikksbilde og tømmer journalen.
+    Alle journalposter er idempotente, så en krasj mellom snapshot og
+    truncate gir samme resultat ved ny replay.
+
+    `revision` øker for hver endring og lagres i snapshot og journal, så den
+    overlever omstart. De siste `changelog` endringene huskes som (revisjon,
+    feature-id-er) slik at klienter kan hente bare det som er endret.
+
+    Flere prosesser kan dele filene (se JournaledStore); revisjonene er da de samme i alle.
+    """
+
+    def __init__(self, snapshot_path: Path, journal_path: Path = None, compact_every: int = 200, changelog: int = 1000):
+        self._init_store(snapshot_path, journal_path)
+        self.compact_every = compact_every
+        self._db = None
+        self._features = {}
+        self._max_id = 0
+        self.revision = 0
+        self.changelog = max(1, changelog)
+        self._log = deque()  # (revisjon, feature-id-er), stigende
+        self._log_base = 0   # endringer til og med denne revisjonen er ikke i loggen
+
+    # -- lasting -------------------------------------------------------
+
+    def _loaded(self):
+        return self._db is not None
+
+    def _position(self):
+        return self.revision
+
+    def _load(self):
+        signature = file_signature(self.snapshot_path)
+        db = json.loads(self.snapshot_path.read_text(encoding='utf-8'))
+        check_db(db)
+        ids_changed = ensure_ids(db)
+        snap_rev = parse_id(db.pop('revision', 0)) or 0
+        records = self._read_journal(0)
+        # snapshot skrevet av et lager (base-posten peker på det) har riktig revisjon; ellers er
+        # filen endret utenfra: ny revisjon, og eldre deltaer gjelder ikke lenger
+        head = records[0] if records and records[0].get('op') == 'base' else None
+        external = head is None or head.get('sig') != list(signature or ())
+        self.revision = max(snap_rev, self.revision + 1) if external else snap_rev
+        self._log.clear()
+        self._log_base = self.revision
+        dataset = db.setdefault('dataset', {})
+        feats = dataset.get('features') or []
+        self._db = db
+        self._features = {}
+        for f in feats:
+            self._features[int(f['properties']['id'])] = f
+        self._max_id = max(self._features, default=0)
+        # selve listen bygges fra indeksen ved serialisering
+        dataset['features'] = None
+        self._signature = signature
+        self.pending = 0
+        for rec in records:
+            if rec.get('op') != 'base':
+                self._replay(rec)
+                self.pending += 1
+        self.version += 1
+        if ids_changed or external:
+            # skriv revisjonen ut så andre prosesser får den samme
+            self.compact(force=True)
+
+    def _replay(self, rec):
+        self._apply(rec)
+        rev = rec.get('rev') or self.revision + 1
+        self._log_change(max(rev, self.revision), [rec.get('id')])
+
+    # refresh(): last på nytt ved endring utenfra (f.eks. enrich_parks.py) eller fra en annen prosess
+
+    # -- lesing --------------------------------------------------------
+
+    def current_version(self):
+        self.refresh()
+        return self.version
+
+    def get(self, fid):
+        self.refresh()
+        return self._features.get(fid)
+
+    def __len__(self):
+        self.refresh()
+        return len(self._features)
+
+    def to_db(self):
+        with self.lock:
+            self.refresh()
+            return self._snapshot_obj()
+
+    def _snapshot_obj(self):
+        db = dict(self._db)
+        db['revision'] = self.revision
+        dataset = dict(db.get('dataset') or {})
+        dataset['features'] = list(self._features.values())
+        db['dataset'] = dataset
+        return db
+
+    def encode(self) -> bytes:
+        with self.lock:
+            return json.dumps(self.to_db(), ensure_ascii=False).encode('utf-8')
+
+    def iter_encoded(self, chunk_size: int = 64 * 1024):
+        """Samme bytes som encode(), men i biter på omtrent chunk_size.
+
+        Tilstanden fanges under låsen (features endres aldri på stedet, se _apply),
+        selve kodingen skjer utenfor, én feature om gangen.
+        """
+        with self.lock:
+            self.refresh()
+            db = self._snapshot_obj()
+            feats = db['dataset']['features']
+            db['dataset']['features'] = _FEATURES_MARK
+            head, tail = json.dumps(db, ensure_ascii=False).split(json.dumps(_FEATURES_MARK), 1)
+        return self._chunks(head, feats, tail, chunk_size)
+
+    @staticmethod
+    def _chunks(head, feats, tail, chunk_size):
+        buf = [head, '[']
+        size = len(head)
+        for i, f in enumerate(feats):
+            s = json.dumps(f, ensure_ascii=False)
+            if i:
+                buf.append(', ')
+            buf.append(s)
+            size += len(s) + 2
+            if size >= chunk_size:
+                yield ''.join(buf).encode('utf-8')
+                buf, size = [], 0
+        buf.append(']')
+        buf.append(tail)
+        yield ''.join(buf).encode('utf-8')
+
+    # -- endringer -----------------------------------------------------
+
+    def _apply(self, rec):
+        # endrede features erstattes med nye objekter (kopi ved skriving), så
+        # lister hentet ut tidligere kan kodes uten lås mens nye endringer kommer inn
+        op = rec.get('op')
+        fid = rec.get('id')
+        if op in ('update', 'move'):
+            f = self._features.get(fid)
+            if f is not None:
+                self._features[fid] = apply_record(f, rec)
+        elif op == 'delete':
+            self._features.pop(fid, None)
+        elif op == 'insert':
+            self._features[fid] = rec['feature']
+            self._max_id = max(self._max_id, fid)
+
+    def _log_change(self, rev, ids):
+        if self._log and self._log[-1][0] == rev:
+            self._log[-1][1].update(ids)
+        else:
+            self._log.append((rev, set(ids)))
+        self.revision = rev
+        while len(self._log) > self.changelog:
+            self._log_base = self._log.popleft()[0]
+
+    def _commit(self, *records):
+        # kalles under _writing()
+        rev = self.revision + 1
+        for rec in records:
+            rec['rev'] = rev
+        self._append(*records)
+        for rec in records:
+            self._apply(rec)
+        self._log_change(rev, [rec['id'] for rec in records])
+        self.version += 1
+        self.pending += len(records)
+        if self.compact_every and self.pending >= self.compact_every:
+            self.compact()
+
+    def changed_since(self, since: int):
+        """Id-ene som er endret etter revisjon `since`, eller None hvis loggen ikke går så langt tilbake."""
+        if since > self.revision or since < self._log_base:
+            return None
+        ids = set()
+        start = bisect.bisect_right([rev for rev, _ in self._log], since)
+        for i in range(start, len(self._log)):
+            ids |= self._log[i][1]
+        return ids
+
+    def changes(self, since: int):
+        """(revisjon, endrede/nye features, slettede id-er) etter `since`, eller None når en full kopi trengs."""
+        with self.lock:
+            self.refresh()
+            ids = self.changed_since(since)
+            if ids is None:
+                return None
+            changed = [self._features[i] for i in sorted(ids) if i in self._features]
+            deleted = sorted(i for i in ids if i not in self._features)
+            return self.revision, changed, deleted
+
+    def _check_base(self, base, ids):
+        # base=None: ubetinget skriving som før
+        if base is None:
+            return
+        changed = self.changed_since(base)
+        if changed is None or changed & set(ids):
+            raise Conflict(self.revision)
+
+    def update(self, fid, props: dict, base=None):
+        with self._writing():
+            if fid not in self._features:
+                raise KeyError(fid)
+            self._check_base(base, [fid])
+            props = { k: v for k, v in (props or {}).items() if k in ALLOWED_PROPS }
+            self._commit({ 'op': 'update', 'id': fid, 'props': props })
+            return self.revision
+
+    def update_many(self, updates: dict):
+        """{id: props} i én revisjon, uten ALLOWED_PROPS-filteret (for enrich_parks.py).
+
+        Features som er slettet i mellomtiden hoppes over.
+        """
+        with self._writing():
+            records = [{ 'op': 'update', 'id': fid, 'props': props }
+                       for fid, props in updates.items() if fid in self._features]
+            if records:
+                self._commit(*records)
+            return self.revision
+
+    def delete(self, fid, base=None):
+        with self._writing():
+            if fid not in self._features:
+                raise KeyError(fid)
+            self._check_base(base, [fid])
+            self._commit({ 'op': 'delete', 'id': fid })
+            return self.revision
+
+    def move(self, fid, to: dict, base=None):
+        with self._writing():
+            if fid not in self._features:
+                raise KeyError(fid)
+            self._check_base(base, [fid])
+            to = { k: str(to[k]) for k in ('code', 'name') if k in to }
+            self._commit({ 'op': 'move', 'id': fid, 'to': to })
+            return self.revision
+
+    def apply_batch(self, ops: list, base=None):
+        """Alle operasjoner valideres før noe skrives; enten brukes alle (én
+        journal-write) eller ingen, og BatchError bærer resultat per operasjon.
+        Returnerer (ny revisjon, resultater)."""
+        with self._writing():
+            live = set(self._features)
+            next_id = self._max_id + 1
+            records, results, failed = [], [], False
+            for op in ops:
+                rec, err = batch_record(op, live, next_id)
+                if err:
+                    failed = True
+                    results.append({ 'ok': False, 'error': err })
+                    continue
+                if rec['op'] == 'insert':
+                    live.add(rec['id'])
+                    next_id += 1
+                elif rec['op'] == 'delete':
+                    live.discard(rec['id'])
+                records.append(rec)
+                results.append({ 'ok': True, 'op': rec['op'], 'id': rec['id'] })
+            if failed:
+                for r in results:
+                    if r['ok']:
+                        r['ok'] = False
+                        r['error'] = 'Not applied'
+                raise BatchError(results)
+            self._check_base(base, [r['id'] for r in records if r['op'] != 'insert'])
+            self._commit(*records)
+            return self.revision, results
+
+    def replace(self, db_obj: dict, base=None):
+        # full lagring (/save-db): nytt snapshot, journalen er da utdatert
+        # valideres før noe skrives, så et ugyldig dokument ikke blir liggende som snapshot
+        check_db(db_obj)
+        ensure_ids(db_obj)
+        with self._writing():
+            if base is not None and base != self.revision:
+                raise Conflict(self.revision)
+            db_obj = dict(db_obj)
+            db_obj['revision'] = self.revision + 1
+            self._backup_once()
+            self._db = None
+            # base-posten skal peke på den nye revisjonen
+            self.revision += 1
+            self._write_snapshot(json.dumps(db_obj, ensure_ascii=False, indent=2))
+            # base-posten peker på det nye snapshotet, så lastingen gir revisjon + 1
+            self._sync()
+            return self.revision
+
+    # -- kompaktering --------------------------------------------------
+
+    def _backup_once(self):
+        backup = self.snapshot_path.with_suffix('.json.bak')
+        if not backup.exists() and self.snapshot_path.exists():
+            shutil.copyfile(self.snapshot_path, backup)
+
+    def compact(self, force: bool = False):
+        with self._writing():
+            # en annen prosess kan ha kompaktert i mellomtiden
+            if self._db is None or not (self.pending or force):
+                return
+            self._backup_once()
+            self._write_snapshot(json.dumps(self._snapshot_obj(), ensure_ascii=False, indent=2))
+
+    def close(self):
+        with self.lock:
+            if self.pending:
+                self.compact()
+            self.journal.close()
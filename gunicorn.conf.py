@@ -0,0 +1,22 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+# WEB_CONCURRENCY prosesser med WORKERS tråder hver; lagrene deles via journal + flock
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8777')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.environ.get('WORKERS', '8'))
+keepalive = 15
+# /db med mange features kan ta noen sekunder å bygge første gang
+timeout = 120
+
+
+def post_worker_init(worker):
+    # bakgrunnsjobbene (kompaktering, /locate-rutenettene) startes når workeren er klar, ikke ved første forespørsel
+    import wsgi
+    wsgi.start_background()
+
+
+def worker_exit(server, worker):
+    import wsgi
+    wsgi.shutdown()
@@ -0,0 +1,402 @@
+import json
+import re
+import shutil
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from pathlib import Path
+
+from journal import FileLock, atomic_write_text
+from metrics import FILE_LOAD
+from response_cache import file_signature
+
+
+def norm_key(s: str) -> str:
+    s = (s or '').lower()
+    # bevar nordiske bokstaver
+    return re.sub(r'[^a-z0-9æøå]', '', s)
+
+
+def clean_hints(hints) -> list:
+    # rens hintliste -> bare str, trim, uten tomme
+    out = []
+    for h in hints or []:
+        try:
+            s = str(h).strip()
+            if s:
+                out.append(s)
+        except Exception:
+            pass
+    return out
+
+
+# -- søkeindeks -------------------------------------------------------
+
+# posisjon for parknavnet i postinglistene; hintene har 0, 1, …
+NAME = -1
+# treff i navnet teller mer enn treff i et hint
+NAME_WEIGHT = 3
+# siste ord i søket matcher også som prefiks (søk mens man skriver), fra denne lengden
+PREFIX_MIN = 2
+
+# samme mønster som enrich_parks.py alltid har brukt for establishedYear
+YEAR_RE = re.compile(r'Opprettet i\s+(\d{4})', re.IGNORECASE)
+# «Høyeste topp er Kvigtinden (1699 moh)», «… høyeste fjell: Galdhøpiggen (2469 moh)»,
+# «Høyeste topp er Store Lenangstind (1624 moh)»: navnet er ordene med stor forbokstav før parentesen
+PEAK_RE = re.compile(r'(?i:høyeste\s+(?:topp|punkt|fjell))[^()]*?\b((?:[A-ZÆØÅ][\w-]*\s+)*[A-ZÆØÅ][\w-]+)'
+                     r'\s*\(\s*(\d{3,4})\s*moh\s*\)')
+
+
+def fold(text: str) -> str:
+    # små bokstaver uten aksenter (á -> a), men æ/ø/å beholdes
+    s = unicodedata.normalize('NFC', str(text or '').lower()).replace('å', '\0')
+    s = ''.join(c for c in unicodedata.normalize('NFD', s) if not unicodedata.combining(c))
+    return s.replace('\0', 'å')
+
+
+def tokenize(text: str) -> list:
+    """Ordene i teksten, normalisert som norm_key(); ord på én bokstav er ikke med."""
+    out = []
+    for word in re.split(r'\W+', fold(text)):
+        t = norm_key(word)
+        if len(t) > 1 or t.isdigit():
+            out.append(t)
+    return out
+
+
+def extract_facts(hints) -> dict:
+    """Opprettelsesår og høyeste topp fra hintene; første treff vinner."""
+    facts = {}
+    for h in hints or []:
+        h = str(h)
+        if 'establishedYear' not in facts:
+            m = YEAR_RE.search(h)
+            if m:
+                facts['establishedYear'] = int(m.group(1))
+        if 'highestPeak' not in facts:
+            m = PEAK_RE.search(h)
+            if m:
+                facts['highestPeak'] = { 'name': m.group(1), 'moh': int(m.group(2)) }
+    return facts
+
+
+class HintsIndex:
+    """Invertert indeks over navn og hint per park (nøkkel i park_hints.json), med fakta som egne felt.
+
+    put() erstatter én park, så skrivinger oppdaterer bare den parkens poster.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # term -> {nøkkel: [posisjoner]}
+        self.postings = {}
+        # sortert liste over termene, for prefikssøk
+        self.vocab = []
+        # nøkkel -> (termer, oppføring, fakta)
+        self.docs = {}
+        # år -> {nøkler}
+        self.by_year = {}
+
+    def rebuild(self, parks: dict):
+        with self.lock:
+            self.postings, self.vocab, self.docs, self.by_year = {}, [], {}, {}
+            for k, v in parks.items():
+                self._add(k, v)
+            self.vocab = sorted(self.postings)
+
+    def put(self, key: str, entry: dict):
+        with self.lock:
+            self._remove(key)
+            self._add(key, entry, incremental=True)
+
+    def remove(self, key: str):
+        with self.lock:
+            self._remove(key)
+
+    def _add(self, key, entry, incremental=False):
+        if not isinstance(entry, dict):
+            return
+        fields = [(NAME, entry.get('name')), (NAME, entry.get('code'))]
+        fields.extend(enumerate(entry.get('hints') or []))
+        terms = set()
+        for pos, text in fields:
+            for t in tokenize(text):
+                plist = self.postings.get(t)
+                if plist is None:
+                    plist = self.postings[t] = {}
+                    if incremental:
+                        insort(self.vocab, t)
+                positions = plist.setdefault(key, [])
+                if not positions or positions[-1] != pos:
+                    positions.append(pos)
+                terms.add(t)
+        facts = extract_facts(entry.get('hints'))
+        self.docs[key] = (terms, entry, facts)
+        if 'establishedYear' in facts:
+            self.by_year.setdefault(facts['establishedYear'], set()).add(key)
+
+    def _remove(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        terms, _, facts = doc
+        for t in terms:
+            plist = self.postings.get(t)
+            if plist is None:
+                continue
+            plist.pop(key, None)
+            if not plist:
+                del self.postings[t]
+                i = bisect_left(self.vocab, t)
+                if i < len(self.vocab) and self.vocab[i] == t:
+                    del self.vocab[i]
+        year = facts.get('establishedYear')
+        if year in self.by_year:
+            self.by_year[year].discard(key)
+            if not self.by_year[year]:
+                del self.by_year[year]
+
+    def facts(self, key) -> dict:
+        doc = self.docs.get(key)
+        return dict(doc[2]) if doc else {}
+
+    def _matches(self, term, prefix):
+        # {nøkkel: posisjoner} for termen, og for alle termer som begynner med den når prefix er sann
+        if not prefix or len(term) < PREFIX_MIN:
+            return self.postings.get(term) or {}
+        out = {}
+        i = bisect_left(self.vocab, term)
+        while i < len(self.vocab) and self.vocab[i].startswith(term):
+            for k, positions in self.postings[self.vocab[i]].items():
+                out.setdefault(k, set()).update(positions)
+            i += 1
+        return out
+
+    def search(self, q: str = '', limit: int = 20, year=None) -> dict:
+        """Parkene som inneholder alle ordene i q (det siste også som prefiks), og har opprettelsesåret year."""
+        terms = tokenize(q)
+        with self.lock:
+            hits = None
+            if year is not None:
+                hits = { k: set() for k in self.by_year.get(year, ()) }
+            for n, t in enumerate(terms):
+                found = self._matches(t, n == len(terms) - 1)
+                if hits is None:
+                    hits = { k: set(p) for k, p in found.items() }
+                else:
+                    hits = { k: hits[k] | set(found[k]) for k in hits if k in found }
+                if not hits:
+                    break
+            hits = hits or {}
+            ranked = sorted(hits.items(), key=lambda kv: (-sum(NAME_WEIGHT if p == NAME else 1 for p in kv[1]), kv[0]))
+            results = []
+            for k, positions in ranked[:max(0, limit)]:
+                _, entry, facts = self.docs[k]
+                hints = entry.get('hints') or []
+                results.append({
+                    'key': k,
+                    'code': entry.get('code'),
+                    'name': entry.get('name'),
+                    'score': sum(NAME_WEIGHT if p == NAME else 1 for p in positions),
+                    'hints': [{ 'index': p, 'text': hints[p] } for p in sorted(positions) if p != NAME],
+                    'facts': dict(facts),
+                })
+        return { 'q': q, 'total': len(hits), 'results': results }
+
+
+class HintsCatalog:
+    """park_hints.json i minnet med oppslag på kode og normalisert navn."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.RLock()
+        # skrivere i andre prosesser; hver skriving leser filen på nytt under låsen
+        self.flock = FileLock(path.with_suffix('.lock'))
+        self.version = 0
+        self._obj = None
+        self._signature = None
+        # kode/normalisert navn -> nøklene med den verdien i filrekkefølge; den første brukes
+        self._by_code = {}
+        self._by_name = {}
+        self._order = {}
+        self.index = HintsIndex()
+
+    def refresh(self):
+        with self.lock:
+            sig = file_signature(self.path)
+            if self._obj is not None and sig == self._signature:
+                return
+            with FILE_LOAD.time(self.path.name):
+                if sig is None:
+                    obj = { 'parks': {} }
+                else:
+                    obj = json.loads(self.path.read_text(encoding='utf-8'))
+                    if not isinstance(obj.get('parks'), dict):
+                        obj['parks'] = {}
+                self._obj = obj
+                self._signature = sig
+                self._reindex()
+                self.index.rebuild(obj['parks'])
+            self.version += 1
+
+    def _reindex(self):
+        self._by_code = {}
+        self._by_name = {}
+        self._order = {}
+        for k, v in self._obj['parks'].items():
+            self._order[k] = len(self._order)
+            if isinstance(v, dict):
+                self._index_entry(k, v)
+
+    @staticmethod
+    def _lookup_values(v):
+        return str(v.get('code') or '').strip(), norm_key(str(v.get('name') or ''))
+
+    def _index_entry(self, k, v):
+        # første forekomst i filen vinner, som i den gamle lineære søkingen
+        for table, value in zip((self._by_code, self._by_name), self._lookup_values(v)):
+            if value:
+                insort(table.setdefault(value, []), (self._order[k], k))
+
+    def _unindex_entry(self, k, v):
+        for table, value in zip((self._by_code, self._by_name), self._lookup_values(v)):
+            keys = table.get(value)
+            if keys and (self._order[k], k) in keys:
+                keys.remove((self._order[k], k))
+                if not keys:
+                    del table[value]
+
+    @property
+    def parks(self) -> dict:
+        self.refresh()
+        return self._obj['parks']
+
+    def current_version(self):
+        self.refresh()
+        return self.version
+
+    def find_key(self, code: str = '', name: str = '', key: str = ''):
+        """Finn eksisterende nøkkel vha kode, navn eller eksplisitt nøkkel – O(1)."""
+        self.refresh()
+        parks = self._obj['parks']
+        code = str(code or '').strip()
+        name = str(name or '').strip()
+        if code and code in self._by_code:
+            return self._by_code[code][0][1]
+        if name:
+            nrm = norm_key(name)
+            if nrm in parks:
+                return nrm
+            raw = name.lower()
+            if raw in parks:
+                return raw
+            if nrm in self._by_name:
+                return self._by_name[nrm][0][1]
+        key = str(key or '').strip()
+        if key:
+            return key
+        return None
+
+    def get(self, code: str = '', name: str = ''):
+        k = self.find_key(code, name)
+        entry = self._obj['parks'].get(k) if k else None
+        return entry if isinstance(entry, dict) else None
+
+    def encode(self) -> bytes:
+        with self.lock:
+            self.refresh()
+            return json.dumps(self._obj, ensure_ascii=False).encode('utf-8')
+
+    def search(self, q: str = '', limit: int = 20, year=None) -> dict:
+        self.refresh()
+        return self.index.search(q, limit, year)
+
+    def facts(self, code: str = '', name: str = '') -> dict:
+        """Opprettelsesår og høyeste topp fra hintene, slått opp i indeksen."""
+        self.refresh()
+        k = self.find_key(code, name)
+        return self.index.facts(k) if k else {}
+
+    # -- skriving ------------------------------------------------------
+
+    def _entry_for_write(self, code, name, key):
+        found_key = self.find_key(code, name, key)
+        if found_key is None:
+            found_key = norm_key(name) or code or 'ukjent'
+        entry = dict(self._obj['parks'].get(found_key) or {})
+        if name:
+            entry['name'] = name
+        if code:
+            entry['code'] = code
+        return found_key, entry
+
+    def _store(self, found_key, entry):
+        # bygg nytt objekt og bytt inn først når filen er skrevet
+        obj = dict(self._obj)
+        obj['parks'] = dict(self._obj['parks'])
+        obj['parks'][found_key] = entry
+        # backup én gang
+        bak = self.path.with_suffix('.json.bak')
+        if not bak.exists() and self.path.exists():
+            shutil.copyfile(self.path, bak)
+        atomic_write_text(self.path, json.dumps(obj, ensure_ascii=False, indent=2))
+        old = self._obj['parks'].get(found_key)
+        self._obj = obj
+        self._signature = file_signature(self.path)
+        # bare den endrede parken flyttes i oppslagene
+        if isinstance(old, dict):
+            self._unindex_entry(found_key, old)
+        self._order.setdefault(found_key, len(self._order))
+        self._index_entry(found_key, entry)
+        self.index.put(found_key, entry)
+        self.version += 1
+
+    def set_hints(self, code: str, name: str, key: str, hints: list):
+        with self.lock, self.flock:
+            self.refresh()
+            code = str(code or '').strip()
+            name = str(name or '').strip()
+            found_key, entry = self._entry_for_write(code, name, key)
+            entry['hints'] = clean_hints(hints)
+            self._store(found_key, entry)
+            return found_key
+
+    def patch(self, code: str, name: str, key: str, op: str, hint=None, index=None, to=None):
+        """Endre ett hint: op 'add' (hint, index?), 'remove' (index eller hint) eller 'move' (index, to)."""
+        with self.lock, self.flock:
+            self.refresh()
+            code = str(code or '').strip()
+            name = str(name or '').strip()
+            if op != 'add' and self.find_key(code, name, key) not in self._obj['parks']:
+                raise KeyError('park')
+            found_key, entry = self._entry_for_write(code, name, key)
+            hints = list(entry.get('hints') or [])
+            if op == 'add':
+                items = clean_hints([hint])
+                if not items:
+                    raise ValueError('Missing hint')
+                pos = len(hints) if index is None else int(index)
+                if not 0 <= pos <= len(hints):
+                    raise IndexError(pos)
+                hints.insert(pos, items[0])
+            elif op == 'remove':
+                if index is not None:
+                    pos = int(index)
+                    if not 0 <= pos < len(hints):
+                        raise IndexError(pos)
+                else:
+                    text = str(hint or '').strip()
+                    if text not in hints:
+                        raise IndexError(text)
+                    pos = hints.index(text)
+                del hints[pos]
+            elif op == 'move':
+                src, dst = int(index), int(to)
+                if not (0 <= src < len(hints) and 0 <= dst < len(hints)):
+                    raise IndexError(src)
+                hints.insert(dst, hints.pop(src))
+            else:
+                raise ValueError('Unknown op')
+            entry['hints'] = hints
+            self._store(found_key, entry)
+            return found_key, hints
@@ -0,0 +1,290 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # uten fcntl (Windows) låses det bare innad i prosessen
+    fcntl = None
+
+from metrics import FILE_LOAD, FILE_SAVE, JOURNAL_APPEND
+from response_cache import file_signature
+
+LOG = logging.getLogger('np.journal')
+
+# umask kan bare leses ved å sette den; gjøres én gang ved import, før andre tråder finnes
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def atomic_write_text(path: Path, text: str):
+    atomic_write_bytes(path, text.encode('utf-8'))
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    # skriv til temp-fil i samme katalog, fsync og rename over originalen
+    with FILE_SAVE.time(path.name):
+        fd, tmp = tempfile.mkstemp(prefix='.' + path.name + '.', suffix='.tmp', dir=str(path.parent))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # mkstemp gir 0600; behold rettighetene til filen som erstattes, ellers som en vanlig ny fil
+                if hasattr(os, 'fchmod'):
+                    try:
+                        mode = os.stat(path).st_mode & 0o7777
+                    except FileNotFoundError:
+                        mode = 0o666 & ~_UMASK
+                    os.fchmod(f.fileno(), mode)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        fsync_dir(path.parent)
+
+
+def fsync_dir(path: Path):
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class FileLock:
+    """Eksklusiv flock på en egen låsefil, så flere prosesser (gunicorn-workere) ikke skriver samtidig.
+
+    Brukes under eierens threading-lås; nøstet bruk i samme prosess teller bare opp.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+        self._depth = 0
+
+    def __enter__(self):
+        if self._depth == 0 and fcntl is not None:
+            if self._pid != os.getpid():
+                # en fd arvet gjennom fork deler lås med forelderen – åpne egen
+                self._fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o644)
+                self._pid = os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return False
+
+
+class Journal:
+    """Append-only JSON-lines logg; hver append er én write + fsync."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._f = None
+
+    def _file(self):
+        if self._f is None:
+            self._drop_torn_tail()
+            self._f = open(self.path, 'ab')
+        return self._f
+
+    def _drop_torn_tail(self):
+        # fjern en halvskrevet siste linje så nye poster ikke havner bak den
+        try:
+            f = open(self.path, 'r+b')
+        except FileNotFoundError:
+            return
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                nl = chunk.rfind(b'\n')
+                if nl >= 0:
+                    pos = pos - step + nl + 1
+                    break
+                pos -= step
+            if pos != end:
+                f.truncate(pos)
+
+    def append(self, *records) -> int:
+        """Skriver postene og returnerer filens lengde etterpå."""
+        if not records:
+            return self.size()
+        data = b''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n' for r in records)
+        with JOURNAL_APPEND.time(self.path.name):
+            f = self._file()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def replay(self):
+        return self.read_from(0)[0]
+
+    def read_from(self, offset: int, limit: int = None):
+        """(poster fra byte-offset, offset etter siste hele post)."""
+        records = []
+        end = offset
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return records, 0
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # avkuttet siste linje etter krasj – ble aldri bekreftet
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                end += len(line)
+                if limit and len(records) >= limit:
+                    break
+        return records, end
+
+    def size(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def truncate(self):
+        self.close()
+        with open(self.path, 'wb') as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def truncate_to(self, offset: int):
+        with open(self.path, 'r+b') as f:
+            f.truncate(offset)
+            os.fsync(f.fileno())
+
+    def reset(self, *records) -> int:
+        # tom journal som starter med records; returnerer lengden
+        self.truncate()
+        return self.append(*records)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class JournaledStore:
+    """Felles for lagre med snapshot + journal som deles mellom prosesser.
+
+    Lesing og skriving skjer under self.lock og en flock på <snapshot>.lock. Hver prosess
+    holder seg oppdatert ved å lese journalen fra der den slapp (`_journal_pos`). Et snapshot
+    skrevet av et lager starter journalen med en base-post `{'op': 'base', 'pos': N, 'sig': [...]}`,
+    så prosesser som allerede står på posisjon N bare tar i bruk det nye snapshotet.
+
+    Underklassene har `_loaded()`, `_position()`, `_load()` (fullt fra snapshot + journal) og
+    `_replay(rec)`.
+    """
+
+    def _init_store(self, snapshot_path: Path, journal_path: Path = None):
+        self.snapshot_path = snapshot_path
+        self.journal = Journal(journal_path or snapshot_path.with_suffix('.journal'))
+        self.flock = FileLock(snapshot_path.with_suffix('.lock'))
+        self.lock = threading.RLock()
+        self.version = 0
+        self.pending = 0
+        self._signature = None
+        self._journal_pos = 0
+
+    def _stale(self) -> bool:
+        return (not self._loaded() or file_signature(self.snapshot_path) != self._signature
+                or self.journal.size() != self._journal_pos)
+
+    def refresh(self):
+        with self.lock:
+            if self._stale():
+                with self.flock:
+                    self._sync()
+
+    @contextmanager
+    def _writing(self):
+        # skrivere holder begge låsene og ser alt andre prosesser har skrevet
+        with self.lock, self.flock:
+            if self._stale():
+                self._sync()
+            yield
+
+    def _sync(self):
+        sig = file_signature(self.snapshot_path)
+        if self._loaded() and sig != self._signature:
+            head, pos = self.journal.read_from(0, limit=1)
+            if head and head[0].get('op') == 'base' and head[0].get('sig') == list(sig or ()) \
+                    and head[0].get('pos') == self._position():
+                # en annen prosess kompakterte den tilstanden vi allerede har
+                self._signature = sig
+                self._journal_pos = pos
+                self.pending = 0
+        if not self._loaded() or sig != self._signature or self.journal.size() < self._journal_pos:
+            with FILE_LOAD.time(self.snapshot_path.name):
+                self._load()
+            return
+        records = self._read_journal(self._journal_pos)
+        for rec in records:
+            if rec.get('op') != 'base':
+                self._replay(rec)
+                self.pending += 1
+        if records:
+            self.version += 1
+
+    def _read_journal(self, offset: int = 0):
+        records, end = self.journal.read_from(offset)
+        if self.journal.size() > end:
+            # halvskrevet post fra en prosess som krasjet; vi holder låsen, så ingen skriver nå
+            self.journal.truncate_to(end)
+        self._journal_pos = end
+        return records
+
+    def _append(self, *records):
+        self._journal_pos = self.journal.append(*records)
+
+    def _write_snapshot(self, text: str):
+        atomic_write_text(self.snapshot_path, text)
+        self._signature = file_signature(self.snapshot_path)
+        self._journal_pos = self.journal.reset({ 'op': 'base', 'pos': self._position(), 'sig': list(self._signature) })
+        self.pending = 0
+
+
+def start_compactor(store, interval: float, name: str):
+    # periodisk kompaktering i bakgrunnen så snapshot ikke henger langt etter journalen
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                if store.pending:
+                    store.compact()
+            except Exception as e:
+                LOG.error('compaction of %s failed: %s', name, e)
+
+    threading.Thread(target=loop, name=name + '-compactor', daemon=True).start()
+    return stop
@@ -0,0 +1,336 @@
+import json
+import random
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from journal import JournaledStore
+from response_cache import file_signature
+
+EMPTY_ENTRY = {"name": "<EMPTY>", "score": 0}
+KEEP_DAILY = 14
+KEEP_WEEKLY = 8
+
+
+class _Top:
+    # vaktpost som er større enn alle nøkler
+    def __lt__(self, other):
+        return False
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, next_, width):
+        self.key = key
+        self.next = next_
+        self.width = width
+
+
+class RankedSet:
+    """Indekserbar skip-liste: innsetting, sletting og rang i O(log n)."""
+
+    MAX_LEVELS = 32
+
+    def __init__(self):
+        self.size = 0
+        self.nil = _Node(_Top(), [], [])
+        self.head = _Node(None, [self.nil] * self.MAX_LEVELS, [1] * self.MAX_LEVELS)
+
+    def __len__(self):
+        return self.size
+
+    def _chain(self, key):
+        chain = [None] * self.MAX_LEVELS
+        steps = [0] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key):
+        chain, steps_at_level = self._chain(key)
+        d = 1
+        while d < self.MAX_LEVELS and random.random() < 0.5:
+            d += 1
+        node = _Node(key, [None] * d, [None] * d)
+        steps = 0
+        for level in range(d):
+            prev = chain[level]
+            node.next[level] = prev.next[level]
+            prev.next[level] = node
+            node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(d, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._chain(key)
+        node = chain[0].next[0]
+        if node is self.nil or node.key != key:
+            raise KeyError(key)
+        d = len(node.next)
+        for level in range(d):
+            prev = chain[level]
+            prev.width[level] += node.width[level] - 1
+            prev.next[level] = node.next[level]
+        for level in range(d, self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        # 0-basert posisjon, eller None hvis nøkkelen ikke finnes
+        node = self.head
+        pos = 0
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                pos += node.width[level]
+                node = node.next[level]
+        nxt = node.next[0]
+        if nxt is self.nil or nxt.key != key:
+            return None
+        return pos
+
+    def slice(self, start: int, count: int):
+        if start < 0:
+            start = 0
+        if start >= self.size or count <= 0:
+            return []
+        node = self.head
+        i = start + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.width[level] <= i:
+                i -= node.width[level]
+                node = node.next[level]
+        out = []
+        while node is not self.nil and len(out) < count:
+            out.append(node.key)
+            node = node.next[0]
+        return out
+
+
+class Board:
+    """Beste score per spiller (navn uten hensyn til store/små bokstaver)."""
+
+    def __init__(self):
+        self.entries = {}  # navn.lower() -> (navn, score, seq)
+        self.order = RankedSet()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def submit(self, name: str, score: int, seq: int) -> bool:
+        k = name.lower()
+        cur = self.entries.get(k)
+        if cur is not None:
+            if score <= cur[1]:
+                return False
+            self.order.remove((-cur[1], cur[2], k))
+        self.entries[k] = (name, score, seq)
+        # lik score: den som kom først står øverst
+        self.order.insert((-score, seq, k))
+        return True
+
+    def would_improve(self, name: str, score: int) -> bool:
+        cur = self.entries.get(name.lower())
+        return cur is None or score > cur[1]
+
+    def rank(self, name: str):
+        cur = self.entries.get(name.lower())
+        if cur is None:
+            return None
+        return self.order.rank((-cur[1], cur[2], name.lower())) + 1
+
+    def page(self, offset: int, limit: int):
+        out = []
+        for i, (_, _, k) in enumerate(self.order.slice(offset, limit)):
+            name, score, _ = self.entries[k]
+            out.append({ 'rank': offset + i + 1, 'name': name, 'score': score })
+        return out
+
+    def rows(self):
+        return [[name, score, seq] for (name, score, seq) in self.entries.values()]
+
+
+def period_ids(t: float):
+    d = datetime.fromtimestamp(t, tz=timezone.utc)
+    year, week, _ = d.isocalendar()
+    return 'daily:' + d.strftime('%Y-%m-%d'), 'weekly:%04d-W%02d' % (year, week)
+
+
+def board_id(which: str) -> str:
+    # 'all', 'daily', 'weekly' (inneværende periode) eller en eksplisitt periode-id
+    which = which or 'all'
+    if which in ('daily', 'weekly'):
+        daily, weekly = period_ids(time.time())
+        which = daily if which == 'daily' else weekly
+    return which
+
+
+def read_legacy_scores(path: Path):
+    # gammel highscores.json: [...] eller {"list": [...]}
+    try:
+        data = json.loads(path.read_text(encoding='utf-8'))
+    except Exception:
+        return []
+    if isinstance(data, dict):
+        data = data.get('list') or []
+    out = []
+    for e in data if isinstance(data, list) else []:
+        try:
+            name = str(e.get('name') or '').strip()
+            score = int(e.get('score'))
+        except Exception:
+            continue
+        if name and name != EMPTY_ENTRY['name']:
+            out.append((name, score))
+    return out
+
+
+class Leaderboard(JournaledStore):
+    """Alle-tiders, daglige og ukentlige tavler i minnet, med journal på disk.
+
+    Hver innsending som forbedrer minst én tavle journalføres med et
+    løpenummer; snapshotet lagrer siste løpenummer, så replay etter krasj
+    hopper over poster som allerede er med. Flere prosesser kan dele filene
+    (se JournaledStore).
+    """
+
+    def __init__(self, snapshot_path: Path, journal_path: Path = None, seed_path: Path = None, compact_every: int = 5000):
+        self._init_store(snapshot_path, journal_path)
+        self.compact_every = compact_every
+        self.seed_path = seed_path
+        self.seq = 0
+        self.boards = None
+        self.refresh()
+
+    def _loaded(self):
+        return self.boards is not None
+
+    def _position(self):
+        return self.seq
+
+    def _load(self):
+        self.seq = 0
+        self.boards = { 'all': Board() }
+        self.pending = 0
+        self._signature = file_signature(self.snapshot_path)
+        if self.snapshot_path.exists():
+            snap = json.loads(self.snapshot_path.read_text(encoding='utf-8'))
+            self.seq = int(snap.get('seq') or 0)
+            for board_id, rows in (snap.get('boards') or {}).items():
+                board = self.boards.setdefault(board_id, Board())
+                for name, score, seq in rows:
+                    board.submit(name, int(score), int(seq))
+        records = [rec for rec in self._read_journal(0) if rec.get('op') != 'base']
+        if not self.snapshot_path.exists() and not records and self.seed_path is not None:
+            for name, score in read_legacy_scores(self.seed_path):
+                self.seq += 1
+                self.boards['all'].submit(name, score, self.seq)
+            self.compact(force=True)
+        for rec in records:
+            self._replay(rec)
+        self.version += 1
+
+    def _replay(self, rec):
+        if rec.get('seq', 0) > self.seq:
+            self._apply(rec)
+            self.pending += 1
+
+    def _apply(self, rec):
+        name, score, seq = rec['name'], rec['score'], rec['seq']
+        for board_id in ('all',) + period_ids(rec['t']):
+            board = self.boards.get(board_id)
+            if board is None:
+                board = self.boards[board_id] = Board()
+                self._prune()
+            board.submit(name, score, seq)
+        self.seq = max(self.seq, seq)
+
+    def _prune(self):
+        for prefix, keep in (('daily:', KEEP_DAILY), ('weekly:', KEEP_WEEKLY)):
+            ids = sorted(b for b in self.boards if b.startswith(prefix))
+            for old in ids[:-keep]:
+                del self.boards[old]
+
+    def board(self, which: str = 'all'):
+        which = board_id(which)
+        return which, self.boards.get(which) or Board()
+
+    def players(self, which: str = 'all') -> int:
+        with self.lock:
+            self.refresh()
+            return len(self.board(which)[1])
+
+    def submit(self, name: str, score: int):
+        """Returnerer (forbedret alle-tiders, rang alle-tiders)."""
+        with self._writing():
+            t = time.time()
+            ids = ('all',) + period_ids(t)
+            if not any(self.boards.get(b) is None or self.boards[b].would_improve(name, score) for b in ids):
+                return False, self.boards['all'].rank(name)
+            improved = self.boards['all'].would_improve(name, score)
+            rec = { 'seq': self.seq + 1, 'name': name, 'score': score, 't': round(t, 3) }
+            self._append(rec)
+            self._apply(rec)
+            self.version += 1
+            self.pending += 1
+            if self.compact_every and self.pending >= self.compact_every:
+                self.compact()
+            return improved, self.boards['all'].rank(name)
+
+    def top(self, n: int = 10, which: str = 'all', offset: int = 0):
+        with self.lock:
+            self.refresh()
+            board_id, board = self.board(which)
+            return board_id, len(board), board.page(offset, n)
+
+    def rank(self, name: str, which: str = 'all'):
+        with self.lock:
+            self.refresh()
+            board_id, board = self.board(which)
+            r = board.rank(name)
+            cur = board.entries.get(name.lower())
+            return board_id, len(board), r, (cur[1] if cur else None)
+
+    def around(self, name: str, n: int = 5, which: str = 'all'):
+        with self.lock:
+            self.refresh()
+            board_id, board = self.board(which)
+            r = board.rank(name)
+            if r is None:
+                return board_id, len(board), None, []
+            start = max(0, r - 1 - n)
+            return board_id, len(board), r, board.page(start, 2 * n + 1)
+
+    def legacy_top10(self):
+        # formatet spill.html forventer: alltid 10 plasser
+        with self.lock:
+            self.refresh()
+            scores = [{ 'name': e['name'], 'score': e['score'] } for e in self.boards['all'].page(0, 10)]
+        while len(scores) < 10:
+            scores.append(dict(EMPTY_ENTRY))
+        return scores
+
+    def current_version(self):
+        self.refresh()
+        return self.version
+
+    def compact(self, force: bool = False):
+        with self._writing():
+            # en annen prosess kan ha kompaktert i mellomtiden
+            if not (self.pending or force):
+                return
+            snap = { 'seq': self.seq, 'boards': { b: board.rows() for b, board in self.boards.items() } }
+            self._write_snapshot(json.dumps(snap, ensure_ascii=False, separators=(',', ':')))
+
+    def close(self):
+        with self.lock:
+            if self.pending:
+                self.compact()
+            self.journal.close()
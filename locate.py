@@ -0,0 +1,234 @@
+import logging
+import threading
+from typing import List, Optional
+
+import numpy as np
+import shapely
+
+import metrics
+from boundaries import load_boundaries
+
+LOG = logging.getLogger('np.locate')
+
+LOOKUPS = metrics.Counter('np_locate_points_total',
+                          'Punkter slått opp i /locate per lag; via=grid er avgjort av cellen alene, via=exact med punkt-i-polygon.',
+                          ('layer', 'via'))
+
+EMPTY = -1
+
+
+class Grid:
+    """Uniformt rutenett over en mengde flater i lon/lat.
+
+    Hver celle er tom, helt inne i nøyaktig én flate, eller en kantcelle med flatene som krysser den.
+    Bare punkter i kantceller testes mot polygonene; resten avgjøres med ett tabelloppslag.
+    """
+
+    def __init__(self, geoms, cell_deg: float):
+        # multipolygoner deles i delflater, så en park med biter langt fra hverandre ikke får en boks
+        # over halve landet; owner er flaten hver del kommer fra
+        self.geoms, self.owner = shapely.get_parts(np.asarray(geoms, dtype=object), return_index=True)
+        # cellene er dobbelt så brede som høye, omtrent kvadratiske i km ved 60° N
+        self.dy = float(cell_deg)
+        self.dx = 2 * self.dy
+        if not len(self.geoms):
+            self.x0 = self.y0 = 0.0
+            self.nx = self.ny = 0
+            self.cells = np.zeros(0, dtype=np.int32)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.candidates = np.zeros(0, dtype=np.int32)
+            return
+        shapely.prepare(self.geoms)
+        x0, y0, x1, y1 = shapely.total_bounds(self.geoms).tolist()
+        self.x0, self.y0 = x0, y0
+        self.nx = max(1, int(np.ceil((x1 - x0) / self.dx)))
+        self.ny = max(1, int(np.ceil((y1 - y0) / self.dy)))
+        ix, iy = np.meshgrid(np.arange(self.nx), np.arange(self.ny))
+        ix, iy = ix.ravel(), iy.ravel()
+        boxes = shapely.box(x0 + ix * self.dx, y0 + iy * self.dy, x0 + (ix + 1) * self.dx, y0 + (iy + 1) * self.dy)
+        # kandidater fra boksene i treet, deretter eksakt mot de preparerte flatene
+        cell, geom = shapely.STRtree(self.geoms).query(boxes)
+        hit = shapely.intersects(self.geoms[geom], boxes[cell])
+        cell, geom = cell[hit], geom[hit]
+        count = np.bincount(cell, minlength=len(boxes))
+        inside = shapely.contains_properly(self.geoms[geom], boxes[cell]) & (count[cell] == 1)
+        cells = np.full(len(boxes), EMPTY, dtype=np.int64)
+        cells[cell[inside]] = geom[inside]
+        # kantceller: -2 - k, der k er nummeret på kandidatlisten; listene er sortert på flateindeks
+        edge = (count > 0) & (cells == EMPTY)
+        keep = edge[cell]
+        cell, geom = cell[keep], geom[keep]
+        order = np.lexsort((geom, cell))
+        cell, geom = cell[order], geom[order]
+        edge_cells, sizes = np.unique(cell, return_counts=True)
+        cells[edge_cells] = -2 - np.arange(len(edge_cells))
+        self.cells = cells.astype(np.int32)
+        self.offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        self.candidates = geom.astype(np.int32)
+
+    def lookup(self, lon: np.ndarray, lat: np.ndarray):
+        """Indeksen til flaten hvert punkt ligger i (-1 for ingen), og hvor mange som trengte eksakt test.
+
+        Ligger punktet i flere (overlappende) flater, gis den med lavest indeks.
+        """
+        out = np.full(len(lon), EMPTY, dtype=np.int64)
+        if not self.nx:
+            return out, 0
+        ix = np.floor((lon - self.x0) / self.dx)
+        iy = np.floor((lat - self.y0) / self.dy)
+        ok = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny)
+        v = np.full(len(lon), EMPTY, dtype=np.int64)
+        v[ok] = self.cells[iy[ok].astype(np.int64) * self.nx + ix[ok].astype(np.int64)]
+        inner = v >= 0
+        out[inner] = v[inner]
+        edge = np.flatnonzero(v <= -2)
+        if not len(edge):
+            return self._owners(out), 0
+        # ett (punkt, kandidat)-par per kandidat i cellen, testet i ett vektorisert kall
+        k = -2 - v[edge]
+        start = self.offsets[k]
+        size = self.offsets[k + 1] - start
+        point = np.repeat(edge, size)
+        pos = np.repeat(start - (np.cumsum(size) - size), size) + np.arange(int(size.sum()))
+        cand = self.candidates[pos].astype(np.int64)
+        hit = shapely.intersects_xy(self.geoms[cand], lon[point], lat[point])
+        first = np.full(len(lon), len(self.geoms), dtype=np.int64)
+        np.minimum.at(first, point[hit], cand[hit])
+        found = first < len(self.geoms)
+        out[found] = first[found]
+        return self._owners(out), len(edge)
+
+    def _owners(self, part):
+        # delflate -> flaten den kommer fra
+        return np.where(part >= 0, self.owner[np.maximum(part, 0)], EMPTY)
+
+
+class Locator:
+    """Fylke, kommune og park for punkter, med ett Grid per lag.
+
+    Grensene lastes fra boundaries.py første gang de trengs, eller av warm() ved oppstart. Parkene hentes
+    fra ParkIndex; når den har bygget en ny utgave (databasen er endret), brukes det forrige rutenettet
+    til det nye er bygget i bakgrunnen, så ingen forespørsel venter på bygget.
+    """
+
+    def __init__(self, parks=None, cell_deg: float = 0.02):
+        self.parks = parks
+        self.cell_deg = cell_deg
+        self.lock = threading.Lock()
+        self._areas = None
+        # (ParkIndex-utgave, Grid) byttes samlet, så indeksene alltid hører til riktig utgave
+        self._park_grid = (None, None)
+        # holdes av tråden som bygger parkrutenettet på nytt, så det bare går én om gangen
+        self._rebuilding = threading.Lock()
+
+    def warm(self):
+        """Bygg rutenettene for grensene og gjeldende parker nå, i stedet for ved første oppslag."""
+        self._boundaries()
+        if self.parks is not None:
+            self._build_parks()
+
+    def _boundaries(self):
+        areas = self._areas
+        if areas is None:
+            with self.lock:
+                if self._areas is None:
+                    counties, municips = load_boundaries()
+                    self._areas = {
+                        layer: ([n for (n, _) in items], Grid([g for (_, g) in items], self.cell_deg))
+                        for layer, items in (('county', counties), ('municipality', municips))
+                    }
+                areas = self._areas
+        return areas
+
+    def _parks(self):
+        if self.parks is None:
+            return None, None
+        built = self._park_grid
+        if built[1] is None:
+            return self._build_parks()
+        if built[0] is not self.parks.snap or not self.parks.is_current():
+            # både parkindeksen og rutenettet bygges i bakgrunnen; (utgave, rutenett) fra før
+            # endringen henger sammen og brukes til det nye er klart
+            self._rebuild_parks()
+        return built
+
+    def _build_parks(self):
+        with self.lock:
+            # gjeldende utgave leses under låsen, så et eldre bygg aldri erstatter et nyere
+            snap = self.parks.refresh()
+            if self._park_grid[0] is not snap:
+                self._park_grid = (snap, Grid([p.geom for p in snap.parks], self.cell_deg))
+            return self._park_grid
+
+    def _rebuild_parks(self):
+        if not self._rebuilding.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._build_parks()
+            except Exception as e:
+                LOG.error('park grid rebuild failed: %s', e)
+            finally:
+                self._rebuilding.release()
+
+        threading.Thread(target=run, name='locate-parks', daemon=True).start()
+
+    def locate(self, lat, lon) -> List[dict]:
+        """Én rad per punkt: {'county', 'municipality', 'park'}, None der punktet ikke ligger i noen."""
+        lat = np.asarray(lat, dtype=float).reshape(-1)
+        lon = np.asarray(lon, dtype=float).reshape(-1)
+        columns = {}
+        for layer, (names, grid) in self._boundaries().items():
+            idx, exact = grid.lookup(lon, lat)
+            self._count(layer, len(idx), exact)
+            columns[layer] = [names[i] if i >= 0 else None for i in idx.tolist()]
+        snap, grid = self._parks()
+        if grid is not None:
+            idx, exact = grid.lookup(lon, lat)
+            self._count('park', len(idx), exact)
+            columns['park'] = [snap.parks[i].summary() if i >= 0 else None for i in idx.tolist()]
+        else:
+            columns['park'] = [None] * len(lat)
+        return [{ 'county': c, 'municipality': m, 'park': p }
+                for c, m, p in zip(columns['county'], columns['municipality'], columns['park'])]
+
+    @staticmethod
+    def parse_points(points):
+        """[[lat, lon], ...] -> (lat, lon) som arrays; ValueError ved feil form eller verdier utenfor kloden."""
+        try:
+            a = np.asarray(points, dtype=float).reshape(-1, 2) if points else np.zeros((0, 2))
+        except (TypeError, ValueError):
+            raise ValueError('points must be [[lat, lon], ...]')
+        if len(a) != len(points) or not np.isfinite(a).all():
+            raise ValueError('points must be [[lat, lon], ...]')
+        if (np.abs(a[:, 0]) > 90).any() or (np.abs(a[:, 1]) > 180).any():
+            raise ValueError('lat/lon out of range')
+        return a[:, 0], a[:, 1]
+
+    def locate_one(self, lat: float, lon: float) -> Optional[dict]:
+        return self.locate([lat], [lon])[0]
+
+    @staticmethod
+    def _count(layer, n, exact):
+        if exact:
+            LOOKUPS.inc(layer, 'exact', value=exact)
+        if n - exact:
+            LOOKUPS.inc(layer, 'grid', value=n - exact)
+
+
+def start_warmer(locator: Locator, interval: float):
+    # bygg rutenettene ved oppstart og deretter når databasen er endret, i bakgrunnen
+    stop = threading.Event()
+
+    def loop():
+        while True:
+            try:
+                locator.warm()
+            except Exception as e:
+                LOG.error('locate warm-up failed: %s', e)
+            if stop.wait(interval):
+                return
+
+    threading.Thread(target=loop, name='locate-warmer', daemon=True).start()
+    return stop
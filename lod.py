@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""Forenklede, kvantiserte utgaver av parkdatabasen og Norgesomrisset (TopoJSON).
+
+Alle ringer og linjer deles opp i buer ved knutepunkter, slik at en grense som
+deles av to flater lagres – og forenkles – én gang. Koordinatene kvantiseres
+til heltall på et felles rutenett og buene delta-kodes, som i TopoJSON.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+ROOT = Path(__file__).resolve().parent
+DB_PATH = ROOT / 'np_database.json'
+# norway_outline_full.json brukes hvis den finnes, ellers den forenklede WGS84-utgaven
+OUTLINE_PATHS = (ROOT / 'norway_outline_full.json', ROOT / 'norway_outline_wgs84.json')
+
+# toleranse i grader før kvantisering; kvantisering = antall rutenettsteg langs lengste akse
+LEVELS = {
+    'low': { 'tolerance': 0.01, 'quantization': 10_000 },
+    'med': { 'tolerance': 0.002, 'quantization': 100_000 },
+    'high': { 'tolerance': 0.0002, 'quantization': 1_000_000 },
+}
+
+
+def outline_path() -> Optional[Path]:
+    for path in OUTLINE_PATHS:
+        if path.exists():
+            return path
+    return None
+
+
+def geojson_items(obj) -> List[Tuple[Optional[dict], dict]]:
+    # FeatureCollection / Feature / GeometryCollection / geometri -> [(geometri, properties)]
+    if not isinstance(obj, dict):
+        return []
+    t = obj.get('type')
+    if t == 'FeatureCollection':
+        return [(f.get('geometry'), dict(f.get('properties') or {})) for f in obj.get('features') or [] if isinstance(f, dict)]
+    if t == 'Feature':
+        return [(obj.get('geometry'), dict(obj.get('properties') or {}))]
+    if t == 'GeometryCollection':
+        return [(g, {}) for g in obj.get('geometries') or [] if isinstance(g, dict)]
+    return [(obj, {})]
+
+
+def _lines_of(geom) -> Tuple[Optional[str], list]:
+    # geometri -> (type, nestet liste av ringer/linjer som (N, 2)-arrays)
+    t = geom.get('type') if isinstance(geom, dict) else None
+    c = geom.get('coordinates') if t else None
+    try:
+        if t == 'Polygon':
+            return t, [np.asarray(r, dtype=float)[:, :2] for r in c]
+        if t == 'MultiPolygon':
+            return t, [[np.asarray(r, dtype=float)[:, :2] for r in p] for p in c]
+        if t == 'LineString':
+            return t, [np.asarray(c, dtype=float)[:, :2]]
+        if t == 'MultiLineString':
+            return t, [np.asarray(l, dtype=float)[:, :2] for l in c]
+        if t == 'Point':
+            return t, [np.asarray([c[:2]], dtype=float)]
+        if t == 'MultiPoint':
+            return t, [np.asarray([p[:2] for p in c], dtype=float).reshape(-1, 2)]
+    except (TypeError, ValueError, IndexError):
+        pass
+    return None, []
+
+
+def _iter_arrays(nested):
+    for item in nested:
+        if isinstance(item, list):
+            yield from _iter_arrays(item)
+        else:
+            yield item
+
+
+class _Arcs:
+    """Samler kvantiserte linjer, finner knutepunkter og bygger delte buer."""
+
+    def __init__(self):
+        self.lines = []  # lister av (x, y)-tupler
+        self.arcs = []
+        self.index = {}
+
+    def add(self, pts) -> int:
+        self.lines.append(pts)
+        return len(self.lines) - 1
+
+    def junctions(self):
+        # et punkt er et knutepunkt når det opptrer med ulike naboer (eller er endepunkt på en åpen linje)
+        seen = {}
+        out = set()
+        for pts in self.lines:
+            closed = pts[0] == pts[-1]
+            n = len(pts) - 1 if closed else len(pts)
+            for i in range(n):
+                p = pts[i]
+                if closed:
+                    prev, nxt = pts[i - 1] if i else pts[-2], pts[i + 1]
+                elif i == 0 or i == n - 1:
+                    out.add(p)
+                    continue
+                else:
+                    prev, nxt = pts[i - 1], pts[i + 1]
+                nb = (prev, nxt) if prev <= nxt else (nxt, prev)
+                if seen.setdefault(p, nb) != nb:
+                    out.add(p)
+        return out
+
+    def cut(self, pts, junctions):
+        if pts[0] != pts[-1]:
+            idx = [0] + [i for i in range(1, len(pts) - 1) if pts[i] in junctions] + [len(pts) - 1]
+            return [pts[a:b + 1] for a, b in zip(idx, idx[1:])]
+        ring = pts[:-1]
+        idx = [i for i, p in enumerate(ring) if p in junctions]
+        # ring uten knutepunkter: start i minste punkt, så like ringer blir like buer
+        start = idx[0] if idx else min(range(len(ring)), key=ring.__getitem__)
+        ring = ring[start:] + ring[:start] + [ring[start]]
+        idx = sorted((i - start) % (len(ring) - 1) for i in idx) if idx else [0]
+        idx.append(len(ring) - 1)
+        return [ring[a:b + 1] for a, b in zip(idx, idx[1:])]
+
+    def arc_id(self, arc) -> int:
+        key = tuple(arc)
+        if key in self.index:
+            return self.index[key]
+        rev = key[::-1]
+        if rev in self.index:
+            return ~self.index[rev]
+        self.index[key] = len(self.arcs)
+        self.arcs.append(arc)
+        return len(self.arcs) - 1
+
+
+def _dedupe(a: np.ndarray) -> list:
+    keep = np.ones(len(a), dtype=bool)
+    keep[1:] = np.any(a[1:] != a[:-1], axis=1)
+    return list(map(tuple, a[keep].tolist()))
+
+
+def _simplify(arcs: List[list], tolerance: float) -> List[np.ndarray]:
+    # alle buer forenkles i ett kall; endepunktene ligger fast, så delte grenser forblir delte
+    if not arcs:
+        return []
+    lengths = np.fromiter((len(a) for a in arcs), dtype=np.int64, count=len(arcs))
+    coords = np.asarray([p for a in arcs for p in a], dtype=float)
+    lines = shapely.linestrings(coords, indices=np.repeat(np.arange(len(arcs)), lengths))
+    if tolerance > 0:
+        lines = shapely.simplify(lines, tolerance, preserve_topology=True)
+    pts, which = shapely.get_coordinates(lines, return_index=True)
+    pts = np.rint(pts).astype(np.int64)
+    splits = np.flatnonzero(np.diff(which)) + 1
+    out = []
+    for arc, part in zip(arcs, np.split(pts, splits)):
+        if arc[0] == arc[-1] and len(part) < 4:
+            # liten lukket ring: behold en trekant i stedet for å miste den
+            n = len(arc) - 1
+            part = np.asarray([arc[0], arc[n // 3], arc[2 * n // 3], arc[0]] if n >= 3 else arc, dtype=np.int64)
+        out.append(part)
+    return out
+
+
+def build_topology(items: Dict[str, List[Tuple[Optional[dict], dict]]], tolerance: float, quantization: int) -> dict:
+    """{objektnavn: [(geometri, properties)]} -> TopoJSON-topologi med kvantiserte, delte buer."""
+    parsed = { name: [(_lines_of(g), p) for g, p in rows] for name, rows in items.items() }
+    arrays = [a for rows in parsed.values() for (_, nested), _ in rows for a in _iter_arrays(nested) if len(a)]
+    if arrays:
+        allc = np.concatenate(arrays)
+        lo, hi = allc.min(axis=0), allc.max(axis=0)
+    else:
+        lo, hi = np.zeros(2), np.ones(2)
+    # samme skala på begge akser, så toleransen betyr det samme i x og y
+    k = float(max(hi - lo)) / (quantization - 1) or 1.0
+    translate = [float(lo[0]), float(lo[1])]
+
+    def q(a):
+        return np.rint((a - lo) / k).astype(np.int64)
+
+    arcs = _Arcs()
+    pending = {}
+    for name, rows in parsed.items():
+        out = []
+        for (t, nested), props in rows:
+            if t in ('Polygon', 'MultiPolygon', 'LineString', 'MultiLineString'):
+                # deler: liste av ringer (flater) eller én linje per del
+                parts = { 'Polygon': [nested], 'MultiPolygon': nested, 'LineString': [nested],
+                          'MultiLineString': [[l] for l in nested] }[t]
+                closed = t in ('Polygon', 'MultiPolygon')
+                refs = []
+                for part in parts:
+                    lines = []
+                    for r in part:
+                        pts = _dedupe(q(r))
+                        if closed and (len(pts) < 4 or pts[0] != pts[-1]):
+                            if len(pts) >= 3 and pts[0] != pts[-1]:
+                                pts.append(pts[0])
+                            else:
+                                continue
+                        if not closed and len(pts) < 2:
+                            continue
+                        lines.append(arcs.add(pts))
+                    if lines:
+                        refs.append(lines)
+                out.append((t, refs, props))
+            elif t in ('Point', 'MultiPoint'):
+                pts = q(nested[0]).tolist()
+                out.append((t, pts[0] if t == 'Point' else pts, props))
+            else:
+                out.append((None, None, props))
+        pending[name] = out
+
+    junctions = arcs.junctions()
+    line_arcs = [[arcs.arc_id(a) for a in arcs.cut(pts, junctions)] for pts in arcs.lines]
+    simple = _simplify(arcs.arcs, tolerance / k)
+
+    objects = {}
+    for name, out in pending.items():
+        geometries = []
+        for t, refs, props in out:
+            g = { 'type': t, 'properties': props }
+            if t in ('Point', 'MultiPoint'):
+                g['coordinates'] = refs
+            elif t is not None:
+                parts = [[line_arcs[i] for i in lines] for lines in refs]
+                if not parts:
+                    g['type'] = None
+                elif t == 'Polygon':
+                    g['arcs'] = parts[0]
+                elif t == 'MultiPolygon':
+                    g['arcs'] = parts
+                elif t == 'LineString':
+                    g['arcs'] = parts[0][0]
+                else:
+                    g['arcs'] = [p[0] for p in parts]
+            geometries.append(g)
+        objects[name] = { 'type': 'GeometryCollection', 'geometries': geometries }
+
+    encoded = []
+    for pts in simple:
+        d = pts.copy()
+        d[1:] -= pts[:-1]
+        encoded.append(d.tolist())
+    return {
+        'type': 'Topology',
+        'bbox': [float(lo[0]), float(lo[1]), float(hi[0]), float(hi[1])],
+        'transform': { 'scale': [k, k], 'translate': translate },
+        'arcs': encoded,
+        'objects': objects,
+    }
+
+
+def decode(topo: dict, name: str) -> List[Tuple[Optional[dict], dict]]:
+    """Motsatt vei: ett objekt i topologien -> [(GeoJSON-geometri, properties)]."""
+    (sx, sy), (tx, ty) = topo['transform']['scale'], topo['transform']['translate']
+    arcs = []
+    for a in topo['arcs']:
+        c = np.cumsum(np.asarray(a, dtype=np.int64).reshape(-1, 2), axis=0)
+        arcs.append(c * [sx, sy] + [tx, ty])
+
+    def line(ids):
+        pts = []
+        for i in ids:
+            a = arcs[i] if i >= 0 else arcs[~i][::-1]
+            pts.extend(a[1:].tolist() if pts else a.tolist())
+        return pts
+
+    out = []
+    for g in topo['objects'][name]['geometries']:
+        t = g.get('type')
+        if t == 'Polygon':
+            geom = { 'type': t, 'coordinates': [line(r) for r in g['arcs']] }
+        elif t == 'MultiPolygon':
+            geom = { 'type': t, 'coordinates': [[line(r) for r in p] for p in g['arcs']] }
+        elif t == 'LineString':
+            geom = { 'type': t, 'coordinates': line(g['arcs']) }
+        elif t == 'MultiLineString':
+            geom = { 'type': t, 'coordinates': [line(l) for l in g['arcs']] }
+        elif t == 'Point':
+            geom = { 'type': t, 'coordinates': [g['coordinates'][0] * sx + tx, g['coordinates'][1] * sy + ty] }
+        elif t == 'MultiPoint':
+            geom = { 'type': t, 'coordinates': [[x * sx + tx, y * sy + ty] for x, y in g['coordinates']] }
+        else:
+            geom = None
+        out.append((geom, g.get('properties') or {}))
+    return out
+
+
+_OUTLINE = {}
+
+
+def load_outline():
+    # Norgesomrisset leses én gang per fil/endring
+    path = outline_path()
+    if path is None:
+        return []
+    sig = path.stat().st_mtime_ns
+    if _OUTLINE.get('key') != (path, sig):
+        _OUTLINE['key'] = (path, sig)
+        _OUTLINE['items'] = geojson_items(json.loads(path.read_text(encoding='utf-8')))
+    return _OUTLINE['items']
+
+
+def build_level(db: dict, level: str) -> dict:
+    params = LEVELS[level]
+    features = ((db.get('dataset') or {}).get('features')) or []
+    items = {
+        'features': [(f.get('geometry'), f.get('properties') or {}) for f in features if isinstance(f, dict)],
+        'outline': load_outline(),
+    }
+    topo = build_topology(items, params['tolerance'], params['quantization'])
+    topo['lod'] = level
+    return topo
+
+
+def encode(topo: dict) -> bytes:
+    return json.dumps(topo, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+# -- byggesteg -------------------------------------------------------
+
+def source_hash(db_path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(db_path.read_bytes())
+    path = outline_path()
+    if path is not None:
+        h.update(path.read_bytes())
+    h.update(json.dumps(LEVELS, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def level_path(db_path: Path, level: str) -> Path:
+    return db_path.with_name(db_path.stem + '.' + level + '.topo.json')
+
+
+def fidelity(db: dict, topo: dict) -> Tuple[float, float]:
+    # median relativ arealfeil (%) og median Hausdorff-avstand (≈ meter) for flatene
+    orig = [g for g, _ in geojson_items({ 'type': 'FeatureCollection', 'features': (db.get('dataset') or {}).get('features') or [] })]
+    simp = [g for g, _ in decode(topo, 'features')]
+    area_err, dist = [], []
+    for a, b in zip(orig, simp):
+        if not a or not b or a.get('type') not in ('Polygon', 'MultiPolygon'):
+            continue
+        try:
+            ga, gb = shape(a), shape(b)
+        except Exception:
+            continue
+        if ga.area > 0:
+            area_err.append(abs(gb.area - ga.area) / ga.area * 100)
+        dist.append(shapely.hausdorff_distance(ga, gb) * 111_000)
+    return (float(np.median(area_err)) if area_err else 0.0, float(np.median(dist)) if dist else 0.0)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Bygg forenklede TopoJSON-nivåer av parkdatabasen')
+    ap.add_argument('--db', default=str(DB_PATH), help='kildedatabase (standard: np_database.json)')
+    ap.add_argument('--force', action='store_true', help='bygg selv om kildene er uendret')
+    ap.add_argument('--table', action='store_true', help='skriv størrelse/nøyaktighet per nivå')
+    args = ap.parse_args(argv)
+    db_path = Path(args.db)
+    if not db_path.exists():
+        print(f"Finner ikke {db_path}")
+        sys.exit(1)
+    db = json.loads(db_path.read_text(encoding='utf-8'))
+    src = source_hash(db_path)
+    raw = len(json.dumps(db, ensure_ascii=False).encode('utf-8'))
+    rows = [('full', raw, len(gzip.compress(json.dumps(db, ensure_ascii=False).encode('utf-8'), 6)), None, None)]
+    for level in LEVELS:
+        path = level_path(db_path, level)
+        topo = None
+        if not args.force and path.exists():
+            try:
+                old = json.loads(path.read_text(encoding='utf-8'))
+                if old.get('source') == src:
+                    topo = old
+            except ValueError:
+                pass
+        if topo is None:
+            topo = build_level(db, level)
+            topo['source'] = src
+            path.write_bytes(encode(topo))
+            print(f"Skrev {path.name}")
+        if args.table:
+            body = encode(topo)
+            err, dist = fidelity(db, topo)
+            rows.append((level, len(body), len(gzip.compress(body, 6)), err, dist))
+    if args.table:
+        print('| nivå | bytes | gzip | arealfeil (median) | avvik (median) |')
+        print('|------|------:|-----:|-------------------:|---------------:|')
+        for level, size, gz, err, dist in rows:
+            e = '–' if err is None else f'{err:.2f} %'
+            d = '–' if dist is None else f'{dist:.0f} m'
+            print(f'| {level} | {size:,} | {gz:,} | {e} | {d} |'.replace(',', ' '))
+
+
+if __name__ == '__main__':
+    main()
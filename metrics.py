@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# METRICS=0 slår av all innsamling (og /metrics); målepunktene blir da bare et flaggoppslag
+ENABLED = os.environ.get('METRICS', '1') != '0'
+
+# sekunder
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# bytes, 64 B – 64 MB
+SIZE_BUCKETS = tuple(64 * 4 ** i for i in range(11))
+
+REGISTRY = []
+
+
+def _escape(v) -> str:
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{v}"' for n, v in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _num(v) -> str:
+    if v == float('inf'):
+        return '+Inf'
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self, out):
+        out.append(f'# HELP {self.name} {self.help}')
+        out.append(f'# TYPE {self.name} {self.kind}')
+        with self._lock:
+            items = sorted((k, self._copy(v)) for k, v in self._values.items())
+        for key, value in items:
+            self._render_one(out, key, value)
+
+    @staticmethod
+    def _copy(v):
+        return v
+
+    def _render_one(self, out, key, value):
+        out.append(f'{self.name}{_labels(self.labels, key)} {_num(value)}')
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, value=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+
+class Gauge(_Metric):
+    """Verdien hentes ved skraping: fn() gir et tall, eller {labelverdier: tall} når gaugen har labels."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, fn, labels=()):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def render(self, out):
+        try:
+            v = self.fn()
+        except Exception:
+            return
+        out.append(f'# HELP {self.name} {self.help}')
+        out.append(f'# TYPE {self.name} {self.kind}')
+        for key, value in sorted(v.items() if isinstance(v, dict) else [((), v)]):
+            self._render_one(out, key, value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            st = self._values.get(labels)
+            if st is None:
+                # [antall per bøtte (ikke kumulativt, siste er +Inf), sum, antall]
+                st = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            st[0][i] += 1
+            st[1] += value
+            st[2] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    @staticmethod
+    def _copy(v):
+        return [list(v[0]), v[1], v[2]]
+
+    def _render_one(self, out, key, value):
+        counts, total, n = value
+        acc = 0
+        for le, c in zip(self.buckets + (float('inf'),), counts):
+            acc += c
+            out.append(f'{self.name}_bucket{_labels(self.labels, key, [("le", _num(float(le)))])} {acc}')
+        out.append(f'{self.name}_sum{_labels(self.labels, key)} {_num(float(total))}')
+        out.append(f'{self.name}_count{_labels(self.labels, key)} {n}')
+
+
+class _Timer:
+    __slots__ = ('hist', 'labels', 't0')
+
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, *self.labels)
+        return False
+
+
+def render() -> bytes:
+    """Alle registrerte målinger i Prometheus tekstformat (0.0.4)."""
+    out = []
+    for m in list(REGISTRY):
+        m.render(out)
+    return ('\n'.join(out) + '\n').encode('utf-8')
+
+
+# målinger som deles av flere moduler
+FILE_LOAD = Histogram('np_file_load_seconds', 'Tid for å lese og indeksere en datafil.', ('file',))
+FILE_SAVE = Histogram('np_file_save_seconds', 'Tid for atomisk skriving (write, fsync, rename) av en fil.', ('file',))
+JOURNAL_APPEND = Histogram('np_journal_append_seconds', 'Tid for journal-append med fsync.', ('journal',))
+CACHE_LOOKUPS = Counter('np_response_cache_lookups_total', 'Oppslag i svarcachen.', ('key', 'result'))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Flytt JSON-filene inn i SQLite-lagringen (STORE_BACKEND=sqlite) og tilbake.
+
+  python3 migrate_store.py import            # np_database.json, park_hints.json, leaderboard.json -> np_store.sqlite3
+  python3 migrate_store.py export [--out D]  # tilbake til JSON, f.eks. for GitHub Pages
+
+Filene leses og skrives i DATA_DIR som i save_server.py.
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import sqlite_store
+
+ROOT = Path(__file__).resolve().parent
+DATA_DIR = Path(os.environ.get('DATA_DIR') or ROOT)
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('command', choices=('import', 'export'))
+    ap.add_argument('--sqlite', type=Path, default=None, help='SQLite-fil (standard: SQLITE_PATH eller <data>/np_store.sqlite3)')
+    ap.add_argument('--data', type=Path, default=DATA_DIR, help='katalog med JSON-filene for import (standard: DATA_DIR)')
+    ap.add_argument('--out', type=Path, default=None, help='katalog for eksport (standard: samme som --data)')
+    ap.add_argument('--force', action='store_true', help='importer selv om databasen allerede har data')
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.sqlite = args.sqlite or Path(os.environ.get('SQLITE_PATH') or args.data / 'np_store.sqlite3')
+    if args.command == 'import':
+        if not (args.data / 'np_database.json').exists():
+            print(f"Finner ikke {args.data / 'np_database.json'}")
+            sys.exit(1)
+        db = sqlite_store.Database(args.sqlite)
+        if db.initialized() and not args.force:
+            print(f"{args.sqlite} har allerede data; bruk --force for å overskrive")
+            sys.exit(2)
+        sqlite_store.import_json(db, args.data / 'np_database.json', args.data / 'park_hints.json',
+                                 args.data / 'leaderboard.json', args.data / 'highscores.json')
+        store = sqlite_store.SQLiteFeatureStore(db)
+        print(f"Importert til {args.sqlite}: {len(store)} features, revisjon {store.revision}")
+    else:
+        if not args.sqlite.exists():
+            print(f"Finner ikke {args.sqlite}")
+            sys.exit(1)
+        out = args.out or args.data
+        out.mkdir(parents=True, exist_ok=True)
+        feats, parks, players = sqlite_store.export_json(sqlite_store.Database(args.sqlite), out / 'np_database.json',
+                                                         out / 'park_hints.json', out / 'leaderboard.json')
+        print(f"Eksportert til {out}: {feats} features, {parks} parker med hint, {players} spillere")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import math
+import threading
+from typing import List, Optional
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from pyproj import Geod
+
+from hints_catalog import norm_key
+
+GEOD = Geod(ellps='WGS84')
+# km per breddegrad, litt i underkant så søkeboksen aldri blir for liten
+KM_PER_DEG_LAT = 110.5
+
+
+class Park:
+    __slots__ = ('key', 'code', 'name', 'ids', 'geom', 'boundary')
+
+    def __init__(self, key, code, name, ids, geom):
+        self.key = key
+        self.code = code
+        self.name = name
+        self.ids = ids
+        self.geom = geom
+        self.boundary = shapely.boundary(geom)
+
+    def summary(self):
+        return { 'code': self.code, 'name': self.name }
+
+
+def geodesic_km(a, b) -> np.ndarray:
+    """Avstand (km) fra hver geometri i a til b, via nærmeste punkt i lon/lat."""
+    lines = shapely.shortest_line(a, b)
+    c = shapely.get_coordinates(lines).reshape(-1, 4)
+    if not len(c):
+        return np.zeros(0)
+    _, _, m = GEOD.inv(c[:, 0], c[:, 1], c[:, 2], c[:, 3])
+    return np.asarray(m, dtype=float) / 1000.0
+
+
+class _Snapshot:
+    # uforanderlig etter bygging, så forespørsler under en ombygging ser én konsistent utgave
+    def __init__(self, parks: List[Park]):
+        geoms = np.array([p.geom for p in parks], dtype=object)
+        shapely.prepare(geoms)
+        self.parks = parks
+        self.by_key = { p.key: p for p in parks }
+        self.by_name = {}
+        for p in parks:
+            self.by_name.setdefault(norm_key(p.name), p)
+        self.by_id = { fid: p for p in parks for fid in p.ids }
+        self.tree = shapely.STRtree(geoms)
+
+    def find(self, code_or_name) -> Optional[Park]:
+        k = norm_key(str(code_or_name or ''))
+        return self.by_key.get(k) or self.by_name.get(k)
+
+    def find_id(self, fid) -> Optional[Park]:
+        # feature-id (properties.id) -> parken den hører til
+        return self.by_id.get(fid)
+
+
+class ParkIndex:
+    """Parkene i FeatureStore som preparerte flater i et STRtree, bygget på nytt når DB-versjonen endres.
+
+    En park er alle park-features med samme kode (eller navn), slått sammen.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.version = None
+        self.snap = _Snapshot([])
+
+    def _build(self, db) -> _Snapshot:
+        groups = {}
+        for f in (db.get('dataset') or {}).get('features') or []:
+            p = f.get('properties') or {}
+            if p.get('source') != 'park' or p.get('status') == 'deleted' or not f.get('geometry'):
+                continue
+            try:
+                g = shape(f['geometry'])
+            except Exception:
+                continue
+            key = norm_key(str(p.get('code') or p.get('name') or ''))
+            if not key or g.is_empty:
+                continue
+            grp = groups.setdefault(key, { 'code': str(p.get('code') or ''), 'name': str(p.get('name') or ''), 'ids': [], 'geoms': [] })
+            grp['ids'].append(p.get('id'))
+            grp['geoms'].append(g)
+        return _Snapshot([Park(key, grp['code'], grp['name'], grp['ids'], shapely.make_valid(shapely.union_all(grp['geoms'])))
+                          for key, grp in groups.items()])
+
+    def refresh(self) -> _Snapshot:
+        version = self.store.current_version()
+        if version == self.version:
+            return self.snap
+        with self.lock:
+            version = self.store.current_version()
+            if version != self.version:
+                self.snap = self._build(self.store.to_db())
+                self.version = version
+            return self.snap
+
+    def is_current(self) -> bool:
+        # om utgaven fra refresh() fortsatt gjelder, uten å bygge en ny
+        return self.store.current_version() == self.version
+
+    # Parkene slås opp i en utgave fra refresh(), og den samme utgaven sendes til metodene under,
+    # så en ombygging midt i en forespørsel ikke blander parker fra to utgaver.
+
+    def find(self, code_or_name) -> Optional[Park]:
+        return self.refresh().find(code_or_name)
+
+    def find_id(self, fid) -> Optional[Park]:
+        return self.refresh().find_id(fid)
+
+    def nearest(self, snap: _Snapshot, geom, n: int, exclude=None) -> List[dict]:
+        """De n nærmeste parkene til geom (punkt eller flate), sortert på geodetisk avstand."""
+        if n <= 0 or not snap.parks:
+            return []
+        x0, y0, x1, y1 = shapely.bounds(geom)
+        d = 0.25
+        while True:
+            idx = [i for i in self._in_box(snap, x0, y0, x1, y1, d) if snap.parks[i] is not exclude]
+            if len(idx) >= n or d > 180:
+                break
+            d *= 2
+        if not idx:
+            return []
+        km = geodesic_km(np.array([snap.parks[i].geom for i in idx], dtype=object), geom)
+        # alle parker nærmere enn den n-te kandidaten ligger innenfor en boks med den avstanden
+        kth = float(np.sort(km)[min(n, len(km)) - 1])
+        seen = set(idx)
+        wider = [i for i in self._in_box(snap, x0, y0, x1, y1, kth / KM_PER_DEG_LAT) if i not in seen and snap.parks[i] is not exclude]
+        if wider:
+            idx = idx + wider
+            km = np.concatenate([km, geodesic_km(np.array([snap.parks[i].geom for i in wider], dtype=object), geom)])
+        order = np.argsort(km, kind='stable')[:n]
+        return [dict(snap.parks[idx[j]].summary(), distanceKm=round(float(km[j]), 2)) for j in order.tolist()]
+
+    @staticmethod
+    def _in_box(snap, x0, y0, x1, y1, d_lat):
+        # boks d_lat breddegrader rundt geometrien; lengdegrader skaleres med cos(breddegrad)
+        lat = min(89.0, max(abs(y0), abs(y1)) + d_lat)
+        d_lon = min(360.0, d_lat / math.cos(math.radians(lat)))
+        return snap.tree.query(shapely.box(x0 - d_lon, y0 - d_lat, x1 + d_lon, y1 + d_lat)).tolist()
+
+    def guess_point(self, snap: _Snapshot, park: Park, lon: float, lat: float, n: int = 3) -> dict:
+        pt = shapely.Point(lon, lat)
+        hit = bool(shapely.contains_xy(park.geom, lon, lat))
+        inside = [park] if hit else [snap.parks[i] for i in snap.tree.query(pt, predicate='intersects').tolist()]
+        return {
+            'hit': hit,
+            'target': park.summary(),
+            # avstand til målparkens grense; ved treff er det hvor langt inne punktet ligger
+            'distanceKm': round(float(geodesic_km(park.boundary, pt)[0]), 2),
+            'inside': inside[0].summary() if inside else None,
+            'nearest': self.nearest(snap, pt, n),
+        }
+
+    def guess_park(self, snap: _Snapshot, park: Park, guessed: Park, n: int = 3) -> dict:
+        hit = park.key == guessed.key
+        return {
+            'hit': hit,
+            'target': park.summary(),
+            'guess': guessed.summary(),
+            # avstand mellom parkene (0 når de grenser mot hverandre)
+            'distanceKm': 0.0 if hit else round(float(geodesic_km(park.geom, guessed.geom)[0]), 2),
+            'nearest': self.nearest(snap, guessed.geom, n, exclude=guessed),
+        }
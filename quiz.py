@@ -0,0 +1,246 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+from array import array
+from pathlib import Path
+
+from metrics import FILE_LOAD
+from response_cache import file_signature
+
+# øk sammen med enrich_parks.QUIZ_FORMAT
+QUIZ_FORMAT = 1
+DIFFICULTIES = ('easy', 'medium', 'hard')
+# forsøk på å trekke en park som ikke er brukt før listen gjennomsøkes
+DRAWS = 32
+# sekunder et spørsmål kan besvares
+ROUND_TTL = 3600
+
+
+def load_secret(path: Path) -> bytes:
+    """Nøkkelen rundene signeres med; lages første gang, så alle worker-prosessene deler den."""
+    if not path.exists():
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            tmp.write_bytes(os.urandom(32))
+            os.chmod(tmp, 0o600)
+            # link feiler hvis en annen prosess kom først; da brukes dens nøkkel
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            tmp.unlink(missing_ok=True)
+    return path.read_bytes()
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class _Index:
+    # uforanderlig etter lasting, så en forespørsel under omlasting ser én konsistent utgave
+    def __init__(self, obj: dict):
+        self.parks = obj.get('parks') or []
+        n = len(self.parks)
+        self.n = n
+        self.counties = obj.get('counties') or []
+        self.municipalities = obj.get('municipalities') or []
+        self.park_counties = obj.get('parkCounties') or [[] for _ in range(n)]
+        self.park_municipalities = obj.get('parkMunicipalities') or [[] for _ in range(n)]
+        self.nearest = obj.get('nearest') or [[] for _ in range(n)]
+        self.size_order = obj.get('sizeOrder') or list(range(n))
+        self.size_rank = [0] * n
+        for r, i in enumerate(self.size_order):
+            self.size_rank[i] = r
+        # km mellom sentroidene, rad for rad (n x n, uint16 little-endian)
+        self.distance = array('H')
+        self.distance.frombytes(base64.b64decode(obj.get('distanceKm') or ''))
+        if sys.byteorder == 'big':
+            self.distance.byteswap()
+        if len(self.distance) != n * n:
+            raise ValueError('distanceKm har feil lengde')
+        self.by_key = { p['key']: i for i, p in enumerate(self.parks) }
+        # mål per vanskelighetsgrad: lett er den største halvdelen
+        self.targets = {
+            'easy': self.size_order[:max(1, (n + 1) // 2)],
+            'medium': list(range(n)),
+            'hard': list(range(n)),
+        }
+
+
+class QuizIndex:
+    """quiz_index.json fra enrich_parks.py, lastet på nytt når filen endres.
+
+    Spørsmål trekkes med oppslag i ferdig beregnede tabeller: mål etter vanskelighetsgrad, og
+    distraktorer fra parker i andre fylker (lett), parker med nesten samme areal (middels) eller
+    de nærmeste parkene (vanskelig).
+
+    Svaret står ikke i spørsmålet. Det har et signert token med alternativene og målets plass blant
+    dem, forskjøvet med en verdi bare serveren kan regne ut; answer() sjekker svaret mot tokenet.
+    """
+
+    def __init__(self, path: Path, secret: bytes, ttl: float = ROUND_TTL):
+        self.path = path
+        self.secret = secret
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._signature = None
+        self._index = None
+
+    def refresh(self):
+        sig = file_signature(self.path)
+        if sig == self._signature:
+            return self._index
+        with self.lock:
+            sig = file_signature(self.path)
+            if sig != self._signature:
+                index = None
+                if sig is not None:
+                    with FILE_LOAD.time(self.path.name):
+                        obj = json.loads(self.path.read_text(encoding='utf-8'))
+                        if obj.get('format') == QUIZ_FORMAT:
+                            index = _Index(obj)
+                self._index = index
+                self._signature = sig
+            return self._index
+
+    def next(self, difficulty: str = 'medium', n: int = 6, exclude=(), rng=random):
+        """Et spørsmål: målparken og n svaralternativer i tilfeldig rekkefølge, eller None uten indeks."""
+        ix = self.refresh()
+        if ix is None or not ix.n:
+            return None
+        excluded = { ix.by_key[k] for k in exclude if k in ix.by_key }
+        target = self._draw(ix.targets[difficulty], excluded, rng)
+        if target is None:
+            # alle er brukt: start på nytt som spill.html
+            target = self._draw(ix.targets[difficulty], (), rng)
+        n = min(n, ix.n)
+        if difficulty == 'hard':
+            pool = ix.nearest[target]
+        elif difficulty == 'medium':
+            # nærmest i arealrekkefølgen først, annenhver større og mindre
+            r = ix.size_rank[target]
+            pool = [ix.size_order[r + d] for k in range(1, n + 1) for d in (-k, k) if 0 <= r + d < ix.n]
+        else:
+            pool = self._far(ix, target, n, rng)
+        chosen = [target]
+        seen = { target }
+        for i in pool:
+            if len(chosen) >= n:
+                break
+            if i not in seen:
+                seen.add(i)
+                chosen.append(i)
+        # for få i tabellen (små databaser): fyll på med tilfeldige parker
+        while len(chosen) < n:
+            i = rng.randrange(ix.n)
+            if i not in seen:
+                seen.add(i)
+                chosen.append(i)
+        rng.shuffle(chosen)
+        p = ix.parks[target]
+        keys = [ix.parks[i]['key'] for i in chosen]
+        return {
+            'difficulty': difficulty,
+            'token': self._token(keys, chosen.index(target)),
+            # det spilleren får vite om målet
+            'clue': {
+                'areaKm2': p.get('areaKm2'),
+                'counties': [ix.counties[c] for c in ix.park_counties[target]],
+                'municipalities': [ix.municipalities[m] for m in ix.park_municipalities[target]],
+            },
+            'choices': [{ 'key': ix.parks[i]['key'], 'code': ix.parks[i].get('code'), 'name': ix.parks[i].get('name') }
+                        for i in chosen],
+        }
+
+    def answer(self, token: str, key: str) -> dict:
+        """Sjekk et svar (nøkkelen til et av alternativene); ValueError ved ugyldig eller utløpt token."""
+        keys, pos = self._open(token)
+        if key not in keys:
+            raise ValueError('Unknown choice')
+        target = keys[pos]
+        out = { 'correct': key == target, 'answer': key, 'target': { 'key': target } }
+        ix = self.refresh()
+        if ix is not None and target in ix.by_key:
+            t = ix.by_key[target]
+            p = ix.parks[t]
+            out['target'] = {
+                'key': target, 'code': p.get('code'), 'name': p.get('name'), 'areaKm2': p.get('areaKm2'),
+                'counties': [ix.counties[c] for c in ix.park_counties[t]],
+                'municipalities': [ix.municipalities[m] for m in ix.park_municipalities[t]],
+            }
+            if key in ix.by_key:
+                out['distanceKm'] = ix.distance[t * ix.n + ix.by_key[key]]
+        return out
+
+    def round(self, key: str) -> str:
+        """Token for en kartrunde (/guess) med målparken key; klienten kan ikke velge eller bytte målet."""
+        return self._token([key], 0, b'guess:')
+
+    def round_target(self, token: str) -> str:
+        """Målparken i et token fra round(); ValueError ved ugyldig eller utløpt token."""
+        keys, pos = self._open(token, b'guess:')
+        return keys[pos]
+
+    # -- token ---------------------------------------------------------
+
+    def _offset(self, nonce: str, n: int) -> int:
+        return int.from_bytes(hmac.new(self.secret, b'pos:' + nonce.encode('ascii'), hashlib.sha256).digest()[:4], 'big') % n
+
+    def _token(self, keys, pos: int, purpose: bytes = b'') -> str:
+        nonce = os.urandom(8).hex()
+        body = json.dumps({ 'c': keys, 'p': (pos + self._offset(nonce, len(keys))) % len(keys), 'n': nonce,
+                            'e': int(time.time() + self.ttl) }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return _b64(body) + '.' + _b64(self._mac(purpose, body))
+
+    def _mac(self, purpose: bytes, body: bytes) -> bytes:
+        # purpose skiller tokentypene: et quiz-token kan ikke brukes som kartrunde, og omvendt
+        return hmac.new(self.secret, purpose + body, hashlib.sha256).digest()[:16]
+
+    def _open(self, token: str, purpose: bytes = b''):
+        try:
+            body, mac = (_unb64(part) for part in str(token).split('.'))
+            if not hmac.compare_digest(mac, self._mac(purpose, body)):
+                raise ValueError('bad signature')
+            obj = json.loads(body)
+            keys, enc, nonce, expires = obj['c'], int(obj['p']), str(obj['n']), float(obj['e'])
+        except (ValueError, TypeError, KeyError, UnicodeDecodeError):
+            raise ValueError('Invalid token')
+        if not keys:
+            raise ValueError('Invalid token')
+        if time.time() > expires:
+            raise ValueError('Expired token')
+        return keys, (enc - self._offset(nonce, len(keys))) % len(keys)
+
+    @staticmethod
+    def _draw(candidates, excluded, rng):
+        if not candidates:
+            return None
+        for _ in range(DRAWS):
+            i = candidates[rng.randrange(len(candidates))]
+            if i not in excluded:
+                return i
+        rest = [i for i in candidates if i not in excluded]
+        return rng.choice(rest) if rest else None
+
+    @staticmethod
+    def _far(ix, target, n, rng):
+        # tilfeldige parker som ikke deler fylke med målet
+        mine = set(ix.park_counties[target])
+        out = []
+        for _ in range(n * 4):
+            i = rng.randrange(ix.n)
+            if i != target and not mine.intersection(ix.park_counties[i]):
+                out.append(i)
+                if len(out) >= n:
+                    break
+        return out
@@ -0,0 +1,108 @@
+import gzip
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from metrics import CACHE_LOOKUPS
+
+
+def file_signature(path: Path):
+    # (inode, mtime, størrelse) – None hvis filen ikke finnes; atomiske skrivinger gir ny inode,
+    # så to raske skrivinger med samme størrelse skilles selv om mtime har grov oppløsning
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class CachedResponse:
+    __slots__ = ('version', 'body', 'gzip_body', 'etag', 'content_type')
+
+    def __init__(self, version, body: bytes, content_type: str):
+        self.version = version
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=6, mtime=0)
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.content_type = content_type
+
+
+class ResponseCache:
+    """Ferdig kodede svar (rå + gzip) per nøkkel, gyldige så lenge versjonen er uendret."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, version_fn, build_fn, lock=None, content_type='application/json'):
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version_fn():
+            CACHE_LOOKUPS.inc(key, 'hit')
+            return entry
+        # bygg på nytt; versjonen leses etter build_fn (som selv kan skrive filen)
+        with (lock or self._lock):
+            entry = self._entries.get(key)
+            version = version_fn()
+            if entry is not None and entry.version == version:
+                # en annen tråd bygget den mens vi ventet på låsen
+                CACHE_LOOKUPS.inc(key, 'hit')
+                return entry
+            CACHE_LOOKUPS.inc(key, 'miss')
+            body = build_fn()
+            entry = CachedResponse(version_fn(), body, content_type)
+            self._entries[key] = entry
+            return entry
+
+    def get_snapshot(self, key, version_fn, snapshot_fn, build_fn, lock, content_type='application/json'):
+        """Som get, for bygg som er for tunge til å kjøres under lagerets lås.
+
+        snapshot_fn gir (versjon, data) og holder lagerets lås bare mens den kopierer; build_fn(data)
+        kjøres under lock (én per nøkkel), og svaret bufres med versjonen fra snapshotet.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version_fn():
+            CACHE_LOOKUPS.inc(key, 'hit')
+            return entry
+        with lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version_fn():
+                CACHE_LOOKUPS.inc(key, 'hit')
+                return entry
+            CACHE_LOOKUPS.inc(key, 'miss')
+            version, data = snapshot_fn()
+            entry = CachedResponse(version, build_fn(data), content_type)
+            self._entries[key] = entry
+            return entry
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
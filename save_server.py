@@ -1,378 +1,882 @@
 import http.server
+import itertools
 import socketserver
 import json
-import re
+import logging
 import os
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urlparse, parse_qs
 
+from response_cache import ResponseCache, etag_matches, accepts_gzip
+from feature_store import FeatureStore, BatchError, Conflict, parse_id
+from journal import start_compactor
+from leaderboard import Leaderboard
+from hints_catalog import HintsCatalog
+from admission import Gate, RateLimiter, retry_after
+from quiz import QuizIndex, DIFFICULTIES, load_secret
+import metrics
+
+try:
+    import lod
+    from park_index import ParkIndex
+    from locate import Locator, start_warmer as start_locate_warmer
+except ImportError:
+    # shapely/numpy/pyproj mangler – /db?lod=, /guess og /locate svarer 501
+    lod = None
+    ParkIndex = None
+    Locator = start_locate_warmer = None
+
 ROOT = Path(__file__).resolve().parent
-DB_FILE = ROOT / 'np_database.json'
-HINTS_FILE = ROOT / 'park_hints.json'
-HIGHSCORES_FILE = ROOT / 'highscores.json'
-
-def load_db():
-    return json.loads(DB_FILE.read_text(encoding='utf-8'))
-
-def save_db(obj):
-    backup = DB_FILE.with_suffix('.json.bak')
-    if not backup.exists():
-        backup.write_text(DB_FILE.read_text(encoding='utf-8'), encoding='utf-8')
-    DB_FILE.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding='utf-8')
-
-def load_highscores():
-    if not HIGHSCORES_FILE.exists():
-        print(f"⚠️ HIGHSCORES FILE MISSING: {HIGHSCORES_FILE} - returning empty list with 10 EMPTY slots")
-        # Returner 10 tomme plasser
-        return [{"name": "<EMPTY>", "score": 0} for _ in range(10)]
+# datafilene kan ligge et annet sted enn koden (DATA_DIR), f.eks. på en egen disk eller i bench.py
+DATA_DIR = Path(os.environ.get('DATA_DIR') or ROOT)
+DB_FILE = DATA_DIR / 'np_database.json'
+HINTS_FILE = DATA_DIR / 'park_hints.json'
+HIGHSCORES_FILE = DATA_DIR / 'highscores.json'
+LEADERBOARD_FILE = DATA_DIR / 'leaderboard.json'
+# bygges av enrich_parks.py
+QUIZ_FILE = DATA_DIR / 'quiz_index.json'
+# nøkkelen quiz-tokenene signeres med; QUIZ_SECRET, ellers en fil som lages første gang
+QUIZ_SECRET_FILE = DATA_DIR / 'quiz_secret'
+# STORE_BACKEND=sqlite: alt i én SQLite-fil (WAL) i stedet for JSON-filene over
+STORE_BACKEND = os.environ.get('STORE_BACKEND', 'json')
+SQLITE_FILE = Path(os.environ.get('SQLITE_PATH') or DATA_DIR / 'np_store.sqlite3')
+KEEPALIVE_TIMEOUT = 15
+# /db strømmes i biter av denne størrelsen (før gzip)
+STREAM_CHUNK = 64 * 1024
+
+def env_int(name, default):
     try:
-        data = json.loads(HIGHSCORES_FILE.read_text(encoding='utf-8'))
-        print(f"✅ Loaded {len(data) if isinstance(data, list) else 'unknown'} hi-scores from file")
-        # Håndter både gammel format {"list": [...]} og ny format [...]
-        if isinstance(data, dict) and 'list' in data:
-            scores = data['list']
-        else:
-            scores = data
-        
-        # Sørg for at det alltid er 10 plasser
-        while len(scores) < 10:
-            scores.append({"name": "<EMPTY>", "score": 0})
-        
-        return scores
-    except Exception as e:
-        print(f"❌ Error reading highscores file: {e}")
-        # Returner 10 tomme plasser ved feil
-        return [{"name": "<EMPTY>", "score": 0} for _ in range(10)]
-
-def save_highscores(scores):
-    backup = HIGHSCORES_FILE.with_suffix('.json.bak')
-    if not backup.exists() and HIGHSCORES_FILE.exists():
-        backup.write_text(HIGHSCORES_FILE.read_text(encoding='utf-8'), encoding='utf-8')
-    HIGHSCORES_FILE.write_text(json.dumps(scores, ensure_ascii=False, indent=2), encoding='utf-8')
-
-def ensure_ids(db_obj):
-    changed = False
-    feats = db_obj.get('dataset', {}).get('features') or []
-    # finn maks eksisterende id
-    max_id = 0
-    for f in feats:
-        pr = f.get('properties') or {}
-        try:
-            i = int(pr.get('id'))
-        except Exception:
-            i = None
-        if isinstance(i, int):
-            if i > max_id:
-                max_id = i
-        else:
-            pr['id'] = None
-    # tildel nye id-er for de som mangler
-    for f in feats:
-        pr = f.get('properties') or {}
-        try:
-            i = int(pr.get('id'))
-        except Exception:
-            i = None
-        if not isinstance(i, int):
-            max_id += 1
-            pr['id'] = max_id
-            f['properties'] = pr
-            changed = True
-    return changed
+        return int(os.environ.get(name, str(default)))
+    except Exception:
+        return default
+
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, str(default)))
+    except Exception:
+        return default
+
+# største request-body per endepunkt (bytes); MAX_BODY_<ENDEPUNKT> overstyrer, f.eks. MAX_BODY_SAVE_DB,
+# og MAX_BODY gjelder andre stier. Større forespørsler avvises med 413 før body leses.
+BODY_LIMITS = {
+    '/save-db': 64 * 1024 * 1024,
+    '/batch': 16 * 1024 * 1024,
+    '/save-hints': 256 * 1024,
+    '/patch-hints': 64 * 1024,
+    '/update': 1024 * 1024,
+    '/move': 64 * 1024,
+    '/delete': 4 * 1024,
+    '/highscores': 4 * 1024,
+    '/guess': 4 * 1024,
+    '/quiz/answer': 4 * 1024,
+    '/locate': 1024 * 1024,
+}
+BODY_LIMITS = { p: env_int('MAX_BODY_' + p.strip('/').replace('-', '_').upper(), n) for p, n in BODY_LIMITS.items() }
+MAX_BODY = env_int('MAX_BODY', 64 * 1024)
+# skrivinger: WRITE_CONCURRENCY samtidig, WRITE_QUEUE venter i inntil WRITE_TIMEOUT s, resten får 503;
+# til sammen ikke flere enn WORKERS, så en skriveflom ikke holder alle arbeidstrådene
+WRITE_PATHS = frozenset(('/save-db', '/save-hints', '/patch-hints', '/highscores', '/batch', '/update', '/delete', '/move'))
+WRITES = Gate(env_int('WRITE_CONCURRENCY', 2), env_int('WRITE_QUEUE', 6), env_float('WRITE_TIMEOUT', 10))
+# forbindelser som venter på en arbeidstråd; flere enn MAX_PENDING avvises med 503
+MAX_PENDING = env_int('MAX_PENDING', 64)
+RETRY_AFTER = env_float('RETRY_AFTER', 1)
+# bodyer opp til denne størrelsen leses før 429/503 (se Handler.reject)
+DRAIN_LIMIT = 1024 * 1024
+# POST /highscores per klient: HIGHSCORE_BURST på en gang, deretter HIGHSCORE_RATE per sekund (0 slår av)
+HIGHSCORE_RATE = env_float('HIGHSCORE_RATE', 0.2)
+HIGHSCORE_LIMIT = RateLimiter(HIGHSCORE_RATE, env_float('HIGHSCORE_BURST', 5)) if HIGHSCORE_RATE > 0 else None
+# /locate: cellestørrelse i rutenettet (grader nord–sør, dobbelt så bredt øst–vest) og største batch
+LOCATE_CELL_DEG = env_float('LOCATE_CELL_DEG', 0.02)
+LOCATE_MAX_POINTS = env_int('LOCATE_MAX_POINTS', 10000)
+# bak en proxy (Render): klienten er TRUSTED_PROXIES ledd fra slutten av X-Forwarded-For
+TRUSTED_PROXIES = env_int('TRUSTED_PROXIES', 0)
+
+LOG = logging.getLogger('np.server')
+# andel vellykkede forespørsler som logges (LOG_LEVEL=DEBUG logger alle); 5xx logges alltid
+LOG_SAMPLE = env_float('LOG_SAMPLE', 0.01)
+
+# ferdig kodede GET-svar for /db, /hints og /highscores
+RESPONSE_CACHE = ResponseCache()
+
+if STORE_BACKEND == 'sqlite':
+    import sqlite_store
+    SQLITE_DB = sqlite_store.Database(SQLITE_FILE)
+    # første oppstart: JSON-filene importeres (se migrate_store.py)
+    if not SQLITE_DB.initialized():
+        sqlite_store.import_json(SQLITE_DB, DB_FILE, HINTS_FILE, LEADERBOARD_FILE, HIGHSCORES_FILE, only_if_empty=True)
+    STORE = sqlite_store.SQLiteFeatureStore(SQLITE_DB, changelog=env_int('DB_CHANGELOG', 1000))
+    LEADERBOARD = sqlite_store.SQLiteLeaderboard(SQLITE_DB)
+    HINTS = sqlite_store.SQLiteHints(SQLITE_DB)
+else:
+    # np_database.json i minnet; endringer journalføres til np_database.journal
+    STORE = FeatureStore(DB_FILE, compact_every=env_int('DB_COMPACT_EVERY', 1000), changelog=env_int('DB_CHANGELOG', 1000))
+    # alle spilleres beste score; highscores.json brukes bare som startdata første gang
+    LEADERBOARD = Leaderboard(LEADERBOARD_FILE, seed_path=HIGHSCORES_FILE)
+    # park_hints.json i minnet, med oppslag på kode og normalisert navn
+    HINTS = HintsCatalog(HINTS_FILE)
+
+# parkflatene i et STRtree for /guess; bygges på nytt når databasen endres
+PARKS = ParkIndex(STORE) if ParkIndex else None
+# fylke/kommune/park for punkter (/locate); rutenettene bygges i bakgrunnen av start_background()
+LOCATOR = Locator(PARKS, LOCATE_CELL_DEG) if Locator else None
+# tabellene for /quiz/next; lastes på nytt når enrich_parks.py skriver filen
+QUIZ = QuizIndex(QUIZ_FILE, os.environ.get('QUIZ_SECRET', '').encode('utf-8') or load_secret(QUIZ_SECRET_FILE))
+
+def encode_json(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+def build_db_response() -> bytes:
+    return STORE.encode()
+
+def build_hints_response() -> bytes:
+    return HINTS.encode()
+
+def build_highscores_response() -> bytes:
+    return encode_json(LEADERBOARD.legacy_top10())
+
+def db_snapshot():
+    # (versjon, dokument) under lagerets lås; versjonen leses først, så en skriving i mellomtiden
+    # bare gir et svar merket med en eldre versjon (og et nytt bygg neste gang), aldri omvendt
+    with STORE.lock:
+        return STORE.current_version(), STORE.to_db()
+
+# LOD-byggene (forenkling av alle flatene) tar sekunder; de kjøres på en kopi, med én lås per nivå
+LOD_LOCKS = { level: threading.Lock() for level in (lod.LEVELS if lod is not None else ()) }
+
+# DB_STREAM=1: /db strømmes som standard i stedet for å bygges og bufres i sin helhet
+DB_STREAM = os.environ.get('DB_STREAM', '0') == '1'
+
+# path -> (cache-nøkkel, versjonsfunksjon, bygg, lås)
+CACHED_GETS = {
+    '/db': ('db', lambda: STORE.current_version(), build_db_response, STORE.lock),
+    '/hints': ('hints', lambda: HINTS.current_version(), build_hints_response, HINTS.lock),
+    '/highscores': ('highscores', lambda: LEADERBOARD.current_version(), build_highscores_response, LEADERBOARD.lock),
+}
+
+# endepunkt-label i /metrics; andre stier telles som 'other' så antallet serier er begrenset
+ENDPOINTS = frozenset(CACHED_GETS) | {
+    '/db/changes', '/guess', '/guess/round', '/locate', '/quiz/next', '/quiz/answer', '/hints/search', '/leaderboard', '/leaderboard/rank', '/leaderboard/around', '/metrics',
+    '/save-db', '/save-hints', '/patch-hints', '/batch', '/update', '/delete', '/move',
+}
+METHODS = frozenset(('GET', 'POST', 'OPTIONS'))
+
+START_TIME = time.time()
+REQUESTS = metrics.Counter('np_http_requests_total', 'HTTP-forespørsler.', ('method', 'endpoint', 'status'))
+LATENCY = metrics.Histogram('np_http_request_duration_seconds', 'Tid fra forespørselen er lest til svaret er skrevet.', ('method', 'endpoint'))
+REQUEST_BYTES = metrics.Histogram('np_http_request_bytes', 'Størrelse på request-body.', ('endpoint',), buckets=metrics.SIZE_BUCKETS)
+RESPONSE_BYTES = metrics.Histogram('np_http_response_bytes', 'Størrelse på svaret slik det ble sendt (etter gzip).', ('endpoint',), buckets=metrics.SIZE_BUCKETS)
+REJECTED = metrics.Counter('np_http_rejected_total', 'Forespørsler avvist av opptakskontrollen.', ('endpoint', 'reason'))
+metrics.Gauge('np_write_requests', 'Skrivinger som kjører eller venter på plass.',
+              lambda: { ('active',): WRITES.active, ('waiting',): WRITES.waiting }, ('state',))
+metrics.Gauge('np_db_revision', 'Databasens revisjon.', lambda: STORE.revision)
+metrics.Gauge('np_db_features', 'Antall features i databasen.', lambda: len(STORE))
+metrics.Gauge('np_leaderboard_players', 'Spillere i topplisten.', LEADERBOARD.players)
+metrics.Gauge('np_process_start_time_seconds', 'Starttid (Unix-tid).', lambda: START_TIME)
+
+def compress_chunks(chunks, z):
+    for data in chunks:
+        if z:
+            data = z.compress(data)
+        if data:
+            yield data
+    if z:
+        yield z.flush()
 
 class Handler(http.server.SimpleHTTPRequestHandler):
+    # HTTP/1.1 gir keep-alive; alle svar må derfor ha Content-Length
+    protocol_version = 'HTTP/1.1'
+    # lukk inaktive keep-alive-forbindelser så de ikke holder på en arbeidstråd
+    timeout = KEEPALIVE_TIMEOUT
+    # header og body skrives separat; uten TCP_NODELAY gir keep-alive ~40 ms ekstra (delayed ACK)
+    disable_nagle_algorithm = True
+
+    # -- måling og logging per forespørsel --------------------------------
+
+    def parse_request(self):
+        # klokken starter når forespørselslinjen er lest, så ventetid på keep-alive ikke telles
+        self._t0 = time.perf_counter()
+        self._status = 0
+        self._sent = 0
+        # en forespørselslinje som ikke kan tolkes (400/431) setter ikke path; telles da som 'other'
+        # og ikke under stien fra forrige forespørsel på forbindelsen
+        self.path = ''
+        return super().parse_request()
+
+    def handle_one_request(self):
+        self._t0 = None
+        super().handle_one_request()
+        if self._t0 is not None:
+            self.record_request()
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def record_request(self):
+        dt = time.perf_counter() - self._t0
+        path = (getattr(self, 'path', '') or '').split('?', 1)[0]
+        endpoint = path if path in ENDPOINTS else 'other'
+        command = getattr(self, 'command', None)
+        method = command if command in METHODS else 'other'
+        status = self._status
+        if metrics.ENABLED:
+            REQUESTS.inc(method, endpoint, str(status))
+            LATENCY.observe(dt, method, endpoint)
+            RESPONSE_BYTES.observe(self._sent, endpoint)
+            if method == 'POST':
+                REQUEST_BYTES.observe(int(self.headers.get('Content-Length') or 0), endpoint)
+        if status >= 500:
+            level = logging.WARNING
+        elif LOG.isEnabledFor(logging.DEBUG):
+            level = logging.DEBUG
+        elif LOG_SAMPLE > 0 and random.random() < LOG_SAMPLE:
+            level = logging.INFO
+        else:
+            return
+        LOG.log(level, 'request method=%s path=%s status=%s ms=%.2f bytes=%d sample=%g',
+                command, path, status, dt * 1000, self._sent, 1.0 if level != logging.INFO else LOG_SAMPLE)
+
+    def log_request(self, code='-', size='-'):
+        # tilgangslogg skrives av record_request (samplet)
+        pass
+
+    def log_message(self, format, *args):
+        LOG.info('http %s %s', self.address_string(), format % args)
+
     def end_headers(self):
         # CORS
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-Match')
+        # andre forbindelser venter på en arbeidstråd: lukk denne etter svaret så de slipper til
+        if not self.close_connection and getattr(self.server, 'pending', 0) > 0:
+            self.close_connection = True
+        if self.close_connection:
+            self.send_header('Connection', 'close')
         super().end_headers()
 
-    def do_OPTIONS(self):
-        self.send_response(204)
+    def reply(self, status, body=b'', content_type=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
+        if body:
+            self.wfile.write(body)
+            self._sent = len(body)
+
+    def reply_json(self, obj, status=200):
+        self.reply(status, encode_json(obj), 'application/json')
+
+    def reject(self, status, body, reason, endpoint, wait=None, length=0):
+        # små bodyer leses og kastes så klienten får svaret og ikke en brutt forbindelse midt i sendingen;
+        # forbindelsen lukkes uansett etter svaret
+        REJECTED.inc(endpoint, reason)
+        if 0 < length <= DRAIN_LIMIT:
+            self.rfile.read(length)
+        self.close_connection = True
+        self.send_response(status)
+        if wait is not None:
+            self.send_header('Retry-After', retry_after(wait))
+            self.send_header('Access-Control-Expose-Headers', 'Retry-After')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self._sent = len(body)
+
+    def client_id(self):
+        if TRUSTED_PROXIES > 0:
+            hops = [h.strip() for h in (self.headers.get('X-Forwarded-For') or '').split(',') if h.strip()]
+            if hops:
+                return hops[-min(TRUSTED_PROXIES, len(hops))]
+        return self.client_address[0]
+
+    def reply_cached(self, entry):
+        if etag_matches(self.headers.get('If-None-Match'), entry.etag):
+            self.send_response(304)
+            self.send_header('ETag', entry.etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        use_gzip = accepts_gzip(self.headers.get('Accept-Encoding'))
+        body = entry.gzip_body if use_gzip else entry.body
+        self.send_response(200)
+        self.send_header('Content-Type', entry.content_type)
+        self.send_header('ETag', entry.etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self._sent = len(body)
+
+    def reply_stream(self, chunks, content_type='application/json'):
+        # chunked transfer encoding
+        for data in self.start_stream(chunks, content_type):
+            self.write_chunk(data)
+        self.wfile.write(b'0\r\n\r\n')
+
+    def start_stream(self, chunks, content_type):
+        # sender headerne og gir body-bitene; med gzip komprimeres hver bit etter hvert som den kodes
+        z = None
+        if accepts_gzip(self.headers.get('Accept-Encoding')):
+            z = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if z:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        return compress_chunks(chunks, z)
+
+    def write_chunk(self, data):
+        if data:
+            self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+            self._sent += len(data)
+
+    def do_OPTIONS(self):
+        self.reply(204)
 
     def do_GET(self):
         parsed = urlparse(self.path)
-        if parsed.path == '/db':
+        cached = CACHED_GETS.get(parsed.path)
+        if parsed.path == '/db' and 'lod=' in (parsed.query or ''):
+            self.lod_get(parse_qs(parsed.query or '').get('lod', [''])[0])
+            return
+        if parsed.path == '/db' and self.stream_db(parse_qs(parsed.query or '')):
             try:
-                obj = load_db()
-                # sørg for at alle features har id
-                if ensure_ids(obj):
-                    save_db(obj)
+                # første bit hentes før headerne sendes: SQLite-lagringen er en lat generator,
+                # så feil viser seg først her og skal gi 500 og ikke en avkortet body
+                chunks = STORE.iter_encoded(STREAM_CHUNK)
+                first = next(chunks, b'')
             except Exception:
-                self.send_response(500); self.end_headers(); self.wfile.write(b'{}'); return
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(obj, ensure_ascii=False).encode('utf-8'))
+                LOG.exception('streaming /db failed')
+                self.reply(500, b'{}'); return
+            self.reply_stream(itertools.chain((first,), chunks))
             return
-        if parsed.path == '/highscores':
+        if parsed.path == '/metrics' and metrics.ENABLED:
+            self.reply(200, metrics.render(), 'text/plain; version=0.0.4; charset=utf-8')
+            return
+        if cached:
+            key, version, build, lock = cached
             try:
-                scores = load_highscores()
+                entry = RESPONSE_CACHE.get(key, version, build, lock=lock)
             except Exception:
-                self.send_response(500); self.end_headers(); self.wfile.write(b'[]'); return
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(scores, ensure_ascii=False).encode('utf-8'))
+                self.reply(500, b'[]' if key == 'highscores' else b'{}'); return
+            self.reply_cached(entry)
             return
-        if parsed.path == '/hints':
-            try:
-                if not HINTS_FILE.exists():
-                    hints = { 'parks': {} }
+        if parsed.path == '/guess':
+            q = parse_qs(parsed.query or '')
+            self.guess({ k: v[0] for k, v in q.items() })
+            return
+        if parsed.path == '/guess/round':
+            self.guess_round(parse_qs(parsed.query or ''))
+            return
+        if parsed.path == '/locate':
+            q = parse_qs(parsed.query or '')
+            self.locate_get({ k: v[0] for k, v in q.items() })
+            return
+        if parsed.path == '/db/changes':
+            self.db_changes(parse_qs(parsed.query or ''))
+            return
+        if parsed.path == '/hints/search':
+            self.hints_search(parse_qs(parsed.query or ''))
+            return
+        if parsed.path == '/quiz/next':
+            self.quiz_next(parse_qs(parsed.query or ''))
+            return
+        if parsed.path.startswith('/leaderboard'):
+            self.leaderboard_get(parsed.path, parse_qs(parsed.query or ''))
+            return
+        self.reply(404, b'Not found')
+
+    def stream_db(self, q):
+        # ?stream=1|0 overstyrer DB_STREAM; HTTP/1.0-klienter kan ikke ta imot chunked
+        if self.request_version == 'HTTP/1.0':
+            return False
+        mode = (q.get('stream') or [''])[0]
+        return mode == '1' if mode in ('0', '1') else DB_STREAM
+
+    def db_changes(self, q):
+        # bare features endret etter ?since=N; full kopi når loggen ikke rekker så langt tilbake
+        since = parse_id((q.get('since') or [None])[0])
+        if since is None:
+            self.reply(400, b'Missing since'); return
+        try:
+            with STORE.lock:
+                res = STORE.changes(since)
+                if res is None:
+                    entry = RESPONSE_CACHE.get('db', lambda: STORE.current_version(), build_db_response, lock=STORE.lock)
+                    body = b'{"full":true,"revision":' + str(STORE.revision).encode() + b',"db":' + entry.body + b'}'
                 else:
-                    hints = json.loads(HINTS_FILE.read_text(encoding='utf-8'))
+                    revision, changed, deleted = res
+                    body = encode_json({ 'full': False, 'since': since, 'revision': revision, 'changed': changed, 'deleted': deleted })
+        except Exception:
+            self.reply(500, b'{}'); return
+        self.reply(200, body, 'application/json')
+
+    def base_revision(self, body):
+        # betinget skriving: { baseRevision: N } eller If-Match: "N"
+        base = body.get('baseRevision')
+        if base is None:
+            tag = (self.headers.get('If-Match') or '').strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            base = tag.strip('"') or None
+        return parse_id(base) if base is not None else None
+
+    def reply_conflict(self, e):
+        self.reply_json({ 'ok': False, 'error': 'Conflict', 'revision': e.revision }, status=409)
+
+    def lod_get(self, level):
+        # forenklet, kvantisert TopoJSON av databasen; ett bufret svar per nivå og DB-versjon
+        if lod is None:
+            self.reply(501, b'LOD requires shapely'); return
+        if level not in lod.LEVELS:
+            self.reply(400, b'Invalid lod'); return
+        try:
+            entry = RESPONSE_CACHE.get_snapshot('db:' + level, STORE.current_version, db_snapshot,
+                                                lambda db: lod.encode(lod.build_level(db, level)), LOD_LOCKS[level])
+        except Exception:
+            self.reply(500, b'{}'); return
+        self.reply_cached(entry)
+
+    def guess_round(self, q):
+        # ?exclude=nøkkel,nøkkel -> { token, target: { key, code, name } }; målet trekkes på serveren
+        if PARKS is None:
+            self.reply(501, b'Guess requires shapely'); return
+        exclude = { k for v in q.get('exclude') or [] for k in v.split(',') if k }
+        try:
+            snap = PARKS.refresh()
+            pool = [p for p in snap.parks if p.key not in exclude] or snap.parks
+            if not pool:
+                self.reply(404, b'No parks'); return
+            park = random.choice(pool)
+            token = QUIZ.round(park.key)
+        except Exception as e:
+            LOG.error('guess round failed: %s', e)
+            self.reply(500, b'{}'); return
+        self.reply_json({ 'token': token, 'target': dict(park.summary(), key=park.key) })
+
+    def guess(self, params):
+        # mål: token fra /guess/round; gjett: lat+lon, id (feature-id) eller guess (kode/navn)
+        if PARKS is None:
+            self.reply(501, b'Guess requires shapely'); return
+        def park_arg(name_key, id_key):
+            if params.get(id_key) not in (None, ''):
+                fid = parse_id(params.get(id_key))
+                return snap.find_id(fid) if fid is not None else None
+            if params.get(name_key) not in (None, ''):
+                return snap.find(params.get(name_key))
+            return False
+        token = params.get('token')
+        if not isinstance(token, str) or not token:
+            self.reply(400, b'Missing token'); return
+        try:
+            target = QUIZ.round_target(token)
+        except ValueError as e:
+            self.reply(400, str(e).encode('utf-8')); return
+        try:
+            n = max(0, min(10, int(params.get('n', 3))))
+        except (TypeError, ValueError):
+            n = 3
+        try:
+            # én utgave av parkindeksen for hele forespørselen
+            snap = PARKS.refresh()
+            park = snap.find(target)
+            if park is None:
+                # parken er fjernet eller har fått ny kode etter at runden ble gitt ut
+                self.reply(404, b'Unknown target'); return
+            guessed = park_arg('guess', 'id')
+            if guessed is None:
+                self.reply(404, b'Unknown park'); return
+            if guessed is not False:
+                result = PARKS.guess_park(snap, park, guessed, n)
+            else:
+                try:
+                    lat, lon = float(params.get('lat')), float(params.get('lon'))
+                except (TypeError, ValueError):
+                    self.reply(400, b'Missing lat/lon or id'); return
+                if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                    self.reply(400, b'Invalid lat/lon'); return
+                result = PARKS.guess_point(snap, park, lon, lat, n)
+        except Exception as e:
+            LOG.error('guess failed: %s', e)
+            self.reply(500, b'{}'); return
+        self.reply_json(result)
+
+    def locate_get(self, params):
+        # ?lat=..&lon=.. -> { county, municipality, park }
+        if LOCATOR is None:
+            self.reply(501, b'Locate requires shapely'); return
+        try:
+            lat, lon = float(params.get('lat')), float(params.get('lon'))
+        except (TypeError, ValueError):
+            self.reply(400, b'Missing lat/lon'); return
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            self.reply(400, b'Invalid lat/lon'); return
+        try:
+            result = LOCATOR.locate_one(lat, lon)
+        except Exception as e:
+            LOG.error('locate failed: %s', e)
+            self.reply(500, b'{}'); return
+        self.reply_json(dict(result, lat=lat, lon=lon))
+
+    def locate_batch(self, body):
+        # { "points": [[lat, lon], ...] } -> { "results": [...] } i samme rekkefølge
+        if LOCATOR is None:
+            self.reply(501, b'Locate requires shapely'); return
+        points = body.get('points')
+        if not isinstance(points, list):
+            self.reply(400, b'Missing points'); return
+        if len(points) > LOCATE_MAX_POINTS:
+            self.reply(400, b'Too many points'); return
+        try:
+            lat, lon = LOCATOR.parse_points(points)
+        except ValueError:
+            self.reply(400, b'Invalid points'); return
+        try:
+            results = LOCATOR.locate(lat, lon)
+        except Exception as e:
+            LOG.error('locate failed: %s', e)
+            self.reply(500, b'{}'); return
+        self.reply_json({ 'results': results })
+
+    def hints_search(self, q):
+        # ?q=ord … (alle må finnes, det siste også som prefiks) og/eller year=opprettelsesår
+        text = (q.get('q') or [''])[0]
+        year = (q.get('year') or [None])[0]
+        try:
+            year = int(year) if year not in (None, '') else None
+            limit = max(1, min(100, int((q.get('limit') or [20])[0])))
+        except (TypeError, ValueError):
+            self.reply(400, b'Invalid year/limit'); return
+        if not text.strip() and year is None:
+            self.reply(400, b'Missing q'); return
+        try:
+            result = HINTS.search(text, limit, year)
+        except Exception as e:
+            LOG.error('hints search failed: %s', e)
+            self.reply(500, b'{}'); return
+        self.reply_json(result)
+
+    def quiz_next(self, q):
+        # ?difficulty=easy|medium|hard&n=6&exclude=nøkkel,nøkkel (parker som allerede er spurt om)
+        difficulty = (q.get('difficulty') or ['medium'])[0]
+        if difficulty not in DIFFICULTIES:
+            self.reply(400, b'Invalid difficulty'); return
+        try:
+            n = max(2, min(10, int((q.get('n') or [6])[0])))
+        except (TypeError, ValueError):
+            n = 6
+        exclude = [k for v in q.get('exclude') or [] for k in v.split(',') if k]
+        try:
+            question = QUIZ.next(difficulty, n, exclude)
+        except Exception as e:
+            LOG.error('quiz failed: %s', e)
+            self.reply(500, b'{}'); return
+        if question is None:
+            self.reply(404, b'No quiz index; run enrich_parks.py'); return
+        self.reply_json(question)
+
+    def quiz_answer(self, body):
+        # { token, answer: nøkkelen til alternativet spilleren valgte }
+        token, key = body.get('token'), body.get('answer')
+        if not isinstance(token, str) or not isinstance(key, str):
+            self.reply(400, b'Missing token/answer'); return
+        try:
+            result = QUIZ.answer(token, key)
+        except ValueError as e:
+            self.reply(400, str(e).encode('utf-8')); return
+        except Exception as e:
+            LOG.error('quiz answer failed: %s', e)
+            self.reply(500, b'{}'); return
+        self.reply_json(result)
+
+    def leaderboard_get(self, path, q):
+        def arg(k, default=None):
+            return (q.get(k) or [default])[0]
+        def int_arg(k, default, hi):
+            try:
+                return max(0, min(hi, int(arg(k, default))))
             except Exception:
-                self.send_response(500); self.end_headers(); self.wfile.write(b'{}'); return
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(hints, ensure_ascii=False).encode('utf-8'))
+                return default
+        which = arg('board', 'all')
+        if path == '/leaderboard':
+            board_id, total, entries = LEADERBOARD.top(int_arg('limit', 10, 100), which, int_arg('offset', 0, 10**9))
+            self.reply_json({ 'board': board_id, 'total': total, 'entries': entries })
             return
-        self.send_response(404)
-        self.end_headers()
-        self.wfile.write(b'Not found')
+        name = str(arg('name', '') or '').strip()
+        if not name:
+            self.reply(400, b'Missing name'); return
+        if path == '/leaderboard/rank':
+            board_id, total, rank, score = LEADERBOARD.rank(name, which)
+            self.reply_json({ 'board': board_id, 'total': total, 'name': name, 'rank': rank, 'score': score })
+            return
+        if path == '/leaderboard/around':
+            board_id, total, rank, entries = LEADERBOARD.around(name, int_arg('n', 5, 50), which)
+            self.reply_json({ 'board': board_id, 'total': total, 'name': name, 'rank': rank, 'entries': entries })
+            return
+        self.reply(404, b'Not found')
 
     def do_POST(self):
         parsed = urlparse(self.path)
-        q = parse_qs(parsed.query or '')
+        endpoint = parsed.path if parsed.path in ENDPOINTS else 'other'
         try:
             length = int(self.headers.get('content-length') or 0)
         except Exception:
             length = 0
+        if length > BODY_LIMITS.get(parsed.path, MAX_BODY):
+            self.reject(413, b'Body too large', 'too_large', endpoint); return
+        if parsed.path == '/highscores' and HIGHSCORE_LIMIT is not None:
+            wait = HIGHSCORE_LIMIT.take(self.client_id())
+            if wait:
+                self.reject(429, b'Too many requests', 'rate_limited', endpoint, wait, length); return
+        if parsed.path not in WRITE_PATHS:
+            self.handle_post(parsed, length)
+            return
+        # bare WRITE_CONCURRENCY skrivinger leser body og tar låsene samtidig; lesinger går utenom
+        if not WRITES.acquire():
+            self.reject(503, b'Busy', 'write_queue_full', endpoint, RETRY_AFTER, length); return
+        try:
+            self.handle_post(parsed, length)
+        finally:
+            WRITES.release()
+
+    def handle_post(self, parsed, length):
+        q = parse_qs(parsed.query or '')
         raw = self.rfile.read(length) if length > 0 else b''
         try:
             body = json.loads(raw.decode('utf-8')) if raw else {}
             # Sørg for at body er et dictionary
             if not isinstance(body, dict):
-                print(f"Warning: body is not dict, got {type(body)}: {body}")
+                LOG.warning('body is not an object: path=%s type=%s', parsed.path, type(body).__name__)
                 body = {}
         except Exception as e:
-            print(f"JSON parse error: {e}, raw: {raw}")
-            self.send_response(400); self.end_headers(); self.wfile.write(b'Invalid JSON'); return
+            LOG.warning('invalid JSON: path=%s bytes=%d error=%s', parsed.path, len(raw), e)
+            self.reply(400, b'Invalid JSON'); return
 
         # full save
         if parsed.path == '/save-db':
             if not isinstance(body, dict) or 'dataset' not in body:
-                self.send_response(400); self.end_headers(); self.wfile.write(b'Invalid schema'); return
+                self.reply(400, b'Invalid schema'); return
             try:
-                save_db(body)
+                revision = STORE.replace(body, base=self.base_revision(body))
+            except Conflict as e:
+                self.reply_conflict(e); return
+            except ValueError as e:
+                self.reply(400, ('Invalid schema: %s' % e).encode('utf-8')); return
             except Exception:
-                self.send_response(500); self.end_headers(); self.wfile.write(b'Write failed'); return
-            self.send_response(200); self.send_header('Content-Type','application/json'); self.end_headers(); self.wfile.write(b'{"ok":true}')
+                self.reply(500, b'Write failed'); return
+            self.reply_json({ 'ok': True, 'revision': revision })
             return
 
         # save hints
         if parsed.path == '/save-hints':
             # body: { name?, code?, key?, hints: [str] }
             if not isinstance(body, dict) or not isinstance(body.get('hints'), list):
-                self.send_response(400); self.end_headers(); self.wfile.write(b'Invalid schema'); return
+                self.reply(400, b'Invalid schema'); return
             try:
-                if not HINTS_FILE.exists():
-                    hints_obj = { 'parks': {} }
-                else:
-                    hints_obj = json.loads(HINTS_FILE.read_text(encoding='utf-8'))
-                parks = hints_obj.get('parks') or {}
-
-                def norm_key(s: str) -> str:
-                    s = (s or '').lower()
-                    # bevar nordiske bokstaver
-                    return re.sub(r'[^a-z0-9\u00e6\u00f8\u00e5]', '', s)
-
-                # finn eksisterende nøkkel vha code eller navn
-                code = str(body.get('code') or '').strip()
-                name = str(body.get('name') or '').strip()
-                key = str(body.get('key') or '').strip()
-
-                found_key = None
-                if code:
-                    for k, v in parks.items():
-                        try:
-                            if str(v.get('code') or '').strip() == code:
-                                found_key = k; break
-                        except Exception:
-                            pass
-                if found_key is None and name:
-                    nrm = norm_key(name)
-                    if nrm in parks:
-                        found_key = nrm
-                    else:
-                        # sjekk entry.name normalisert
-                        for k, v in parks.items():
-                            vn = norm_key(str(v.get('name') or ''))
-                            if vn and vn == nrm:
-                                found_key = k; break
-                if found_key is None and key:
-                    found_key = key
-                if found_key is None:
-                    found_key = norm_key(name) or code or 'ukjent'
-
-                # rens hintliste -> bare str, trim, uten tomme
-                hints_list = []
-                for h in body.get('hints'):
-                    try:
-                        s = str(h).strip()
-                        if s:
-                            hints_list.append(s)
-                    except Exception:
-                        pass
-                entry = parks.get(found_key) or {}
-                if name:
-                    entry['name'] = name
-                if code:
-                    entry['code'] = code
-                entry['hints'] = hints_list
-                parks[found_key] = entry
-                hints_obj['parks'] = parks
-
-                # backup én gang
-                bak = HINTS_FILE.with_suffix('.json.bak')
-                if not bak.exists() and HINTS_FILE.exists():
-                    bak.write_text(HINTS_FILE.read_text(encoding='utf-8'), encoding='utf-8')
-                HINTS_FILE.write_text(json.dumps(hints_obj, ensure_ascii=False, indent=2), encoding='utf-8')
+                HINTS.set_hints(body.get('code'), body.get('name'), body.get('key'), body.get('hints'))
+            except Exception:
+                self.reply(500, b'Write failed'); return
+            self.reply(200, b'{"ok":true}', 'application/json')
+            return
+
+        # endre ett hint: { name?, code?, key?, op: add|remove|move, hint?, index?, to? }
+        if parsed.path == '/patch-hints':
+            op = body.get('op')
+            if op not in ('add', 'remove', 'move'):
+                self.reply(400, b'Invalid op'); return
+            try:
+                key, hints = HINTS.patch(body.get('code'), body.get('name'), body.get('key'), op,
+                                         hint=body.get('hint'), index=body.get('index'), to=body.get('to'))
+            except KeyError:
+                self.reply(404, b'Not found'); return
+            except (IndexError, ValueError, TypeError):
+                self.reply(400, b'Invalid hint/index'); return
             except Exception:
-                self.send_response(500); self.end_headers(); self.wfile.write(b'Write failed'); return
-            self.send_response(200); self.send_header('Content-Type','application/json'); self.end_headers(); self.wfile.write(b'{"ok":true}')
+                self.reply(500, b'Write failed'); return
+            self.reply_json({ 'ok': True, 'key': key, 'hints': hints })
             return
 
         # save highscore
         if parsed.path == '/highscores':
-            if not isinstance(body, dict):
-                print(f"Highscore body is not dict: {type(body)}: {body}")
-                self.send_response(400); self.end_headers(); self.wfile.write(b'Invalid body format'); return
             name = str(body.get('name') or '').strip()
             score = body.get('score')
-            print(f"Highscore data: name='{name}', score={score}, body={body}")
             if not name or not isinstance(score, (int, float)) or score < 0:
-                self.send_response(400); self.end_headers(); self.wfile.write(b'Invalid name/score'); return
+                self.reply(400, b'Invalid name/score'); return
             try:
-                scores = load_highscores()
-                print(f"📊 Current hi-scores before adding: {len(scores)} entries")
-                
-                # Sjekk om navnet allerede eksisterer og erstatt hvis ny score er høyere
-                existing_index = None
-                for i, existing_score in enumerate(scores):
-                    if existing_score.get('name', '').lower() == name.lower():
-                        existing_index = i
-                        break
-                
-                if existing_index is not None:
-                    # Navnet eksisterer - erstatt kun hvis ny score er høyere
-                    existing_score = scores[existing_index]['score']
-                    if int(score) > existing_score:
-                        scores[existing_index] = {"name": name, "score": int(score)}
-                        print(f"🔄 Updated existing entry: {name} from {existing_score} to {score}")
-                    else:
-                        print(f"⚠️ Score {score} not higher than existing {existing_score} for {name}")
-                        self.send_response(200); self.send_header('Content-Type','application/json'); self.end_headers(); self.wfile.write(b'{"ok":true,"message":"Score not higher than existing"}'); return
-                else:
-                    # Nytt navn - legg til
-                    scores.append({"name": name, "score": int(score)})
-                    print(f"➕ Added new entry: {name} with {score} points")
-                
-                # Sorter etter score (høyest først) og behold top 10
-                scores.sort(key=lambda x: x['score'], reverse=True)
-                scores = scores[:10]
-                print(f"💾 Saving {len(scores)} hi-scores to file")
-                save_highscores(scores)
-                print(f"✅ Hi-score saved successfully: {name} with {score} points")
+                improved, rank = LEADERBOARD.submit(name, int(score))
             except Exception as e:
-                print(f"❌ Error saving hi-score: {e}")
-                self.send_response(500); self.end_headers(); self.wfile.write(b'Write failed'); return
-            self.send_response(200); self.send_header('Content-Type','application/json'); self.end_headers(); self.wfile.write(b'{"ok":true}')
+                LOG.error('saving highscore failed: %s', e)
+                self.reply(500, b'Write failed'); return
+            if not improved:
+                self.reply_json({ 'ok': True, 'rank': rank, 'message': 'Score not higher than existing' }); return
+            self.reply_json({ 'ok': True, 'rank': rank })
             return
 
-        # targeted ops: update, delete, move
-        try:
-            db = load_db()
-            feats = db.get('dataset',{}).get('features') or []
-        except Exception:
-            self.send_response(500); self.end_headers(); self.wfile.write(b'Could not load DB'); return
+        if parsed.path == '/guess':
+            self.guess(body)
+            return
 
-        def parse_id(v):
-            try:
-                return int(v)
-            except Exception:
-                return None
+        if parsed.path == '/locate':
+            self.locate_batch(body)
+            return
 
-        def find_index(fid):
-            for i,f in enumerate(feats):
-                pr = f.get('properties') or {}
-                vid = pr.get('id')
-                try:
-                    ivid = int(vid)
-                except Exception:
-                    ivid = None
-                if ivid == fid:
-                    return i
-            return -1
-
-        if parsed.path == '/update':
-            fid = parse_id(body.get('id') or (q.get('id',[None])[0]))
-            props = body.get('props') or {}
-            if fid is None:
-                self.send_response(400); self.end_headers(); self.wfile.write(b'Missing id'); return
-            idx = find_index(fid)
-            if idx < 0:
-                self.send_response(404); self.end_headers(); self.wfile.write(b'Not found'); return
-            allowed = {'name','code','status','display','source'}
-            feats[idx].setdefault('properties',{})
-            for k,v in props.items():
-                if k in allowed:
-                    feats[idx]['properties'][k] = v
-            try:
-                save_db(db)
-            except Exception:
-                self.send_response(500); self.end_headers(); self.wfile.write(b'Write failed'); return
-            self.send_response(200); self.end_headers(); self.wfile.write(b'{"ok":true}')
+        if parsed.path == '/quiz/answer':
+            self.quiz_answer(body)
             return
 
-        if parsed.path == '/delete':
-            fid = parse_id(body.get('id') or (q.get('id',[None])[0]))
-            if fid is None:
-                self.send_response(400); self.end_headers(); self.wfile.write(b'Missing id'); return
-            idx = find_index(fid)
-            if idx < 0:
-                self.send_response(404); self.end_headers(); self.wfile.write(b'Not found'); return
-            del feats[idx]
+        # batch: ordnet liste med update/delete/move/insert, alt eller ingenting, én skriving
+        if parsed.path == '/batch':
+            ops = body.get('ops')
+            if not isinstance(ops, list) or not ops:
+                self.reply(400, b'Missing ops'); return
             try:
-                save_db(db)
+                revision, results = STORE.apply_batch(ops, base=self.base_revision(body))
+            except BatchError as e:
+                self.reply_json({ 'ok': False, 'results': e.results }, status=400); return
+            except Conflict as e:
+                self.reply_conflict(e); return
             except Exception:
-                self.send_response(500); self.end_headers(); self.wfile.write(b'Write failed'); return
-            self.send_response(200); self.end_headers(); self.wfile.write(b'{"ok":true}')
+                self.reply(500, b'Write failed'); return
+            self.reply_json({ 'ok': True, 'revision': revision, 'results': results })
             return
 
-        if parsed.path == '/move':
-            fid = parse_id(body.get('id') or (q.get('id',[None])[0]))
-            to = body.get('to') or {}
-            if fid is None or not to:
-                self.send_response(400); self.end_headers(); self.wfile.write(b'Missing id/to'); return
-            idx = find_index(fid)
-            if idx < 0:
-                self.send_response(404); self.end_headers(); self.wfile.write(b'Not found'); return
-            feats[idx].setdefault('properties',{})
-            if 'code' in to: feats[idx]['properties']['code'] = str(to['code'])
-            if 'name' in to: feats[idx]['properties']['name'] = str(to['name'])
-            try:
-                save_db(db)
-            except Exception:
-                self.send_response(500); self.end_headers(); self.wfile.write(b'Write failed'); return
-            self.send_response(200); self.end_headers(); self.wfile.write(b'{"ok":true}')
+        if parsed.path not in ('/update', '/delete', '/move'):
+            self.reply(404, b'Not found')
             return
 
-        self.send_response(404)
-        self.end_headers()
-        self.wfile.write(b'Not found')
+        # targeted ops: update, delete, move – slås opp i id-indeksen og journalføres
+        fid = parse_id(body.get('id') or (q.get('id',[None])[0]))
+        base = self.base_revision(body)
+        try:
+            if parsed.path == '/update':
+                props = body.get('props') or {}
+                if fid is None:
+                    self.reply(400, b'Missing id'); return
+                if not isinstance(props, dict):
+                    self.reply(400, b'Invalid props'); return
+                revision = STORE.update(fid, props, base=base)
+            elif parsed.path == '/delete':
+                if fid is None:
+                    self.reply(400, b'Missing id'); return
+                revision = STORE.delete(fid, base=base)
+            else:
+                to = body.get('to') or {}
+                if fid is None or not to:
+                    self.reply(400, b'Missing id/to'); return
+                if not isinstance(to, dict):
+                    self.reply(400, b'Invalid to'); return
+                revision = STORE.move(fid, to, base=base)
+        except KeyError:
+            self.reply(404, b'Not found'); return
+        except Conflict as e:
+            self.reply_conflict(e); return
+        except Exception:
+            self.reply(500, b'Write failed'); return
+        self.reply_json({ 'ok': True, 'revision': revision })
 
-if __name__ == '__main__':
-    host = os.environ.get('HOST', '0.0.0.0')
-    try:
-        port = int(os.environ.get('PORT', '8777'))
-    except Exception:
-        port = 8777
-    with socketserver.TCPServer((host, port), Handler) as httpd:
-        print(f"Serving admin endpoints on http://{host}:{port}")
-        httpd.serve_forever()
 
+class PooledHTTPServer(socketserver.TCPServer):
+    """TCPServer som betjener forbindelser i en avgrenset trådpool."""
+    allow_reuse_address = True
 
+    def __init__(self, server_address, handler_class, workers=8, max_pending=64):
+        super().__init__(server_address, handler_class)
+        self.workers = max(1, int(workers))
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='http')
+        # forbindelser i køen til trådpoolen; Handler lukker keep-alive-forbindelser når den ikke er tom
+        self.max_pending = max(1, int(max_pending))
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._pending_lock:
+            full = self.pending >= self.max_pending
+            if not full:
+                self.pending += 1
+        if full:
+            self.reject(request)
+            return
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def reject(self, request):
+        # svares direkte fra lyttetråden; det som allerede er mottatt leses så lukkingen ikke gir RST før svaret
+        REJECTED.inc('other', 'pending_full')
+        body = b'Busy'
+        head = (f'HTTP/1.1 503 Service Unavailable\r\nRetry-After: {retry_after(RETRY_AFTER)}\r\n'
+                f'Access-Control-Allow-Origin: *\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n')
+        try:
+            request.setblocking(False)
+            try:
+                request.recv(65536)
+            except OSError:
+                pass
+            request.send(head.encode('ascii') + body)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def process_request_thread(self, request, client_address):
+        with self._pending_lock:
+            self.pending -= 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start_background():
+    if LOCATOR is not None:
+        start_locate_warmer(LOCATOR, env_float('LOCATE_WARM_INTERVAL', 5.0))
+    # SQLite har ingen journal å kompaktere
+    if STORE_BACKEND == 'sqlite':
+        return
+    start_compactor(STORE, env_int('DB_COMPACT_INTERVAL', 30), 'db')
+    start_compactor(LEADERBOARD, env_int('LEADERBOARD_COMPACT_INTERVAL', 60), 'leaderboard')
+
+
+def close_stores():
+    STORE.close()
+    LEADERBOARD.close()
+
+
+def setup_logging():
+    logging.basicConfig(
+        level=getattr(logging, os.environ.get('LOG_LEVEL', 'INFO').upper(), logging.INFO),
+        format='%(asctime)s %(levelname)s %(name)s %(message)s',
+    )
+
+
+if __name__ == '__main__':
+    setup_logging()
+    host = os.environ.get('HOST', '0.0.0.0')
+    port = env_int('PORT', 8777)
+    workers = env_int('WORKERS', 8)
+    start_background()
+    with PooledHTTPServer((host, port), Handler, workers=workers, max_pending=MAX_PENDING) as httpd:
+        LOG.info('serving admin endpoints on http://%s:%s (%d workers, %d pending)', host, port, httpd.workers, httpd.max_pending)
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            close_stores()
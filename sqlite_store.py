@@ -0,0 +1,754 @@
+"""SQLite-lagring (WAL) for databasen, hint og topplisten.
+
+Samme grensesnitt som FeatureStore, HintsCatalog og Leaderboard, men hver endring er én transaksjon
+på radene den rører i stedet for journal + hele JSON-filen. Velges med STORE_BACKEND=sqlite;
+migrate_store.py flytter JSON-filene inn og eksporterer dem ut igjen (f.eks. for GitHub Pages).
+I WAL-modus leser lesere et fast øyeblikksbilde uten å stoppe skrivere, og flere prosesser kan dele filen.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from feature_store import ALLOWED_PROPS, FeatureStore, BatchError, Conflict, apply_record, batch_record, check_db, ensure_ids, parse_id
+from hints_catalog import HintsCatalog, HintsIndex, clean_hints, norm_key
+from journal import FileLock, Journal, atomic_write_text
+from leaderboard import EMPTY_ENTRY, KEEP_DAILY, KEEP_WEEKLY, Leaderboard, board_id, period_ids
+from metrics import FILE_SAVE
+
+# plassholder for features/parks når resten av dokumentet kodes
+_MARK = '\x00rows\x00'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+-- pos er rekkefølgen i /db; id er properties.id
+CREATE TABLE IF NOT EXISTS features (
+    pos INTEGER PRIMARY KEY,
+    id INTEGER NOT NULL UNIQUE,
+    code TEXT,
+    source TEXT,
+    status TEXT,
+    rev INTEGER NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS features_code ON features(code);
+CREATE INDEX IF NOT EXISTS features_source ON features(source, status);
+CREATE INDEX IF NOT EXISTS features_status ON features(status);
+CREATE INDEX IF NOT EXISTS features_rev ON features(rev);
+-- slettede features, for /db/changes
+CREATE TABLE IF NOT EXISTS tombstones (
+    id INTEGER PRIMARY KEY,
+    rev INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tombstones_rev ON tombstones(rev);
+CREATE TABLE IF NOT EXISTS hints (
+    pos INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    code TEXT,
+    name_key TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hints_code ON hints(code);
+CREATE INDEX IF NOT EXISTS hints_name ON hints(name_key);
+-- beste score per spiller (navn.lower()) og tavle
+CREATE TABLE IF NOT EXISTS scores (
+    board TEXT NOT NULL,
+    player TEXT NOT NULL,
+    name TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (board, player)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS scores_rank ON scores(board, score DESC, seq);
+'''
+
+
+def dumps(obj) -> str:
+    # samme koding som json.dumps i FeatureStore.encode(), så radene kan skjøtes rett inn i /db
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def split_doc(doc: dict, *path):
+    # (før, etter) radene når doc[path...] kodes
+    doc = dict(doc)
+    inner = doc
+    for k in path[:-1]:
+        inner[k] = dict(inner.get(k) or {})
+        inner = inner[k]
+    inner[path[-1]] = _MARK
+    head, tail = dumps(doc).split(dumps(_MARK), 1)
+    return head, tail
+
+
+def get_meta(c, key, default=None):
+    row = c.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+
+def set_meta(c, key, value):
+    c.execute('INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+              (key, dumps(value)))
+
+
+class Database:
+    """Én SQLite-fil i WAL-modus; én forbindelse per tråd (og prosess).
+
+    read() er en lesetransaksjon med fast øyeblikksbilde, write() en BEGIN IMMEDIATE-transaksjon
+    som rulles tilbake ved unntak. Skrivere venter på hverandre, ikke på lesere: på en tråd-lås og en
+    flock på <fil>.lock, som slipper neste skriver til med en gang (busy_timeout venter med økende pauser).
+    """
+
+    def __init__(self, path: Path, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self.flock = FileLock(path.with_suffix('.lock'))
+        self._conn().executescript(SCHEMA)
+
+    def connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # fsync ved hver commit, som journalen i JSON-lagringen
+        conn.execute('PRAGMA synchronous=FULL')
+        return conn
+
+    def _conn(self):
+        local = self._local
+        # forbindelser skal ikke arves gjennom fork (gunicorn --preload)
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = self.connect()
+            local.pid = os.getpid()
+            local.writing = False
+        return local.conn
+
+    @contextmanager
+    def read(self):
+        c = self._conn()
+        if c.in_transaction:
+            yield c
+            return
+        c.execute('BEGIN')
+        try:
+            yield c
+        finally:
+            c.execute('COMMIT')
+
+    @contextmanager
+    def write(self):
+        c = self._conn()
+        if self._local.writing:
+            yield c
+            return
+        with self._write_lock, self.flock, FILE_SAVE.time(self.path.name):
+            c.execute('BEGIN IMMEDIATE')
+            self._local.writing = True
+            try:
+                yield c
+            except BaseException:
+                c.execute('ROLLBACK')
+                raise
+            else:
+                c.execute('COMMIT')
+            finally:
+                self._local.writing = False
+
+    def initialized(self) -> bool:
+        with self.read() as c:
+            return get_meta(c, 'db') is not None
+
+    def close(self):
+        local = self._local
+        if getattr(local, 'pid', None) == os.getpid():
+            local.conn.close()
+            local.pid = None
+
+
+class SQLiteFeatureStore:
+    """Features i tabellen `features`, én rad (JSON) per feature, med revisjonen den sist ble endret i.
+
+    /db/changes slår opp på `rev` direkte; slettinger huskes i `tombstones` (de siste `changelog`).
+    """
+
+    def __init__(self, db: Database, changelog: int = 1000):
+        self.db = db
+        self.lock = threading.RLock()
+        self.changelog = max(1, changelog)
+        # ingen journal å kompaktere
+        self.pending = 0
+
+    @property
+    def revision(self):
+        with self.db.read() as c:
+            return get_meta(c, 'revision', 0)
+
+    def current_version(self):
+        return self.revision
+
+    # -- lesing --------------------------------------------------------
+
+    def get(self, fid):
+        with self.db.read() as c:
+            row = c.execute('SELECT body FROM features WHERE id = ?', (fid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __len__(self):
+        with self.db.read() as c:
+            return c.execute('SELECT COUNT(*) FROM features').fetchone()[0]
+
+    def _doc(self, c):
+        # dokumentet uten features, med revisjonen sist som i FeatureStore.to_db()
+        doc = dict(get_meta(c, 'db') or { 'dataset': { 'features': None } })
+        doc['revision'] = get_meta(c, 'revision', 0)
+        return doc
+
+    def to_db(self):
+        with self.db.read() as c:
+            doc = self._doc(c)
+            dataset = dict(doc.get('dataset') or {})
+            dataset['features'] = [json.loads(b) for (b,) in c.execute('SELECT body FROM features ORDER BY pos')]
+            doc['dataset'] = dataset
+            return doc
+
+    def select(self, **where):
+        """Features med gitte verdier for code, source og/eller status (indeksert), i /db-rekkefølge."""
+        cols = [k for k in ('code', 'source', 'status') if k in where]
+        if len(cols) != len(where):
+            raise ValueError('Unknown column')
+        sql = 'SELECT body FROM features' + (' WHERE ' + ' AND '.join(k + ' = ?' for k in cols) if cols else '') + ' ORDER BY pos'
+        with self.db.read() as c:
+            return [json.loads(b) for (b,) in c.execute(sql, [where[k] for k in cols])]
+
+    def encode(self) -> bytes:
+        return b''.join(self.iter_encoded(1 << 62))
+
+    def iter_encoded(self, chunk_size: int = 64 * 1024):
+        """Samme bytes som FeatureStore.encode(); radene leses i én lesetransaksjon på en egen forbindelse."""
+        conn = self.db.connect()
+        try:
+            conn.execute('BEGIN')
+            head, tail = split_doc(self._doc(conn), 'dataset', 'features')
+            buf = [head, '[']
+            size = len(head)
+            for i, (s,) in enumerate(conn.execute('SELECT body FROM features ORDER BY pos')):
+                if i:
+                    buf.append(', ')
+                buf.append(s)
+                size += len(s) + 2
+                if size >= chunk_size:
+                    yield ''.join(buf).encode('utf-8')
+                    buf, size = [], 0
+            buf.append(']')
+            buf.append(tail)
+            yield ''.join(buf).encode('utf-8')
+        finally:
+            conn.close()
+
+    def changes(self, since: int):
+        """(revisjon, endrede/nye features, slettede id-er) etter `since`, eller None når en full kopi trengs."""
+        with self.db.read() as c:
+            rev = get_meta(c, 'revision', 0)
+            if since > rev or since < get_meta(c, 'log_base', 0):
+                return None
+            changed = [json.loads(b) for (b,) in c.execute('SELECT body FROM features WHERE rev > ? ORDER BY id', (since,))]
+            deleted = [i for (i,) in c.execute('SELECT id FROM tombstones WHERE rev > ? ORDER BY id', (since,))]
+            return rev, changed, deleted
+
+    # -- endringer -----------------------------------------------------
+
+    @staticmethod
+    def _row(f: dict, rev: int):
+        pr = f.get('properties') or {}
+        return (int(pr['id']), pr.get('code'), pr.get('source'), pr.get('status'), rev, dumps(f))
+
+    def _insert(self, c, f, rev):
+        # dobbel id: siste vinner på første plass, som dict-en i FeatureStore
+        c.execute('INSERT INTO features (id, code, source, status, rev, body) VALUES (?, ?, ?, ?, ?, ?) '
+                  'ON CONFLICT(id) DO UPDATE SET code = excluded.code, source = excluded.source, status = excluded.status, '
+                  'rev = excluded.rev, body = excluded.body', self._row(f, rev))
+
+    def _exists(self, c, fid) -> bool:
+        return c.execute('SELECT 1 FROM features WHERE id = ?', (fid,)).fetchone() is not None
+
+    def _check_base(self, c, base, ids):
+        # base=None: ubetinget skriving som før
+        if base is None:
+            return
+        rev = get_meta(c, 'revision', 0)
+        if base > rev or base < get_meta(c, 'log_base', 0):
+            raise Conflict(rev)
+        ids = json.dumps(list(ids))
+        hit = c.execute('SELECT 1 FROM features WHERE rev > ?1 AND id IN (SELECT value FROM json_each(?2)) '
+                        'UNION ALL SELECT 1 FROM tombstones WHERE rev > ?1 AND id IN (SELECT value FROM json_each(?2)) LIMIT 1',
+                        (base, ids)).fetchone()
+        if hit:
+            raise Conflict(rev)
+
+    def _commit(self, c, records):
+        # kalles under db.write(); alle postene får samme nye revisjon
+        rev = get_meta(c, 'revision', 0) + 1
+        max_id = get_meta(c, 'max_id', 0)
+        deleted = False
+        for rec in records:
+            op, fid = rec['op'], rec['id']
+            if op in ('update', 'move'):
+                row = c.execute('SELECT body FROM features WHERE id = ?', (fid,)).fetchone()
+                if row:
+                    _, code, source, status, _, body = self._row(apply_record(json.loads(row[0]), rec), rev)
+                    c.execute('UPDATE features SET code = ?, source = ?, status = ?, rev = ?, body = ? WHERE id = ?',
+                              (code, source, status, rev, body, fid))
+            elif op == 'delete':
+                c.execute('DELETE FROM features WHERE id = ?', (fid,))
+                c.execute('INSERT OR REPLACE INTO tombstones (id, rev) VALUES (?, ?)', (fid, rev))
+                deleted = True
+            elif op == 'insert':
+                self._insert(c, rec['feature'], rev)
+                max_id = max(max_id, fid)
+        if deleted:
+            self._prune_tombstones(c)
+        set_meta(c, 'max_id', max_id)
+        set_meta(c, 'revision', rev)
+        return rev
+
+    def _prune_tombstones(self, c):
+        row = c.execute('SELECT rev FROM tombstones ORDER BY rev DESC LIMIT 1 OFFSET ?', (self.changelog,)).fetchone()
+        if row:
+            # eldre slettinger er glemt: /db/changes fra før dette gir full kopi
+            c.execute('DELETE FROM tombstones WHERE rev <= ?', (row[0],))
+            set_meta(c, 'log_base', max(row[0], get_meta(c, 'log_base', 0)))
+
+    def update(self, fid, props: dict, base=None):
+        with self.db.write() as c:
+            if not self._exists(c, fid):
+                raise KeyError(fid)
+            self._check_base(c, base, [fid])
+            props = { k: v for k, v in (props or {}).items() if k in ALLOWED_PROPS }
+            return self._commit(c, [{ 'op': 'update', 'id': fid, 'props': props }])
+
+    def update_many(self, updates: dict):
+        """{id: props} i én revisjon, uten ALLOWED_PROPS-filteret (for enrich_parks.py)."""
+        with self.db.write() as c:
+            return self._commit(c, [{ 'op': 'update', 'id': fid, 'props': props } for fid, props in updates.items()])
+
+    def delete(self, fid, base=None):
+        with self.db.write() as c:
+            if not self._exists(c, fid):
+                raise KeyError(fid)
+            self._check_base(c, base, [fid])
+            return self._commit(c, [{ 'op': 'delete', 'id': fid }])
+
+    def move(self, fid, to: dict, base=None):
+        with self.db.write() as c:
+            if not self._exists(c, fid):
+                raise KeyError(fid)
+            self._check_base(c, base, [fid])
+            to = { k: str(to[k]) for k in ('code', 'name') if k in to }
+            return self._commit(c, [{ 'op': 'move', 'id': fid, 'to': to }])
+
+    def apply_batch(self, ops: list, base=None):
+        """Som FeatureStore.apply_batch(): alle operasjoner i én transaksjon, eller ingen."""
+        with self.db.write() as c:
+            # bare id-ene batchen rører trengs for valideringen
+            wanted = [parse_id(op.get('id')) for op in ops if isinstance(op, dict) and op.get('op') != 'insert']
+            live = { i for (i,) in c.execute('SELECT id FROM features WHERE id IN (SELECT value FROM json_each(?))',
+                                             (json.dumps([w for w in wanted if w is not None]),)) }
+            next_id = get_meta(c, 'max_id', 0) + 1
+            records, results, failed = [], [], False
+            for op in ops:
+                rec, err = batch_record(op, live, next_id)
+                if err:
+                    failed = True
+                    results.append({ 'ok': False, 'error': err })
+                    continue
+                if rec['op'] == 'insert':
+                    live.add(rec['id'])
+                    next_id += 1
+                elif rec['op'] == 'delete':
+                    live.discard(rec['id'])
+                records.append(rec)
+                results.append({ 'ok': True, 'op': rec['op'], 'id': rec['id'] })
+            if failed:
+                for r in results:
+                    if r['ok']:
+                        r['ok'] = False
+                        r['error'] = 'Not applied'
+                raise BatchError(results)
+            self._check_base(c, base, [r['id'] for r in records if r['op'] != 'insert'])
+            return self._commit(c, records), results
+
+    def replace(self, db_obj: dict, base=None):
+        # full lagring (/save-db): alle rader byttes i én transaksjon
+        check_db(db_obj)
+        with self.db.write() as c:
+            rev = get_meta(c, 'revision', 0)
+            if base is not None and base != rev:
+                raise Conflict(rev)
+            self.load(c, db_obj, rev + 1)
+            return rev + 1
+
+    def load(self, c, db_obj: dict, revision: int):
+        # hele dokumentet inn på nytt; eldre deltaer gjelder ikke lenger
+        doc = dict(db_obj)
+        doc.pop('revision', None)
+        dataset = dict(doc.get('dataset') or {})
+        feats = dataset.get('features') or []
+        ensure_ids({ 'dataset': { 'features': feats } })
+        dataset['features'] = None
+        doc['dataset'] = dataset
+        c.execute('DELETE FROM features')
+        c.execute('DELETE FROM tombstones')
+        for f in feats:
+            self._insert(c, f, revision)
+        set_meta(c, 'db', doc)
+        set_meta(c, 'revision', revision)
+        set_meta(c, 'log_base', revision)
+        set_meta(c, 'max_id', max((int(f['properties']['id']) for f in feats), default=0))
+
+    def compact(self, force: bool = False):
+        pass
+
+    def close(self):
+        self.db.close()
+
+
+class SQLiteHints:
+    """park_hints.json som rader i `hints`, med indeks på kode og normalisert navn."""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.lock = threading.RLock()
+        # søkeindeksen i minnet; bygges på nytt når en annen prosess har endret hintene
+        self.index = HintsIndex()
+        self._index_version = None
+
+    def current_version(self):
+        with self.db.read() as c:
+            return get_meta(c, 'hints_version', 0)
+
+    def _fresh_index(self) -> HintsIndex:
+        with self.lock:
+            with self.db.read() as c:
+                version = get_meta(c, 'hints_version', 0)
+                if version != self._index_version:
+                    self.index.rebuild({ k: json.loads(b) for (k, b) in c.execute('SELECT key, body FROM hints ORDER BY pos') })
+                    self._index_version = version
+            return self.index
+
+    def _indexed(self, key, entry, version):
+        # egen skriving: bare den parken oppdateres, hvis indeksen var à jour før den
+        with self.lock:
+            if self._index_version == version - 1:
+                self.index.put(key, entry)
+                self._index_version = version
+
+    def search(self, q: str = '', limit: int = 20, year=None) -> dict:
+        return self._fresh_index().search(q, limit, year)
+
+    def facts(self, code: str = '', name: str = '') -> dict:
+        index = self._fresh_index()
+        k = self.find_key(code, name)
+        return index.facts(k) if k else {}
+
+    @property
+    def parks(self) -> dict:
+        with self.db.read() as c:
+            return { k: json.loads(b) for (k, b) in c.execute('SELECT key, body FROM hints ORDER BY pos') }
+
+    def _find_key(self, c, code='', name='', key=''):
+        # samme rekkefølge som HintsCatalog.find_key(); første forekomst vinner
+        code = str(code or '').strip()
+        name = str(name or '').strip()
+        if code:
+            row = c.execute('SELECT key FROM hints WHERE code = ? ORDER BY pos LIMIT 1', (code,)).fetchone()
+            if row:
+                return row[0]
+        if name:
+            nrm = norm_key(name)
+            for k in (nrm, name.lower()):
+                if c.execute('SELECT 1 FROM hints WHERE key = ?', (k,)).fetchone():
+                    return k
+            row = c.execute('SELECT key FROM hints WHERE name_key = ? ORDER BY pos LIMIT 1', (nrm,)).fetchone() if nrm else None
+            if row:
+                return row[0]
+        key = str(key or '').strip()
+        return key or None
+
+    def find_key(self, code: str = '', name: str = '', key: str = ''):
+        with self.db.read() as c:
+            return self._find_key(c, code, name, key)
+
+    def _entry(self, c, k):
+        row = c.execute('SELECT body FROM hints WHERE key = ?', (k,)).fetchone() if k else None
+        return json.loads(row[0]) if row else None
+
+    def get(self, code: str = '', name: str = ''):
+        with self.db.read() as c:
+            entry = self._entry(c, self._find_key(c, code, name))
+        return entry if isinstance(entry, dict) else None
+
+    def encode(self) -> bytes:
+        with self.db.read() as c:
+            head, tail = split_doc(get_meta(c, 'hints', { 'parks': None }), 'parks')
+            rows = ', '.join(dumps(k) + ': ' + b for (k, b) in c.execute('SELECT key, body FROM hints ORDER BY pos'))
+        return (head + '{' + rows + '}' + tail).encode('utf-8')
+
+    # -- skriving ------------------------------------------------------
+
+    @staticmethod
+    def _put(c, k, entry):
+        # eksisterende nøkler beholder plassen sin
+        code = str(entry.get('code') or '').strip() if isinstance(entry, dict) else ''
+        vn = norm_key(str(entry.get('name') or '')) if isinstance(entry, dict) else ''
+        c.execute('INSERT INTO hints (key, code, name_key, body) VALUES (?, ?, ?, ?) '
+                  'ON CONFLICT(key) DO UPDATE SET code = excluded.code, name_key = excluded.name_key, body = excluded.body',
+                  (k, code or None, vn or None, dumps(entry)))
+
+    def _entry_for_write(self, c, code, name, key):
+        found_key = self._find_key(c, code, name, key)
+        if found_key is None:
+            found_key = norm_key(name) or code or 'ukjent'
+        cur = self._entry(c, found_key)
+        entry = dict(cur) if isinstance(cur, dict) else {}
+        if name:
+            entry['name'] = name
+        if code:
+            entry['code'] = code
+        return found_key, entry
+
+    def _store(self, c, found_key, entry):
+        self._put(c, found_key, entry)
+        version = get_meta(c, 'hints_version', 0) + 1
+        set_meta(c, 'hints_version', version)
+        return version
+
+    def set_hints(self, code: str, name: str, key: str, hints: list):
+        with self.db.write() as c:
+            code = str(code or '').strip()
+            name = str(name or '').strip()
+            found_key, entry = self._entry_for_write(c, code, name, key)
+            entry['hints'] = clean_hints(hints)
+            version = self._store(c, found_key, entry)
+        self._indexed(found_key, entry, version)
+        return found_key
+
+    def patch(self, code: str, name: str, key: str, op: str, hint=None, index=None, to=None):
+        """Som HintsCatalog.patch()."""
+        with self.db.write() as c:
+            code = str(code or '').strip()
+            name = str(name or '').strip()
+            if op != 'add' and self._entry(c, self._find_key(c, code, name, key)) is None:
+                raise KeyError('park')
+            found_key, entry = self._entry_for_write(c, code, name, key)
+            hints = list(entry.get('hints') or [])
+            if op == 'add':
+                items = clean_hints([hint])
+                if not items:
+                    raise ValueError('Missing hint')
+                pos = len(hints) if index is None else int(index)
+                if not 0 <= pos <= len(hints):
+                    raise IndexError(pos)
+                hints.insert(pos, items[0])
+            elif op == 'remove':
+                if index is not None:
+                    pos = int(index)
+                    if not 0 <= pos < len(hints):
+                        raise IndexError(pos)
+                else:
+                    text = str(hint or '').strip()
+                    if text not in hints:
+                        raise IndexError(text)
+                    pos = hints.index(text)
+                del hints[pos]
+            elif op == 'move':
+                src, dst = int(index), int(to)
+                if not (0 <= src < len(hints) and 0 <= dst < len(hints)):
+                    raise IndexError(src)
+                hints.insert(dst, hints.pop(src))
+            else:
+                raise ValueError('Unknown op')
+            entry['hints'] = hints
+            version = self._store(c, found_key, entry)
+        self._indexed(found_key, entry, version)
+        return found_key, hints
+
+    def load(self, c, obj: dict):
+        doc = dict(obj)
+        parks = doc.get('parks') if isinstance(doc.get('parks'), dict) else {}
+        doc['parks'] = None
+        c.execute('DELETE FROM hints')
+        for k, v in parks.items():
+            self._put(c, k, v)
+        set_meta(c, 'hints', doc)
+        set_meta(c, 'hints_version', get_meta(c, 'hints_version', 0) + 1)
+
+
+class SQLiteLeaderboard:
+    """Alle-tiders, daglige og ukentlige tavler som rader i `scores`; rang er antall rader foran i indeksen."""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.lock = threading.RLock()
+
+    def current_version(self):
+        with self.db.read() as c:
+            return get_meta(c, 'seq', 0)
+
+    @staticmethod
+    def _count(c, board):
+        return c.execute('SELECT COUNT(*) FROM scores WHERE board = ?', (board,)).fetchone()[0]
+
+    @staticmethod
+    def _rank(c, board, player):
+        row = c.execute('SELECT score, seq FROM scores WHERE board = ? AND player = ?', (board, player)).fetchone()
+        if row is None:
+            return None, None
+        # lik score: den som kom først står øverst
+        ahead = c.execute('SELECT COUNT(*) FROM scores WHERE board = ?1 AND (score > ?2 OR (score = ?2 AND seq < ?3))',
+                          (board, row[0], row[1])).fetchone()[0]
+        return ahead + 1, row[0]
+
+    @staticmethod
+    def _page(c, board, offset, limit):
+        rows = c.execute('SELECT name, score FROM scores WHERE board = ? ORDER BY score DESC, seq LIMIT ? OFFSET ?',
+                         (board, max(0, limit), max(0, offset)))
+        return [{ 'rank': max(0, offset) + i + 1, 'name': name, 'score': score } for i, (name, score) in enumerate(rows)]
+
+    @staticmethod
+    def _prune(c):
+        for prefix, keep in (('daily:', KEEP_DAILY), ('weekly:', KEEP_WEEKLY)):
+            ids = [b for (b,) in c.execute('SELECT DISTINCT board FROM scores WHERE board >= ? AND board < ? ORDER BY board',
+                                           (prefix, prefix[:-1] + ';'))]
+            for old in ids[:-keep]:
+                c.execute('DELETE FROM scores WHERE board = ?', (old,))
+
+    def players(self, which: str = 'all') -> int:
+        with self.db.read() as c:
+            return self._count(c, board_id(which))
+
+    def submit(self, name: str, score: int):
+        """Returnerer (forbedret alle-tiders, rang alle-tiders)."""
+        with self.db.write() as c:
+            t = time.time()
+            player = name.lower()
+            ids = ('all',) + period_ids(t)
+            cur = dict(c.execute('SELECT board, score FROM scores WHERE player = ? AND board IN (?, ?, ?)', (player,) + ids))
+            better = [b for b in ids if b not in cur or score > cur[b]]
+            if not better:
+                return False, self._rank(c, 'all', player)[0]
+            seq = get_meta(c, 'seq', 0) + 1
+            new_board = False
+            for b in better:
+                new_board = new_board or c.execute('SELECT 1 FROM scores WHERE board = ? LIMIT 1', (b,)).fetchone() is None
+                c.execute('INSERT INTO scores (board, player, name, score, seq) VALUES (?, ?, ?, ?, ?) '
+                          'ON CONFLICT(board, player) DO UPDATE SET name = excluded.name, score = excluded.score, seq = excluded.seq',
+                          (b, player, name, score, seq))
+            if new_board:
+                self._prune(c)
+            set_meta(c, 'seq', seq)
+            return 'all' in better, self._rank(c, 'all', player)[0]
+
+    def top(self, n: int = 10, which: str = 'all', offset: int = 0):
+        which = board_id(which)
+        with self.db.read() as c:
+            return which, self._count(c, which), self._page(c, which, offset, n)
+
+    def rank(self, name: str, which: str = 'all'):
+        which = board_id(which)
+        with self.db.read() as c:
+            r, score = self._rank(c, which, name.lower())
+            return which, self._count(c, which), r, score
+
+    def around(self, name: str, n: int = 5, which: str = 'all'):
+        which = board_id(which)
+        with self.db.read() as c:
+            r, _ = self._rank(c, which, name.lower())
+            if r is None:
+                return which, self._count(c, which), None, []
+            start = max(0, r - 1 - n)
+            return which, self._count(c, which), r, self._page(c, which, start, 2 * n + 1)
+
+    def legacy_top10(self):
+        # formatet spill.html forventer: alltid 10 plasser
+        with self.db.read() as c:
+            scores = [{ 'name': e['name'], 'score': e['score'] } for e in self._page(c, 'all', 0, 10)]
+        while len(scores) < 10:
+            scores.append(dict(EMPTY_ENTRY))
+        return scores
+
+    def snapshot(self):
+        # samme format som leaderboard.json
+        with self.db.read() as c:
+            boards = {}
+            for b, name, score, seq in c.execute('SELECT board, name, score, seq FROM scores ORDER BY board, seq'):
+                boards.setdefault(b, []).append([name, score, seq])
+            boards.setdefault('all', [])
+            return { 'seq': get_meta(c, 'seq', 0), 'boards': boards }
+
+    def load(self, c, snap: dict):
+        c.execute('DELETE FROM scores')
+        for b, rows in (snap.get('boards') or {}).items():
+            c.executemany('INSERT INTO scores (board, player, name, score, seq) VALUES (?, ?, ?, ?, ?)',
+                          [(b, name.lower(), name, int(score), int(seq)) for name, score, seq in rows])
+        set_meta(c, 'seq', int(snap.get('seq') or 0))
+
+    def compact(self, force: bool = False):
+        pass
+
+    def close(self):
+        self.db.close()
+
+
+def import_json(db: Database, db_path: Path, hints_path: Path, leaderboard_path: Path, highscores_path: Path = None,
+                only_if_empty: bool = False) -> bool:
+    """Les JSON-lagrene (med uavsluttede journalposter) og skriv dem inn i én transaksjon.
+
+    Med only_if_empty gjøres ingenting hvis databasen allerede har data (flere workere som starter samtidig).
+    """
+    store = FeatureStore(db_path)
+    try:
+        doc = store.to_db()
+    finally:
+        store.close()
+    hints = json.loads(HintsCatalog(hints_path).encode())
+    lb = Leaderboard(leaderboard_path, seed_path=highscores_path)
+    try:
+        with lb.lock:
+            lb.refresh()
+            snap = { 'seq': lb.seq, 'boards': { b: board.rows() for b, board in lb.boards.items() } }
+    finally:
+        lb.close()
+    with db.write() as c:
+        if only_if_empty and get_meta(c, 'db') is not None:
+            return False
+        SQLiteFeatureStore(db).load(c, doc, int(doc.get('revision') or 0))
+        SQLiteHints(db).load(c, hints)
+        SQLiteLeaderboard(db).load(c, snap)
+    return True
+
+
+def _export(path: Path, text: str):
+    # samme lås som JSON-lagrene; journalen tømmes så den ikke spilles av oppå den eksporterte filen
+    with FileLock(path.with_suffix('.lock')):
+        atomic_write_text(path, text)
+        journal = path.with_suffix('.journal')
+        if journal.exists():
+            Journal(journal).truncate()
+
+
+def export_json(db: Database, db_path: Path, hints_path: Path, leaderboard_path: Path):
+    """Skriv databasen, hint og topplisten tilbake som JSON-filer (statisk hosting, eller tilbake til STORE_BACKEND=json)."""
+    store, hints, lb = SQLiteFeatureStore(db), SQLiteHints(db), SQLiteLeaderboard(db)
+    with db.read():
+        doc = store.to_db()
+        hints_obj = json.loads(hints.encode())
+        snap = lb.snapshot()
+    _export(db_path, json.dumps(doc, ensure_ascii=False, indent=2))
+    _export(hints_path, json.dumps(hints_obj, ensure_ascii=False, indent=2))
+    _export(leaderboard_path, json.dumps(snap, ensure_ascii=False, separators=(',', ':')))
+    return len(doc['dataset']['features']), len(hints_obj.get('parks') or {}), len(snap['boards']['all'])
@@ -0,0 +1,27 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def park(fid, name, code, lon=10.0, lat=60.0):
+    # liten kvadratisk park-feature rundt (lon, lat)
+    d = 0.05
+    ring = [[lon - d, lat - d], [lon + d, lat - d], [lon + d, lat + d], [lon - d, lat + d], [lon - d, lat - d]]
+    return {
+        'type': 'Feature',
+        'properties': { 'id': fid, 'name': name, 'code': code, 'source': 'park' },
+        'geometry': { 'type': 'Polygon', 'coordinates': [ring] },
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / 'np_database.json'
+    feats = [park(1, 'Alfa', '101', 10.0, 60.0), park(2, 'Beta', '102', 11.0, 61.0), park(3, 'Gamma', '103', 8.0, 62.0)]
+    path.write_text(json.dumps({ 'dataset': { 'type': 'FeatureCollection', 'features': feats } }), encoding='utf-8')
+    return path
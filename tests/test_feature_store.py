@@ -0,0 +1,89 @@
+import json
+import multiprocessing
+
+import pytest
+
+from feature_store import Conflict, FeatureStore
+from conftest import park
+
+
+def test_replay_after_crash(db_path):
+    store = FeatureStore(db_path, compact_every=0)
+    store.update(1, { 'name': 'Alfa nasjonalpark' })
+    rev = store.update(2, { 'status': 'deleted' })
+    store.close()
+    # krasj midt i en append: halv linje uten linjeskift bakerst i journalen
+    journal = db_path.with_suffix('.journal')
+    with open(journal, 'ab') as f:
+        f.write(b'{"op":"update","id":3,"props":{"na')
+
+    store = FeatureStore(db_path, compact_every=0)
+    assert store.get(1)['properties']['name'] == 'Alfa nasjonalpark'
+    assert store.get(2)['properties']['status'] == 'deleted'
+    assert store.get(3)['properties']['name'] == 'Gamma'
+    assert store.revision == rev
+    # den halve posten er fjernet, så neste post havner på en egen linje
+    store.update(3, { 'name': 'Gamma 2' })
+    store.close()
+    assert all(json.loads(line) for line in journal.read_bytes().splitlines())
+    assert FeatureStore(db_path).get(3)['properties']['name'] == 'Gamma 2'
+
+
+def test_conditional_write_conflict(db_path):
+    store = FeatureStore(db_path)
+    store.refresh()
+    base = store.revision
+    store.update(1, { 'name': 'A' })
+    # feature 2 er ikke endret etter base, så skrivingen går gjennom
+    store.update(2, { 'name': 'B' }, base=base)
+    with pytest.raises(Conflict) as e:
+        store.update(1, { 'name': 'C' }, base=base)
+    assert e.value.revision == store.revision
+    assert store.get(1)['properties']['name'] == 'A'
+    with pytest.raises(Conflict):
+        store.replace(store.to_db(), base=base)
+
+
+def _insert(path, prefix, n):
+    store = FeatureStore(path)
+    for i in range(n):
+        store.apply_batch([{ 'op': 'insert', 'feature': park(None, f'{prefix}{i}', f'{prefix}{i}') }])
+    store.close()
+
+
+def test_cross_process_appends(db_path):
+    first = FeatureStore(db_path)
+    first.refresh()
+    start = first.revision
+    ctx = multiprocessing.get_context('spawn')
+    procs = [ctx.Process(target=_insert, args=(db_path, prefix, 20)) for prefix in ('x', 'y')]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    store = FeatureStore(db_path)
+    store.refresh()
+    names = { f['properties']['name'] for f in store.to_db()['dataset']['features'] }
+    assert { f'{p}{i}' for p in 'xy' for i in range(20) } <= names
+    assert len(store) == 3 + 40
+    assert store.revision == start + 40
+
+
+def test_replace_validates_before_writing(db_path):
+    store = FeatureStore(db_path)
+    before = db_path.read_bytes()
+    with pytest.raises(ValueError):
+        store.replace({ 'dataset': { 'features': [{ 'properties': 'x' }] } })
+    assert db_path.read_bytes() == before
+    assert len(store) == 3
+
+
+def test_duplicate_ids_get_new_ids(db_path):
+    db = json.loads(db_path.read_text(encoding='utf-8'))
+    db['dataset']['features'].append(park(2, 'Delta', '104'))
+    db_path.write_text(json.dumps(db), encoding='utf-8')
+    store = FeatureStore(db_path)
+    assert len(store) == 4
+    assert store.get(2)['properties']['name'] == 'Beta'
+    assert store.get(4)['properties']['name'] == 'Delta'
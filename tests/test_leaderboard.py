@@ -0,0 +1,40 @@
+from leaderboard import Leaderboard
+
+
+def make_board(tmp_path, scores):
+    lb = Leaderboard(tmp_path / 'leaderboard.json')
+    for name, score in scores:
+        lb.submit(name, score)
+    return lb
+
+
+def test_rank(tmp_path):
+    lb = make_board(tmp_path, [('ola', 10), ('kari', 30), ('per', 20), ('Ola', 40), ('per', 5)])
+    # beste score per navn, uten hensyn til store/små bokstaver
+    assert lb.rank('ola') == ('all', 3, 1, 40)
+    assert lb.rank('KARI') == ('all', 3, 2, 30)
+    assert lb.rank('per') == ('all', 3, 3, 20)
+    assert lb.rank('ingen') == ('all', 3, None, None)
+
+
+def test_equal_scores_keep_submission_order(tmp_path):
+    lb = make_board(tmp_path, [('a', 10), ('b', 10), ('c', 10)])
+    assert [e['name'] for e in lb.top(3)[2]] == ['a', 'b', 'c']
+
+
+def test_around(tmp_path):
+    lb = make_board(tmp_path, [(f'p{i}', i) for i in range(1, 21)])
+    board_id, total, rank, entries = lb.around('p10', n=2)
+    assert (board_id, total, rank) == ('all', 20, 11)
+    assert [(e['rank'], e['name']) for e in entries] == [(9, 'p12'), (10, 'p11'), (11, 'p10'), (12, 'p9'), (13, 'p8')]
+    # ved toppen starter vinduet på 1 og har fortsatt 2n + 1 plasser
+    assert [e['name'] for e in lb.around('p20', n=2)[3]] == ['p20', 'p19', 'p18', 'p17', 'p16']
+    assert [e['name'] for e in lb.around('p1', n=2)[3]] == ['p3', 'p2', 'p1']
+    assert lb.around('ingen') == ('all', 20, None, [])
+
+
+def test_survives_reopen(tmp_path):
+    make_board(tmp_path, [('ola', 10), ('kari', 30)]).close()
+    lb = Leaderboard(tmp_path / 'leaderboard.json')
+    assert lb.rank('ola')[2:] == (2, 10)
+    assert lb.submit('ola', 50) == (True, 1)
@@ -0,0 +1,74 @@
+import base64
+import json
+import random
+
+import pytest
+
+from quiz import QUIZ_FORMAT, QuizIndex
+
+
+@pytest.fixture
+def quiz(tmp_path):
+    parks = [{ 'key': f'k{i}', 'code': str(100 + i), 'name': f'Park {i}', 'areaKm2': 10 * (i + 1) } for i in range(8)]
+    distance = bytes(2 * len(parks) ** 2)
+    path = tmp_path / 'quiz_index.json'
+    path.write_text(json.dumps({ 'format': QUIZ_FORMAT, 'parks': parks, 'distanceKm': base64.b64encode(distance).decode('ascii') }))
+    return QuizIndex(path, b'secret')
+
+
+def test_answer(quiz):
+    q = quiz.next('medium', 4, rng=random.Random(1))
+    keys = [c['key'] for c in q['choices']]
+    results = [quiz.answer(q['token'], k) for k in keys]
+    # nøyaktig ett alternativ er riktig, og alle svarene peker på samme mål
+    assert sum(r['correct'] for r in results) == 1
+    assert len({ r['target']['key'] for r in results }) == 1
+    assert results[0]['target']['key'] in keys
+
+
+def test_token_does_not_name_the_target(quiz):
+    # samme mål og alternativer gir ulik posisjon i tokenet fra gang til gang
+    positions = set()
+    for _ in range(20):
+        body = json.loads(base64.urlsafe_b64decode(quiz._token(['a', 'b', 'c', 'd'], 0).split('.')[0] + '=='))
+        positions.add(body['p'])
+    assert len(positions) > 1
+
+
+def test_tampered_token(quiz):
+    q = quiz.next('easy', 4, rng=random.Random(2))
+    body, mac = q['token'].split('.')
+    obj = json.loads(base64.urlsafe_b64decode(body + '=='))
+    obj['p'] = (obj['p'] + 1) % len(obj['c'])
+    forged = base64.urlsafe_b64encode(json.dumps(obj).encode('utf-8')).decode('ascii').rstrip('=') + '.' + mac
+    with pytest.raises(ValueError, match='Invalid token'):
+        quiz.answer(forged, q['choices'][0]['key'])
+    with pytest.raises(ValueError, match='Invalid token'):
+        QuizIndex(quiz.path, b'other').answer(q['token'], q['choices'][0]['key'])
+    with pytest.raises(ValueError, match='Invalid token'):
+        quiz.answer('not-a-token', 'k0')
+
+
+def test_expired_token(quiz):
+    old = QuizIndex(quiz.path, quiz.secret, ttl=-1)
+    q = old.next('hard', 4, rng=random.Random(3))
+    with pytest.raises(ValueError, match='Expired token'):
+        quiz.answer(q['token'], q['choices'][0]['key'])
+
+
+def test_unknown_choice(quiz):
+    q = quiz.next('medium', 4, rng=random.Random(4))
+    other = next(f'k{i}' for i in range(8) if f'k{i}' not in { c['key'] for c in q['choices'] })
+    with pytest.raises(ValueError, match='Unknown choice'):
+        quiz.answer(q['token'], other)
+
+
+def test_round_tokens_are_separate(quiz):
+    token = quiz.round('k3')
+    assert quiz.round_target(token) == 'k3'
+    # et kartrunde-token er ikke et quiz-token, og omvendt
+    with pytest.raises(ValueError, match='Invalid token'):
+        quiz.answer(token, 'k3')
+    q = quiz.next('medium', 4, rng=random.Random(5))
+    with pytest.raises(ValueError, match='Invalid token'):
+        quiz.round_target(q['token'])
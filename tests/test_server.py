@@ -0,0 +1,78 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import ROOT
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def server(db_path):
+    port = free_port()
+    env = dict(os.environ, DATA_DIR=str(db_path.parent), PORT=str(port), HOST='127.0.0.1', QUIZ_SECRET='test')
+    proc = subprocess.Popen([sys.executable, str(ROOT / 'save_server.py')], cwd=str(ROOT), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 20
+    while True:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                break
+        except OSError:
+            if time.time() > deadline or proc.poll() is not None:
+                proc.kill()
+                pytest.fail('save_server.py did not start')
+            time.sleep(0.1)
+    yield url
+    proc.terminate()
+    proc.wait(10)
+
+
+def post(url, body, headers=None):
+    req = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), method='POST',
+                                 headers=dict({ 'Content-Type': 'application/json' }, **(headers or {})))
+    try:
+        with urllib.request.urlopen(req, timeout=10) as r:
+            return r.status, json.loads(r.read())
+    except urllib.error.HTTPError as e:
+        data = e.read()
+        try:
+            return e.code, json.loads(data)
+        except ValueError:
+            return e.code, data
+
+
+def test_update_conflict_is_409(server):
+    status, first = post(server + '/update', { 'id': 1, 'props': { 'name': 'A' } })
+    assert status == 200
+    base = first['revision']
+    status, second = post(server + '/update', { 'id': 1, 'props': { 'name': 'B' }, 'baseRevision': base })
+    assert status == 200
+    # feature 1 er endret etter base
+    status, body = post(server + '/update', { 'id': 1, 'props': { 'name': 'C' }, 'baseRevision': base })
+    assert status == 409
+    assert body == { 'ok': False, 'error': 'Conflict', 'revision': second['revision'] }
+    status, body = post(server + '/update', { 'id': 1, 'props': { 'name': 'C' } }, { 'If-Match': f'"{base}"' })
+    assert status == 409
+    # en annen feature kan fortsatt skrives mot den gamle revisjonen
+    status, _ = post(server + '/update', { 'id': 2, 'props': { 'name': 'D' }, 'baseRevision': base })
+    assert status == 200
+
+
+def test_save_db_rejects_invalid_document(server, db_path):
+    before = db_path.read_bytes()
+    status, _ = post(server + '/save-db', { 'dataset': { 'features': 'x' } })
+    assert status == 400
+    assert db_path.read_bytes() == before
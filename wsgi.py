@@ -0,0 +1,127 @@
+"""WSGI-app for save_server.py, f.eks. `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+Rutene er de samme som i save_server.Handler; WSGIHandler erstatter bare socket-delen.
+Hver worker-prosess har sin egen kopi av lagrene i minnet og holder seg oppdatert via
+journalene, med flock rundt alle skrivinger (se journal.JournaledStore).
+"""
+import io
+import os
+import threading
+import time
+from http.client import HTTPMessage
+
+import save_server
+from save_server import Handler, LOG
+
+# headere som gjelder selve forbindelsen; dem setter WSGI-serveren
+HOP_BY_HOP = frozenset(('connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                        'te', 'trailers', 'transfer-encoding', 'upgrade'))
+
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def request_headers(environ) -> HTTPMessage:
+    headers = HTTPMessage()
+    for k, v in environ.items():
+        if k.startswith('HTTP_'):
+            headers[k[5:].replace('_', '-').title()] = v
+    for k in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        if environ.get(k):
+            headers[k.replace('_', '-').title()] = environ[k]
+    return headers
+
+
+class WSGIHandler(Handler):
+    # ingen PooledHTTPServer; køen foran workerne er gunicorns
+    server = None
+
+    # BaseHTTPRequestHandler.__init__ kalles ikke: det er ingen socket å lese forespørselen fra
+    def __init__(self, environ):
+        self.environ = environ
+        self.command = environ['REQUEST_METHOD']
+        qs = environ.get('QUERY_STRING')
+        self.path = (environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')) or '/'
+        if qs:
+            self.path += '?' + qs
+        self.request_version = environ.get('SERVER_PROTOCOL', 'HTTP/1.1')
+        self.headers = request_headers(environ)
+        self.rfile = environ['wsgi.input']
+        self.wfile = io.BytesIO()
+        self.client_address = (environ.get('REMOTE_ADDR', ''), 0)
+        self.close_connection = False
+        self._headers_buffer = []
+        self.status = None
+        self.response_headers = []
+        self.body = None
+
+    def send_response(self, code, message=None):
+        self._status = code
+        self.status = f"{code} {message or self.responses.get(code, ('',))[0]}"
+
+    def send_header(self, keyword, value):
+        if keyword.lower() not in HOP_BY_HOP:
+            self.response_headers.append((keyword, str(value)))
+
+    def flush_headers(self):
+        self._headers_buffer = []
+
+    def reply_stream(self, chunks, content_type='application/json'):
+        # WSGI-serveren står for chunked-innkapslingen
+        self.body = self.start_stream(chunks, content_type)
+
+    def run(self):
+        self._t0 = time.perf_counter()
+        self._status = 0
+        self._sent = 0
+        method = getattr(self, 'do_' + self.command, None)
+        try:
+            if method is None:
+                self.reply(501, b'Unsupported method')
+            else:
+                method()
+        except Exception:
+            LOG.exception('request failed: method=%s path=%s', self.command, self.path)
+            self.response_headers = []
+            self.body = None
+            self.wfile = io.BytesIO()
+            self.reply(500, b'Internal error')
+
+    def stream_body(self):
+        # måles når siste bit er sendt
+        try:
+            for data in self.body:
+                self._sent += len(data)
+                yield data
+        finally:
+            self.record_request()
+
+
+def start_background():
+    # kompaktering i hver worker, startet etter fork (også med --preload)
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid != os.getpid():
+            save_server.start_background()
+            _started_pid = os.getpid()
+
+
+def app(environ, start_response):
+    start_background()
+    h = WSGIHandler(environ)
+    h.run()
+    start_response(h.status or '500 Internal Server Error', h.response_headers)
+    if h.body is not None:
+        return h.stream_body()
+    h.record_request()
+    return [h.wfile.getvalue()]
+
+
+def shutdown():
+    save_server.close_stores()
+
+
+application = app
+save_server.setup_logging()